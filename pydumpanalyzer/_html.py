@@ -1,5 +1,7 @@
 ''' this is the home for various html helpers '''
 
+import html
+
 from utility import getUniqueId
 from csmlog_setup import getLogger
 
@@ -22,6 +24,20 @@ def getDropLeft(title, textCommaLinks):
     </div>
     ''' % (title, ('\n'.join([('<a class="dropdown-item" href="%s">%s</a>' % (val[1], val[0])) for val in textCommaLinks])))
 
+def getFilterForm(fields, values=None, classes=None):
+    ''' returns text for a GET form with a text input per (field name, placeholder) tuple in fields.
+    values can be a dict of field name -> value to fill the inputs in with '''
+    values = values if values is not None else {}
+    inputs = '\n'.join([('<input name="%s" type="text" placeholder="%s" value="%s">' % (name, placeholder, html.escape(values.get(name, ''), quote=True))) for name, placeholder in fields])
+    return FILTER_FORM.format(inputs=inputs, classes=classes if classes is not None else '')
+
+FILTER_FORM = '''
+<form method="get" class="{classes}">
+{inputs}
+<input type="submit" value="Filter">
+</form>
+'''
+
 SEARCH_CODE = '''
 <script src="https://ajax.googleapis.com/ajax/libs/jquery/3.4.1/jquery.min.js"></script>
 <script>
@@ -53,8 +69,10 @@ TABLE_CONTENT = '''
 FULL_CONTENT = '''
 <h2 class="{classes}">{name}</h2>
 <div class="{classes}" style="border: 1px solid black;">
+{header}
 {searchCode}
 {tableContent}
+{footer}
 </div>
 '''
 
@@ -69,6 +87,10 @@ class HtmlTable(object):
         self.id = getUniqueId()
         self.rows = []
 
+        # optional extra html to show above/below the table (filters, page links, etc.)
+        self.header = ''
+        self.footer = ''
+
     @classmethod
     def fromCursor(cls, cursor, name=None, addSearch=True, classes=None):
         ''' helper to get an HtmlTable from a database cursor '''
@@ -150,7 +172,7 @@ class HtmlTable(object):
 
         tableContent = TABLE_CONTENT.format(id=self.id, rows=rowText, headers=headerText, classes=self.classes)
 
-        retStr = FULL_CONTENT.format(classes=self.classes, searchCode=searchCode, tableContent=tableContent, name=self.name)
+        retStr = FULL_CONTENT.format(classes=self.classes, searchCode=searchCode, tableContent=tableContent, name=self.name, header=self.header, footer=self.footer)
         return retStr
 
 
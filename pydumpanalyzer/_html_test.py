@@ -133,4 +133,19 @@ def test_add_column():
     assert len(h.tableHeaders) == 4
     assert h.tableHeaders[-1] == 'D'
     for i in h.rows:
-        assert len(i) == 4
\ No newline at end of file
+        assert len(i) == 4
+
+def test_filter_form():
+    ''' ensures getFilterForm gives an input per field and fills in (escaped) values '''
+    txt = getFilterForm([('Tag', 'Tag...'), ('Other', 'Other...')], {'Tag' : '"><b>'})
+    assert txt.count('<input name=') == 2
+    assert 'placeholder="Other..." value=""' in txt
+    assert 'value="&quot;&gt;&lt;b&gt;"' in txt
+
+def test_header_and_footer():
+    ''' ensures header/footer html is shown around the table '''
+    table = HtmlTable(['A', 'B', 'C'])
+    table.header = '<p>TheHeader</p>'
+    table.footer = '<p>TheFooter</p>'
+    txt = table.__html__()
+    assert txt.index('TheHeader') < txt.index('<table') < txt.index('TheFooter')
@@ -1,5 +1,6 @@
 ''' home to the abstract database class which is used for working with the a sqlite3 database '''
 import collections
+import functools
 import os
 import sqlite3
 import threading
@@ -10,11 +11,15 @@ logger = getLogger(__file__)
 
 Column = collections.namedtuple('Column', ['Name', 'Type'])
 
+@functools.lru_cache(maxsize=1024)
+def _getRowClass(fields):
+    """ Returns the named tuple class for rows with the given (tuple of) field names.
+    Making a namedtuple class is slow, so this is only done once per distinct set of fields. """
+    return collections.namedtuple("Row", fields)
+
 def _rowToNamedTuple(cursor, row):
     """ Returns sqlite rows as named tuples """
-    fields = [col[0] for col in cursor.description]
-    Row = collections.namedtuple("Row", fields)
-    return Row(*row)
+    return _getRowClass(tuple([col[0] for col in cursor.description]))._make(row)
 
 class SqlStatementUnsafeException(Exception):
     ''' exception to say the query did not look safe to execute '''
@@ -27,12 +32,32 @@ class AbstractDatabase(object):
 
     _LOCK = threading.Lock() # lock for async access
 
-    def __init__(self, databaseFile=':memory:', commitOnClose=True):
+    # how long to wait on another connection's lock before giving up
+    BUSY_TIMEOUT_SECONDS = 60
+
+    # max number of idle connections kept (per database file) when using pooled connections
+    MAX_POOLED_CONNECTIONS = 8
+
+    _POOL = {} # database file -> list of idle connections
+    _POOL_LOCK = threading.Lock()
+    _POOL_PID = os.getpid()
+
+    # connections inherited over a fork. sqlite connections must not be used (or closed) in a forked child,
+    #  so they are just kept referenced here.
+    _FORKED_CONNECTIONS = []
+
+    def __init__(self, databaseFile=':memory:', commitOnClose=True, pragmas=None, pooled=False, immediate=False):
         ''' initializer, takes in the location of the database. By default it is :memory:
-        Optionally, the user can choose to commit on closing this or not at all. '''
+        Optionally, the user can choose to commit on closing this or not at all.
+        pragmas is a dict of PRAGMA name -> value to apply to each new connection.
+        If pooled is True, connections are handed back to a per-process pool on close() and reused by later open()s.
+        If immediate is True, the transaction takes the database's write lock up front (BEGIN IMMEDIATE) instead of on the first write. '''
         self.databaseFile = databaseFile
         self.database = None
         self.commitOnClose = commitOnClose
+        self.pragmas = pragmas if pragmas is not None else {}
+        self.pooled = pooled
+        self.immediate = immediate
 
     def __enter__(self):
         ''' called when entering via a context manager '''
@@ -45,22 +70,88 @@ class AbstractDatabase(object):
         self.close()
         AbstractDatabase._LOCK.release()
 
+    def _connect(self):
+        ''' makes a new connection to the database with our pragmas applied '''
+        connection = sqlite3.connect(self.databaseFile, isolation_level=None, timeout=self.BUSY_TIMEOUT_SECONDS, check_same_thread=not self.pooled)
+        connection.row_factory = _rowToNamedTuple
+        for name, value in self.pragmas.items():
+            connection.execute('PRAGMA %s = %s' % (name, value))
+
+        return connection
+
+    @classmethod
+    def _getPooledConnection(cls, databaseFile):
+        ''' takes an idle connection out of the pool (or returns None if there isn't one) '''
+        with cls._POOL_LOCK:
+            if cls._POOL_PID != os.getpid():
+                cls._FORKED_CONNECTIONS.extend(c for connections in cls._POOL.values() for c in connections)
+                cls._POOL.clear()
+                cls._POOL_PID = os.getpid()
+
+            connections = cls._POOL.get(databaseFile)
+            if connections:
+                return connections.pop()
+
+        return None
+
+    @classmethod
+    def _returnPooledConnection(cls, databaseFile, connection):
+        ''' gives a connection back to the pool. Returns False if the pool is full (the caller should close it) '''
+        with cls._POOL_LOCK:
+            connections = cls._POOL.setdefault(databaseFile, [])
+            if cls._POOL_PID != os.getpid() or len(connections) >= cls.MAX_POOLED_CONNECTIONS:
+                return False
+
+            connections.append(connection)
+            return True
+
+    @classmethod
+    def closePooledConnections(cls, databaseFile=None):
+        ''' closes idle pooled connections to the given database file (or all of them if not given).
+        Should be called before deleting/replacing a database file. '''
+        with cls._POOL_LOCK:
+            databaseFiles = [databaseFile] if databaseFile is not None else list(cls._POOL.keys())
+            for d in databaseFiles:
+                for connection in cls._POOL.pop(d, []):
+                    connection.close()
+
     def open(self):
         ''' opens the connection to the database '''
-        self.database = sqlite3.connect(self.databaseFile, isolation_level=None)
-        self.database.row_factory = _rowToNamedTuple
+        self.database = self._getPooledConnection(self.databaseFile) if self.pooled else None
+        if self.database is None:
+            self.database = self._connect()
 
         # at this point we own the responsibility of commiting on our own since
         #  we are in our own transaction.
-        self.execute('BEGIN')
+        self.begin()
+
+    def begin(self):
+        ''' begins a transaction (taking the write lock up front if immediate) '''
+        self.execute('BEGIN IMMEDIATE' if self.immediate else 'BEGIN')
+
+    def commit(self, begin=True):
+        ''' commits the current transaction (making it visible to other connections and releasing our locks).
+        If begin is True, a new transaction is begun right after (like open() does). Otherwise each statement commits on its own until begin() is called. '''
+        self.database.commit()
+        if begin:
+            self.begin()
 
     def close(self):
-        ''' closes the connect to the database '''
+        ''' closes the connect to the database (or gives it back to the pool if pooled).
+        If the commit (or rollback) fails, the connection is closed rather than pooled, then the exception is raised. '''
         if self.database:
-            if self.commitOnClose:
-                self.database.commit()
-            self.database.close()
-            self.database = None
+            connection, self.database = self.database, None
+            pooled = False
+            try:
+                if self.commitOnClose:
+                    connection.commit()
+                elif self.pooled:
+                    connection.rollback()
+
+                pooled = self.pooled and self._returnPooledConnection(self.databaseFile, connection)
+            finally:
+                if not pooled:
+                    connection.close()
 
     @classmethod
     def _ensureSqlStatementSafe(cls, sqlStatement):
@@ -105,18 +196,42 @@ class AbstractDatabase(object):
         ''' returns true if the given table exists '''
         return bool(self.execute("PRAGMA table_info('%s')" % tableName).fetchall())
 
-    def createTable(self, tableName, columns):
-        ''' creates the given table with the given columns. The columns should be a list of Column tuples.'''
+    def createTable(self, tableName, columns, uniqueIndexes=None, indexes=None):
+        ''' creates the given table with the given columns. The columns should be a list of Column tuples.
+        Optionally uniqueIndexes/indexes can be lists of column names (or tuples of column names) to index. '''
         sqlStatement = 'CREATE TABLE {tableName} (IdKey INTEGER PRIMARY KEY AUTOINCREMENT, '.format(tableName=tableName)
         for col in columns:
             sqlStatement += ('%s %s,' % (col.Name, col.Type))
 
         sqlStatement = sqlStatement.rstrip(', ') + ")"
 
+        return self.booleanExecute(sqlStatement) and self._createIndexes(tableName, uniqueIndexes, indexes)
+
+    def createIndex(self, tableName, columnNames, unique=False):
+        ''' creates an index (if it doesn't already exist) on the given column name (or tuple of column names) of the given table '''
+        if isinstance(columnNames, str):
+            columnNames = (columnNames,)
+
+        sqlStatement = 'CREATE {unique}INDEX IF NOT EXISTS `{indexName}` ON `{tableName}` ({columns})'.format(
+            unique='UNIQUE ' if unique else '',
+            indexName='index_%s_%s' % (tableName, '_'.join(columnNames)),
+            tableName=tableName,
+            columns=','.join('`%s`' % c for c in columnNames)
+        )
         return self.booleanExecute(sqlStatement)
 
-    def ensureTableHasAtLeastTheseColumns(self, tableName, columns):
-        ''' goes to a given table and ensures that the given columns (list of Column) exist in the given table '''
+    def _createIndexes(self, tableName, uniqueIndexes, indexes):
+        ''' creates the given unique indexes then (non-unique) indexes on the given table. Returns False on the first failure. '''
+        for columnNames, unique in [(i, True) for i in (uniqueIndexes or [])] + [(i, False) for i in (indexes or [])]:
+            if not self.createIndex(tableName, columnNames, unique=unique):
+                logger.error("Failed to add index on: %s" % str(columnNames))
+                return False
+
+        return True
+
+    def ensureTableHasAtLeastTheseColumns(self, tableName, columns, uniqueIndexes=None, indexes=None):
+        ''' goes to a given table and ensures that the given columns (list of Column) exist in the given table.
+        Optionally uniqueIndexes/indexes can be lists of column names (or tuples of column names) that should be indexed. '''
         tableInfo = self.getTableInfo(tableName)
         if not tableInfo:
             logger.error("Could not get table info for table: %s" % tableName)
@@ -133,7 +248,7 @@ class AbstractDatabase(object):
                     logger.error("Failed to add column: %s!" % (col.Name))
                     return False
 
-        return True
+        return self._createIndexes(tableName, uniqueIndexes, indexes)
 
     def addRow(self, tableName, rowAsDict):
         ''' adds the given dict of column name -> value to the given table '''
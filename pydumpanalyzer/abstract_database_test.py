@@ -1,11 +1,13 @@
 ''' this file contains tests for the abstract_database module '''
 
 import os
+import sqlite3
 import unittest
+import unittest.mock
 
 import pytest
 
-from abstract_database import AbstractDatabase, Column, SqlStatementUnsafeException
+from abstract_database import AbstractDatabase, Column, SqlStatementUnsafeException, _getRowClass
 from csmlog_setup import getLogger
 
 logger = getLogger(__file__)
@@ -55,6 +57,30 @@ class TestAbstractDatabase(unittest.TestCase):
 
         assert self.database.execute('SELECT * FROM MYTABLE').fetchall()[0].ColumnName == 'ColumnData'
 
+    def test_row_class_is_reused(self):
+        ''' ensure rows come back as named tuples and the row class is only made once per set of columns '''
+        assert self.database.createTable('MyTable', [
+            Column("ColumnName", "TEXT"),
+            Column("Number", "INT"),
+        ])
+        for i in range(10):
+            assert self.database.addRow('MyTable', {"ColumnName" : "Data%d" % i, "Number" : i})
+
+        rows = self.database.execute('SELECT * FROM MyTable').fetchall()
+        assert len(set(type(row) for row in rows)) == 1
+        assert rows[3].ColumnName == 'Data3'
+        assert rows[3].Number == 3
+        assert rows[3] == (4, 'Data3', 3)
+
+        hits = _getRowClass.cache_info().hits
+        self.database.execute('SELECT * FROM MyTable').fetchall()
+        assert _getRowClass.cache_info().hits == hits + 10
+
+        # different columns get a different row type
+        row = self.database.execute('SELECT Number FROM MyTable').fetchone()
+        assert row.Number == 0
+        assert not hasattr(row, 'ColumnName')
+
     def test_ensure_has_columns(self):
         ''' ensure we can add columns if needed '''
 
@@ -83,6 +109,34 @@ class TestAbstractDatabase(unittest.TestCase):
             Column('TextColumn3', "INT"), # wrong type!
         ])
 
+    def test_indexes(self):
+        ''' ensure we can declare unique and regular indexes '''
+        assert self.database.createTable('MyTable', [
+            Column("Key", "TEXT"),
+            Column("Other", "TEXT"),
+        ], uniqueIndexes=['Key'], indexes=[('Other', 'Key')])
+
+        indexes = {row.name : row.unique for row in self.database.execute("PRAGMA index_list('MyTable')").fetchall()}
+        assert indexes == {'index_MyTable_Key' : 1, 'index_MyTable_Other_Key' : 0}
+
+        assert self.database.addRow('MyTable', {'Key' : 'A'})
+        assert not self.database.addRow('MyTable', {'Key' : 'A'})
+
+        plan = self.database.execute("EXPLAIN QUERY PLAN SELECT * FROM MyTable WHERE Key = ?", ['A']).fetchall()
+        assert 'index_MyTable_Key' in str(plan)
+
+        # can be added later too (and it is fine if they already exist)
+        assert self.database.ensureTableHasAtLeastTheseColumns('MyTable', [
+            Column("Key", "TEXT"),
+            Column("Third", "TEXT"),
+        ], uniqueIndexes=['Key', 'Third'])
+        assert len(self.database.execute("PRAGMA index_list('MyTable')").fetchall()) == 3
+
+        # can't add a unique index if there is duplicate data
+        assert self.database.addRow('MyTable', {'Key' : 'B', 'Other' : 'Dup'})
+        assert self.database.addRow('MyTable', {'Key' : 'C', 'Other' : 'Dup'})
+        assert not self.database.createIndex('MyTable', 'Other', unique=True)
+
     def test_ensure_commit_on_close_works(self):
         ''' ensure commitOnClose works '''
         TEST_DB_FILE = os.path.join(os.path.dirname(__file__), 'test_db.sqlite')
@@ -136,6 +190,121 @@ class TestAbstractDatabase(unittest.TestCase):
 
         os.remove(TEST_DB_FILE)
 
+    def test_pooled_connections_are_reused(self):
+        ''' ensures pooled connections go back to the pool on close() and are reused by the next open() '''
+        TEST_DB_FILE = os.path.join(os.path.dirname(__file__), 'test_db_pool.sqlite')
+        AbstractDatabase.closePooledConnections(TEST_DB_FILE)
+        if os.path.isfile(TEST_DB_FILE):
+            os.remove(TEST_DB_FILE)
+
+        first = AbstractDatabase(TEST_DB_FILE, pooled=True)
+        first.open()
+        connection = first.database
+
+        # a second user while the first is open gets its own connection
+        second = AbstractDatabase(TEST_DB_FILE, pooled=True)
+        second.open()
+        assert second.database is not connection
+        second.close()
+        first.close()
+
+        third = AbstractDatabase(TEST_DB_FILE, pooled=True)
+        third.open()
+        assert third.database in (connection, second.database)
+        third.close()
+
+        AbstractDatabase.closePooledConnections(TEST_DB_FILE)
+        os.remove(TEST_DB_FILE)
+
+    def test_failed_commit_on_close_still_releases_connection(self):
+        ''' ensures a connection whose commit fails on close() is closed instead of leaked (or pooled) '''
+        TEST_DB_FILE = os.path.join(os.path.dirname(__file__), 'test_db_pool.sqlite')
+        AbstractDatabase.closePooledConnections(TEST_DB_FILE)
+
+        database = AbstractDatabase(TEST_DB_FILE, pooled=True)
+        database.open()
+        connection = database.database
+        database.database = unittest.mock.Mock(wraps=connection)
+        database.database.commit.side_effect = sqlite3.OperationalError('disk I/O error')
+        mockConnection = database.database
+
+        with pytest.raises(sqlite3.OperationalError):
+            database.close()
+        assert database.database is None
+        mockConnection.close.assert_called_once()
+        assert mockConnection not in AbstractDatabase._POOL.get(TEST_DB_FILE, [])
+
+        AbstractDatabase.closePooledConnections(TEST_DB_FILE)
+        os.remove(TEST_DB_FILE)
+
+    def test_pragmas_and_immediate(self):
+        ''' ensures pragmas are applied to connections and immediate takes the write lock up front '''
+        TEST_DB_FILE = os.path.join(os.path.dirname(__file__), 'test_db_pragmas.sqlite')
+        if os.path.isfile(TEST_DB_FILE):
+            os.remove(TEST_DB_FILE)
+
+        writer = AbstractDatabase(TEST_DB_FILE, pragmas={'journal_mode' : 'WAL', 'synchronous' : 'NORMAL', 'cache_size' : -1000}, immediate=True)
+        writer.open()
+        assert writer.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+        assert writer.execute('PRAGMA synchronous').fetchone()[0] == 1
+        assert writer.execute('PRAGMA cache_size').fetchone()[0] == -1000
+        assert writer.createTable('MyTable', [Column("TextColumn1", "TEXT")])
+
+        # with WAL, a reader isn't blocked by the open write transaction (and doesn't see it yet)
+        reader = AbstractDatabase(TEST_DB_FILE)
+        reader.open()
+        assert not reader.tableExists('MyTable')
+        reader.close()
+
+        # but a second writer can't get the write lock
+        otherWriter = AbstractDatabase(TEST_DB_FILE, immediate=True)
+        otherWriter.BUSY_TIMEOUT_SECONDS = 0
+        with pytest.raises(sqlite3.OperationalError):
+            otherWriter.open()
+        otherWriter.close()
+
+        writer.close()
+        os.remove(TEST_DB_FILE)
+
+    def test_commit(self):
+        ''' ensures commit() makes changes visible and releases the write lock (and can begin again after) '''
+        TEST_DB_FILE = os.path.join(os.path.dirname(__file__), 'test_db_commit.sqlite')
+        if os.path.isfile(TEST_DB_FILE):
+            os.remove(TEST_DB_FILE)
+
+        writer = AbstractDatabase(TEST_DB_FILE, pragmas={'journal_mode' : 'WAL'}, immediate=True)
+        writer.open()
+        assert writer.createTable('MyTable', [Column("TextColumn1", "TEXT")])
+        writer.commit(begin=False)
+
+        # without a transaction, another writer can get in
+        otherWriter = AbstractDatabase(TEST_DB_FILE, immediate=True)
+        otherWriter.BUSY_TIMEOUT_SECONDS = 0
+        otherWriter.open()
+        assert otherWriter.tableExists('MyTable')
+        assert otherWriter.addRow('MyTable', {'TextColumn1' : 'MyText'})
+        otherWriter.close()
+
+        # and we see what it did. Then we can have the write lock back.
+        assert len(writer.execute("SELECT * FROM MyTable").fetchall()) == 1
+        writer.begin()
+        assert writer.addRow('MyTable', {'TextColumn1' : 'MyText2'})
+        writer.commit()
+
+        otherWriter = AbstractDatabase(TEST_DB_FILE, immediate=True)
+        otherWriter.BUSY_TIMEOUT_SECONDS = 0
+        with pytest.raises(sqlite3.OperationalError):
+            otherWriter.open()
+        otherWriter.close()
+
+        writer.commitOnClose = False
+        writer.close()
+
+        with AbstractDatabase(TEST_DB_FILE) as reader:
+            assert len(reader.execute("SELECT * FROM MyTable").fetchall()) == 2
+
+        os.remove(TEST_DB_FILE)
+
     def test_database_as_contextmanager(self):
         ''' makes sure the context manager usage works '''
         with AbstractDatabase(':memory:') as m:
@@ -0,0 +1,165 @@
+''' this file is home to the background workers that analyze crash dumps from the analysis job queue (see Storage.enqueueAnalysis()).
+Running this file runs a pool of them. The flask app only starts a pool when run directly (see its --analysis-workers), so when it is
+served by a WSGI server, run this file (once per database) alongside it or queued crash dumps won't be analyzed. '''
+
+import argparse
+import multiprocessing
+import os
+import platform
+import traceback
+
+from csmlog_setup import enableConsoleLogging, getLogger
+from storage import Storage
+from utility import callEvery
+
+# number of worker processes in a pool if not told otherwise
+DEFAULT_POOL_SIZE = 2
+
+# how long an idle worker waits before checking the queue again
+DEFAULT_POLL_INTERVAL_SECONDS = 1
+
+# how often a worker records that it is alive (see Storage.getLiveAnalysisWorkerCount()). Done on its own thread, so it keeps
+#  happening while the worker runs a long analysis.
+HEARTBEAT_INTERVAL_SECONDS = 5
+
+logger = getLogger(__file__)
+
+class AnalysisWorker(object):
+    ''' claims jobs from the analysis job queue, runs the debugger on each job's crash dump, then saves the Analysis back.
+    The debugger is run without a Storage open, so nothing waits on it. '''
+    def __init__(self, storageClass=Storage, workerId=None):
+        ''' initializer takes in the Storage class to use and an id for this worker (recorded on the jobs it claims) '''
+        self.storageClass = storageClass
+        self.workerId = workerId or '%s:%d' % (platform.node(), os.getpid())
+
+    def runOnce(self):
+        ''' claims and works a single job. Returns the finished job's row, or None if nothing was queued '''
+        with self.storageClass() as storage:
+            job = storage.claimAnalysisJob(self.workerId)
+        if job is None:
+            return None
+
+        logger.info("Worker %s running analysis job %d: %s / %s" % (self.workerId, job.IdKey, job.ApplicationName, job.RowUid))
+
+        analysis = None
+        error = None
+        try:
+            with self.storageClass(readOnly=True) as storage:
+                analysisInputs = storage.getAnalysisInputs(job.ApplicationName, job.RowUid)
+
+            with self.storageClass.analysisJobHeartbeat(job.IdKey, self.workerId):
+                analysis = self.storageClass.generateAnalysis(*analysisInputs)
+        except Exception:
+            error = traceback.format_exc()
+            logger.error("Analysis job %d failed: %s" % (job.IdKey, error))
+
+        with self.storageClass() as storage:
+            # the job is requeued (and can be claimed by someone else) if our heartbeats stopped for too long. Then it isn't ours to finish.
+            if not storage.isAnalysisJobClaimedBy(job.IdKey, self.workerId):
+                logger.warning("Analysis job %d isn't claimed by worker %s anymore, dropping its result" % (job.IdKey, self.workerId))
+            else:
+                if analysis is not None and not storage.saveAnalysis(job.ApplicationName, job.RowUid, analysis):
+                    error = "Failed to save the analysis"
+
+                storage.finishAnalysisJob(job.IdKey, self.workerId, error)
+
+            storage.addProcessStatistics()
+            return storage.database.execute("SELECT * FROM AnalysisJobs WHERE IdKey = ?", [job.IdKey]).fetchone()
+
+    def recordHeartbeat(self):
+        ''' records that this worker is alive '''
+        with self.storageClass() as storage:
+            storage.recordAnalysisWorkerHeartbeat(self.workerId)
+
+    def runForever(self, stopEvent, pollInterval=DEFAULT_POLL_INTERVAL_SECONDS):
+        ''' works jobs until the given (threading or multiprocessing) Event is set. Waits pollInterval seconds between checks when idle.
+        Records a heartbeat every HEARTBEAT_INTERVAL_SECONDS the whole time. '''
+        with callEvery(self.recordHeartbeat, HEARTBEAT_INTERVAL_SECONDS):
+            while not stopEvent.is_set():
+                try:
+                    if self.runOnce() is None:
+                        stopEvent.wait(pollInterval)
+                except Exception:
+                    logger.error("Worker %s hit an error: %s" % (self.workerId, traceback.format_exc()))
+                    stopEvent.wait(pollInterval)
+
+        with self.storageClass() as storage:
+            storage.removeAnalysisWorker(self.workerId)
+
+def _runWorkerProcess(storageClass, stopEvent, pollInterval):
+    ''' the entry point of each process in an AnalysisWorkerPool '''
+    AnalysisWorker(storageClass).runForever(stopEvent, pollInterval)
+
+class AnalysisWorkerPool(object):
+    ''' a pool of processes, each running an AnalysisWorker. Can be used as a context manager.
+    Jobs left running by workers that went away are requeued (see Storage.requeueStaleAnalysisJobs()). '''
+    def __init__(self, poolSize=DEFAULT_POOL_SIZE, storageClass=Storage, pollInterval=DEFAULT_POLL_INTERVAL_SECONDS):
+        ''' initializer takes in the number of worker processes, the Storage class to use and how often idle workers check the queue '''
+        if poolSize < 1:
+            raise ValueError("poolSize must be at least 1, not %d" % poolSize)
+
+        self.poolSize = poolSize
+        self.storageClass = storageClass
+        self.pollInterval = pollInterval
+        self._stopEvent = None
+        self._processes = []
+
+    def __enter__(self):
+        ''' called when entering via a context manager '''
+        self.start()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        ''' called when exiting via a context manager '''
+        self.stop()
+
+    def start(self):
+        ''' starts the worker processes '''
+        if self._processes:
+            raise RuntimeError("Pool is already started")
+
+        self.storageClass.migrate()
+        with self.storageClass() as storage:
+            storage.requeueStaleAnalysisJobs()
+
+        self._stopEvent = multiprocessing.Event()
+        for i in range(self.poolSize):
+            process = multiprocessing.Process(target=_runWorkerProcess, args=(self.storageClass, self._stopEvent, self.pollInterval),
+                                              name='AnalysisWorker-%d' % i, daemon=True)
+            process.start()
+            self._processes.append(process)
+
+        logger.info("Started %d analysis worker(s)" % self.poolSize)
+
+    def stop(self, timeout=30):
+        ''' tells the worker processes to stop after their current job, then waits (up to timeout seconds each) for them.
+        Any that don't stop in time are terminated (their jobs are requeued once their heartbeats go stale). '''
+        if not self._processes:
+            return
+
+        self._stopEvent.set()
+        for process in self._processes:
+            process.join(timeout)
+            if process.is_alive():
+                logger.warning("Terminating analysis worker that didn't stop: %s" % process.name)
+                process.terminate()
+                process.join()
+
+        self._processes = []
+
+    def isRunning(self):
+        ''' returns True if the pool is started '''
+        return bool(self._processes)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Runs a pool of workers to analyze queued crash dumps')
+    parser.add_argument('-p', '--pool-size', type=int, default=DEFAULT_POOL_SIZE, help='number of worker processes')
+    parser.add_argument('-i', '--poll-interval', type=float, default=DEFAULT_POLL_INTERVAL_SECONDS, help='seconds between queue checks when idle')
+    args = parser.parse_args()
+
+    enableConsoleLogging()
+    with AnalysisWorkerPool(args.pool_size, pollInterval=args.poll_interval) as pool:
+        try:
+            multiprocessing.Event().wait()
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,166 @@
+''' home to tests for the analysis workers '''
+import io
+import threading
+import time
+import unittest.mock
+
+import pytest
+
+from analysis_worker import AnalysisWorker, AnalysisWorkerPool
+from debugger import Debugger
+from stack import Stack
+from storage import AnalysisJobStatus
+from storage_test import MockRequest, Storage
+
+class _FakeDebugger(Debugger):
+    ''' a debugger that doesn't need any debugging tools. Its raw analysis is the crash dump's contents. '''
+    def getStackTrace(self):
+        return Stack([], 0)
+
+    def getRawAnalysis(self):
+        with open(self.crashDump, 'r') as f:
+            return f.read()
+
+class _BrokenDebugger(Debugger):
+    ''' a debugger that always fails '''
+    def getStackTrace(self):
+        raise RuntimeError("The debugger broke")
+
+class _FakeDebuggerStorage(Storage):
+    ''' test storage that analyzes with _FakeDebugger '''
+    DEBUGGERS = {
+        'Windows' : _FakeDebugger,
+    }
+
+class _BrokenDebuggerStorage(Storage):
+    ''' test storage that analyzes with _BrokenDebugger '''
+    DEBUGGERS = {
+        'Windows' : _BrokenDebugger,
+    }
+
+def _addCrashDumps(count):
+    ''' adds count crash dumps to storage, returning their uids '''
+    uids = []
+    with Storage() as s:
+        for i in range(count):
+            request = MockRequest({
+                'CrashDumpFile' : io.BytesIO(b'crash dump %d' % i),
+            }, {
+                'Application' : 'MyApp',
+                'OperatingSystem' : 'Windows',
+            })
+            uids.append(s.addFromAddRequest(request).split('UID:')[-1].strip())
+
+    return uids
+
+def setup_function(function):
+    ''' called at the start of all tests '''
+    Storage.removeDatabase()
+
+def test_run_once_with_empty_queue():
+    ''' ensures a worker does nothing if nothing is queued '''
+    assert AnalysisWorker(_FakeDebuggerStorage).runOnce() is None
+
+def test_run_once():
+    ''' ensures a worker runs the debugger on a queued crash dump and saves the analysis '''
+    uid = _addCrashDumps(1)[0]
+    with Storage() as s:
+        s.enqueueAnalysis('MyApp', uid)
+
+    job = AnalysisWorker(_FakeDebuggerStorage, workerId='theWorker').runOnce()
+    assert job.Status == AnalysisJobStatus.DONE.value
+    assert job.WorkerId == 'theWorker'
+    assert job.Error is None
+
+    with Storage(readOnly=True) as s:
+        analysis = s.getAnalysis('MyApp', uid)
+        assert analysis.rawAnalysisText == 'crash dump 0'
+
+        # the debugger is given the crash dump with its original name
+        assert analysis.dumpFileName == 'THEFILENAME'
+
+    assert AnalysisWorker(_FakeDebuggerStorage).runOnce() is None
+
+def test_run_once_with_failing_debugger():
+    ''' ensures a failing analysis marks the job as failed (with the error) '''
+    uid = _addCrashDumps(1)[0]
+    with Storage() as s:
+        s.enqueueAnalysis('MyApp', uid)
+
+    job = AnalysisWorker(_BrokenDebuggerStorage).runOnce()
+    assert job.Status == AnalysisJobStatus.FAILED.value
+    assert 'The debugger broke' in job.Error
+
+    with Storage(readOnly=True) as s:
+        assert s.getApplicationCell('MyApp', uid, 'CrashDumpAnalysis') is None
+
+def test_run_once_with_reclaimed_job():
+    ''' ensures a worker doesn't save (or finish) a job that was reclaimed by someone else while it ran '''
+    uid = _addCrashDumps(1)[0]
+    with Storage() as s:
+        s.enqueueAnalysis('MyApp', uid)
+
+    def generateAnalysis(*args):
+        ''' the job goes stale (and is claimed by another worker) while the debugger runs '''
+        with Storage() as s:
+            assert s.database.execute("UPDATE AnalysisJobs SET WorkerId = 'otherWorker' WHERE RowUid = ?", [uid]).rowcount == 1
+        return 'Analysis'
+
+    with unittest.mock.patch.object(_FakeDebuggerStorage, 'generateAnalysis', side_effect=generateAnalysis):
+        job = AnalysisWorker(_FakeDebuggerStorage, workerId='theWorker').runOnce()
+
+    assert job.Status == AnalysisJobStatus.RUNNING.value
+    assert job.WorkerId == 'otherWorker'
+    with Storage(readOnly=True) as s:
+        assert s.getApplicationCell('MyApp', uid, 'CrashDumpAnalysis') is None
+
+def test_pool_works_queue():
+    ''' ensures a pool of worker processes works through all queued jobs '''
+    uids = _addCrashDumps(4)
+    with Storage() as s:
+        for uid in uids:
+            s.enqueueAnalysis('MyApp', uid)
+
+    with AnalysisWorkerPool(2, storageClass=_FakeDebuggerStorage, pollInterval=.1) as pool:
+        assert pool.isRunning()
+
+        deadline = time.time() + 60
+        while time.time() < deadline:
+            with Storage(readOnly=True) as s:
+                statuses = [s.getAnalysisJob('MyApp', uid).Status for uid in uids]
+            if all(status == AnalysisJobStatus.DONE.value for status in statuses):
+                break
+            time.sleep(.1)
+
+    assert not pool.isRunning()
+    with Storage(readOnly=True) as s:
+        for i, uid in enumerate(uids):
+            assert s.getAnalysisJob('MyApp', uid).Status == AnalysisJobStatus.DONE.value
+            assert s.getAnalysis('MyApp', uid).rawAnalysisText == 'crash dump %d' % i
+
+def test_run_forever_records_heartbeats():
+    ''' ensures a worker counts as alive while it runs (and not after it stops) '''
+    stopEvent = threading.Event()
+    worker = AnalysisWorker(_FakeDebuggerStorage, workerId='theWorker')
+    thread = threading.Thread(target=worker.runForever, args=(stopEvent, .05))
+    thread.start()
+    try:
+        deadline = time.time() + 10
+        while time.time() < deadline:
+            with Storage(readOnly=True) as s:
+                if s.getLiveAnalysisWorkerCount():
+                    break
+            time.sleep(.05)
+        else:
+            assert False, "the worker never recorded a heartbeat"
+    finally:
+        stopEvent.set()
+        thread.join()
+
+    with Storage(readOnly=True) as s:
+        assert s.getLiveAnalysisWorkerCount() == 0
+
+def test_pool_size_must_be_positive():
+    ''' ensures a pool needs at least one worker '''
+    with pytest.raises(ValueError):
+        AnalysisWorkerPool(0)
@@ -0,0 +1,115 @@
+''' this file is home to the BlobStore class which keeps large binary objects as content-addressed files on disk '''
+
+import hashlib
+import io
+import os
+import string
+
+from csmlog_setup import getLogger
+from utility import Statistics, getUniqueId
+
+# files are streamed in/out of the store in chunks of this size to keep memory bounded
+CHUNK_SIZE = 1024 * 1024
+
+logger = getLogger(__file__)
+
+class BlobStore(object):
+    ''' content-addressed storage for binary objects. Each blob is kept as a file named after the SHA-256 of its
+    contents, under a directory named after the first two characters of that hash (to keep directories small).
+    Since the name is the content, adding the same bytes twice only stores them once. '''
+    TEMP_DIRECTORY_NAME = 'temp'
+
+    # counts of content that was already stored, for every blob store in this process (and duplicate symbol store adds and files given
+    #  by hash, see Storage)
+    STATISTICS = Statistics({
+        'blobs' : 'DedupBlobs',
+        'blobBytes' : 'DedupBlobBytesSaved',
+        'symbolStoreAdds' : 'DedupSymbolStoreAddsSkipped',
+        'symbolStoreBytes' : 'DedupSymbolStoreBytesSkipped',
+        'references' : 'DedupFilesReferenced',
+        'referenceBytes' : 'DedupReferencedBytes',
+    })
+
+    def __init__(self, path):
+        ''' Takes in the directory the blob store should live in. It will be created if needed. '''
+        self.path = path
+        self.tempPath = os.path.join(self.path, self.TEMP_DIRECTORY_NAME)
+        os.makedirs(self.tempPath, exist_ok=True)
+
+    @classmethod
+    def isValidHash(cls, blobHash):
+        ''' returns True if the given string looks like a SHA-256 hex digest '''
+        return isinstance(blobHash, str) and len(blobHash) == 64 and all(c in string.hexdigits for c in blobHash)
+
+    def getPath(self, blobHash):
+        ''' gets the path where the blob with the given hash would be stored '''
+        if not self.isValidHash(blobHash):
+            raise ValueError("Invalid blob hash: %s" % blobHash)
+
+        blobHash = blobHash.lower()
+        return os.path.join(self.path, blobHash[:2], blobHash)
+
+    def exists(self, blobHash):
+        ''' returns True if the blob with the given hash is in the store '''
+        return self.isValidHash(blobHash) and os.path.isfile(self.getPath(blobHash))
+
+    def add(self, data):
+        ''' adds the given bytes to the store. Returns a tuple of (hash, size) '''
+        if isinstance(data, str):
+            data = data.encode()
+
+        return self.addFromFile(io.BytesIO(data))
+
+    def addFromFile(self, fileObj, chunkSize=CHUNK_SIZE):
+        ''' streams the given (readable, binary) file object into the store chunk by chunk, hashing as it goes.
+        At most chunkSize bytes are held in memory. Returns a tuple of (hash, size) '''
+        hasher = hashlib.sha256()
+        size = 0
+
+        # write to a temp location then move into place so a partially written blob is never visible
+        tempPath = os.path.join(self.tempPath, getUniqueId())
+        try:
+            with open(tempPath, 'wb') as f:
+                while True:
+                    chunk = fileObj.read(chunkSize)
+                    if not chunk:
+                        break
+
+                    hasher.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+
+            blobHash = hasher.hexdigest()
+            finalPath = self.getPath(blobHash)
+            if os.path.isfile(finalPath):
+                logger.debug("Blob already stored: %s" % blobHash)
+                os.remove(tempPath)
+                self.STATISTICS.record(blobs=1, blobBytes=size)
+            else:
+                self._moveIntoPlace(tempPath, finalPath)
+        except:
+            if os.path.isfile(tempPath):
+                os.remove(tempPath)
+            raise
+
+        return blobHash, size
+
+    def get(self, blobHash):
+        ''' gets the bytes for the blob with the given hash. Returns None if it isn't in the store '''
+        if not self.exists(blobHash):
+            logger.warning("Blob not in store: %s" % blobHash)
+            return None
+
+        with open(self.getPath(blobHash), 'rb') as f:
+            return f.read()
+
+    def _moveIntoPlace(self, tempPath, finalPath):
+        ''' moves a fully written temp file to its final (hash-named) location '''
+        os.makedirs(os.path.dirname(finalPath), exist_ok=True)
+        try:
+            os.replace(tempPath, finalPath)
+        except OSError:
+            # someone else may have stored the same content (and may have it open) at the same time
+            if not os.path.isfile(finalPath):
+                raise
+            os.remove(tempPath)
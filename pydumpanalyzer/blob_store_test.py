@@ -0,0 +1,80 @@
+''' this file contains tests for the BlobStore class '''
+
+import hashlib
+import io
+import os
+
+import pytest
+
+from blob_store import BlobStore
+from utility import temporaryFilePath
+
+def test_add_and_get():
+    ''' ensures we can add bytes and get them back by hash '''
+    with temporaryFilePath() as tempDir:
+        store = BlobStore(tempDir)
+        blobHash, size = store.add(b'abcdefghijklmnopqrstuvwxyz')
+
+        assert blobHash == hashlib.sha256(b'abcdefghijklmnopqrstuvwxyz').hexdigest()
+        assert size == 26
+        assert store.exists(blobHash)
+        assert store.get(blobHash) == b'abcdefghijklmnopqrstuvwxyz'
+        assert os.path.isfile(os.path.join(tempDir, blobHash[:2], blobHash))
+
+def test_add_same_content_twice_is_stored_once():
+    ''' ensures content addressing means identical data is only kept once '''
+    with temporaryFilePath() as tempDir:
+        store = BlobStore(tempDir)
+        assert store.add(b'hello') == store.add(b'hello')
+        assert store.add('hello') == store.add(b'hello')
+
+        blobHash = store.add(b'hello')[0]
+        assert os.listdir(os.path.join(tempDir, blobHash[:2])) == [blobHash]
+        assert os.listdir(store.tempPath) == []
+
+def test_duplicates_are_counted():
+    ''' ensures content that was already stored is counted as deduplicated '''
+    with temporaryFilePath() as tempDir:
+        store = BlobStore(tempDir)
+        BlobStore.STATISTICS.takeStatistics()
+        store.add(b'hello')
+        assert BlobStore.STATISTICS.getStatistics()['DedupBlobs'] == 0
+
+        store.add(b'hello')
+        store.add(b'hello')
+        statistics = BlobStore.STATISTICS.takeStatistics()
+        assert statistics['DedupBlobs'] == 2
+        assert statistics['DedupBlobBytesSaved'] == 10
+        assert BlobStore.STATISTICS.getStatistics()['DedupBlobs'] == 0
+
+def test_missing_and_invalid_hashes():
+    ''' ensures missing or bogus hashes are handled '''
+    with temporaryFilePath() as tempDir:
+        store = BlobStore(tempDir)
+        assert not store.exists('0' * 64)
+        assert store.get('0' * 64) is None
+
+        assert not store.exists('../../etc/passwd')
+        with pytest.raises(ValueError):
+            store.getPath('../../etc/passwd')
+
+def test_add_from_file_streams_in_chunks():
+    ''' ensures addFromFile() never reads more than a chunk at a time '''
+    class ChunkCheckingFile(io.BytesIO):
+        ''' BytesIO that remembers the largest read size requested '''
+        largestRead = 0
+        def read(self, size=-1):
+            ChunkCheckingFile.largestRead = max(ChunkCheckingFile.largestRead, size)
+            assert size > 0
+            return super().read(size)
+
+    data = os.urandom(10000)
+    with temporaryFilePath() as tempDir:
+        store = BlobStore(tempDir)
+        blobHash, size = store.addFromFile(ChunkCheckingFile(data), chunkSize=1000)
+
+        assert ChunkCheckingFile.largestRead == 1000
+        assert size == len(data)
+        assert blobHash == hashlib.sha256(data).hexdigest()
+        assert store.get(blobHash) == data
+        assert os.listdir(store.tempPath) == []
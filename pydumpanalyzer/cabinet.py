@@ -0,0 +1,99 @@
+''' this file is home to writing cabinet (.cab) files, like the ones symstore.exe makes for compressed symbol store entries '''
+
+import datetime
+import os
+import struct
+import zlib
+
+CAB_SIGNATURE = b'MSCF'
+CAB_VERSION = (3, 1) # minor, major
+
+# each data block holds at most this many (uncompressed) bytes
+CAB_BLOCK_SIZE = 32768
+
+# a folder's block count is 16 bits, so a file can take up at most this many blocks in a cabinet
+CAB_MAX_BLOCKS = 0xFFFF
+
+COMPRESSION_MSZIP = 1
+MSZIP_SIGNATURE = b'CK'
+
+FILE_ATTRIBUTE_ARCHIVE = 0x20
+FILE_ATTRIBUTE_NAME_IS_UTF = 0x80
+
+CAB_HEADER = struct.Struct('<4sIIIIIBBHHHHH') # CFHEADER (with no reserved area)
+CAB_FOLDER = struct.Struct('<IHH')            # CFFOLDER
+CAB_FILE = struct.Struct('<IIHHHH')           # CFFILE (followed by the name)
+CAB_DATA = struct.Struct('<IHH')              # CFDATA (followed by the data)
+
+def _getDosDateAndTime(timestamp):
+    ''' gets a tuple of (date, time) in the MS-DOS format cabinets use, for the given timestamp '''
+    t = datetime.datetime.fromtimestamp(timestamp)
+    year = min(max(t.year, 1980), 2107)
+    return ((year - 1980) << 9) | (t.month << 5) | t.day, (t.hour << 11) | (t.minute << 5) | (t.second // 2)
+
+def getCabinetFileSize(path):
+    ''' gets the (uncompressed) size of the first file in the cabinet at path. Gives back None if it isn't a cabinet. '''
+    with open(path, 'rb') as f:
+        header = f.read(CAB_HEADER.size)
+        if len(header) != CAB_HEADER.size or not header.startswith(CAB_SIGNATURE):
+            return None
+
+        filesOffset = CAB_HEADER.unpack(header)[4]
+        f.seek(filesOffset)
+        cabFile = f.read(CAB_FILE.size)
+        if len(cabFile) != CAB_FILE.size:
+            return None
+
+        return CAB_FILE.unpack(cabFile)[0]
+
+def fitsInCabinet(path):
+    ''' returns True if the file at path is small enough to be written to a cabinet (in at most CAB_MAX_BLOCKS blocks) '''
+    return os.path.getsize(path) <= CAB_MAX_BLOCKS * CAB_BLOCK_SIZE
+
+def writeCabinet(sourcePath, destinationFile, fileName=None, compressionLevel=zlib.Z_DEFAULT_COMPRESSION):
+    ''' writes a cabinet holding the file at sourcePath (named fileName in it, its base name by default) to destinationFile.
+    destinationFile should be open for writing in binary mode (and be seekable, the header is written once the size is known).
+    The file is compressed with MSZIP a block at a time, so only a block is held in memory. Returns the size of the cabinet.
+    Raises ValueError if the file is too big for a cabinet (see fitsInCabinet()). '''
+    fileName = fileName or os.path.basename(sourcePath)
+    try:
+        name = fileName.encode('ascii')
+        attributes = FILE_ATTRIBUTE_ARCHIVE
+    except UnicodeEncodeError:
+        name = fileName.encode('utf-8')
+        attributes = FILE_ATTRIBUTE_ARCHIVE | FILE_ATTRIBUTE_NAME_IS_UTF
+    name += b'\0'
+
+    filesOffset = CAB_HEADER.size + CAB_FOLDER.size
+    dataOffset = filesOffset + CAB_FILE.size + len(name)
+
+    start = destinationFile.tell()
+    destinationFile.write(b'\0' * dataOffset)
+
+    # each block is its own deflate stream (behind the MSZIP signature). Checksums are optional, 0 means there isn't one.
+    blockCount = 0
+    fileSize = 0
+    with open(sourcePath, 'rb') as f:
+        date, time = _getDosDateAndTime(os.fstat(f.fileno()).st_mtime)
+        while True:
+            block = f.read(CAB_BLOCK_SIZE)
+            if not block:
+                break
+
+            compressor = zlib.compressobj(compressionLevel, zlib.DEFLATED, -zlib.MAX_WBITS)
+            data = MSZIP_SIGNATURE + compressor.compress(block) + compressor.flush()
+            destinationFile.write(CAB_DATA.pack(0, len(data), len(block)))
+            destinationFile.write(data)
+
+            blockCount += 1
+            fileSize += len(block)
+            if blockCount > CAB_MAX_BLOCKS:
+                raise ValueError("File is too big for a cabinet: %s" % sourcePath)
+
+    cabinetSize = destinationFile.tell() - start
+    destinationFile.seek(start)
+    destinationFile.write(CAB_HEADER.pack(CAB_SIGNATURE, 0, cabinetSize, 0, filesOffset, 0, CAB_VERSION[0], CAB_VERSION[1], 1, 1, 0, 0, 0))
+    destinationFile.write(CAB_FOLDER.pack(dataOffset, blockCount, COMPRESSION_MSZIP))
+    destinationFile.write(CAB_FILE.pack(fileSize, 0, 0, date, time, attributes) + name)
+    destinationFile.seek(start + cabinetSize)
+    return cabinetSize
@@ -0,0 +1,48 @@
+''' this file contains tests for writing cabinet files '''
+
+import io
+import os
+
+from cabinet import CAB_BLOCK_SIZE, getCabinetFileSize, writeCabinet
+from test_helpers import readCabinet
+from utility import temporaryFilePath
+
+def test_write_cabinet():
+    ''' ensures a file of any size goes in a cabinet (compressed a block at a time) and can be read back out '''
+    for contents in (b'', b'abcdefghijklmnopqrstuvwxyz', os.urandom(CAB_BLOCK_SIZE), b'abc' * CAB_BLOCK_SIZE + os.urandom(1000)):
+        with temporaryFilePath(fileName='TheCrasher.pdb') as path:
+            with open(path, 'wb') as f:
+                f.write(contents)
+
+            cabinet = io.BytesIO()
+            assert writeCabinet(path, cabinet) == len(cabinet.getvalue())
+            assert readCabinet(cabinet.getvalue()) == ('TheCrasher.pdb', contents)
+
+            # the name can be given, and the cabinet doesn't need to start at the start of the file
+            cabinet = io.BytesIO()
+            cabinet.write(b'before')
+            writeCabinet(path, cabinet, fileName='Other.pdb')
+            assert readCabinet(cabinet.getvalue()[len(b'before'):]) == ('Other.pdb', contents)
+
+def test_get_cabinet_file_size():
+    ''' ensures the size of the file in a cabinet can be read without decompressing it '''
+    with temporaryFilePath() as path:
+        with open(path, 'wb') as f:
+            f.write(b'abc' * CAB_BLOCK_SIZE)
+
+        with temporaryFilePath() as cabinetPath:
+            with open(cabinetPath, 'wb') as f:
+                writeCabinet(path, f)
+            assert getCabinetFileSize(cabinetPath) == 3 * CAB_BLOCK_SIZE
+
+        # not a cabinet
+        assert getCabinetFileSize(path) is None
+
+def test_write_cabinet_compresses():
+    ''' ensures compressible data is smaller in the cabinet '''
+    with temporaryFilePath() as path:
+        with open(path, 'wb') as f:
+            f.write(b'\0' * CAB_BLOCK_SIZE * 10)
+
+        cabinet = io.BytesIO()
+        assert writeCabinet(path, cabinet) < CAB_BLOCK_SIZE
@@ -3,19 +3,31 @@
 import os
 
 from analysis import Analysis
+from utility import Statistics
 
 class Debugger(object):
     ''' The debugger class is the base class for all Debuggers.
     All public functions for all debuggers should be defined here '''
-    def __init__(self, crashDump, symbols, executable=None):
+
+    # statistics for every debugger call made in this process (children should record to it)
+    CALL_STATISTICS = Statistics({
+        'calls' : 'DebuggerCalls',
+        'timeouts' : 'DebuggerCallTimeouts',
+        'failures' : 'DebuggerCallFailures',
+        'seconds' : 'DebuggerCallSeconds',
+    })
+
+    def __init__(self, crashDump, symbols, executable=None, allThreads=False):
         ''' initalizer takes in a crash dump file location, symbols file location, and
         optionally the executable that caused the crash.
         On certain platforms (Windows), symbols can refer to a symbol store as opposed to a single symbols file.
             Though if you give a single symbols file, it will be used by adding to the downstream symbol store.
+        If allThreads is True, getAnalysis() gets the stack of every thread instead of just the one that crashed.
          '''
         self.crashDump = crashDump
         self.symbols = symbols
         self.executable = executable
+        self.allThreads = allThreads
 
         # do last
         self._platformSetup()
@@ -30,13 +42,23 @@ class Debugger(object):
         Defined by children '''
         pass
 
+    def getAllStackTraces(self):
+        ''' Get a list of stack.Stack instances: the one from getStackTrace() first, then one for each other thread.
+        Children should get them all at once if they can. By default, only getStackTrace()'s is given back. '''
+        return [self.getStackTrace()]
+
     def getRawAnalysis(self):
         ''' Get a string of raw analysis data from the debugger.
         Defined by children '''
         pass
 
+    def openSession(self):
+        ''' Opens a debugger_session.DebuggerSession: a debugger kept open on the crash dump, to run commands on one at a time.
+        Defined by children '''
+        pass
+
     def getAnalysis(self):
-        ''' Uses getStackTrace() / getRawAnalysis() to get an Analysis object '''
+        ''' Uses getStackTrace() (or getAllStackTraces() if allThreads is set) / getRawAnalysis() to get an Analysis object '''
         return Analysis(os.path.basename(self.crashDump),
-        self.getStackTrace(), # hmm this is one stack... should we get others?... Analysis supports that if we want it
+        self.getAllStackTraces() if self.allThreads else self.getStackTrace(),
         self.getRawAnalysis())
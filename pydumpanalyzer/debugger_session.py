@@ -0,0 +1,271 @@
+''' this file is home to long lived debugger sessions: a debugger (cdb) process kept open on a crash dump,
+so commands can be run one after another without reloading the dump and symbols for each one '''
+
+import collections
+import contextlib
+import queue
+import re
+import subprocess
+import threading
+import time
+
+from csmlog_setup import getLogger
+from debugger import Debugger
+from utility import killProcessTree
+
+# how long (in seconds) to wait on a command's output by default
+DEFAULT_COMMAND_TIMEOUT = 60
+
+# how long (in seconds) to wait on the debugger to load the dump/symbols and give its first prompt
+DEFAULT_START_TIMEOUT = 300
+
+# defaults for DebuggerSessionPool
+DEFAULT_MAX_SESSIONS = 4
+DEFAULT_IDLE_TIMEOUT_SECONDS = 300
+
+# matches the debugger's prompt(s) at the start of a line. Like 0:000> or 0:000:x86>
+REGEX_PROMPT = re.compile(r'^(\s*\d+:\d+(:\w+)?> ?)+')
+
+logger = getLogger(__file__)
+
+class DebuggerSessionError(Exception):
+    ''' raised when a debugger session can't be used (it timed out or its process went away) '''
+    pass
+
+class DebuggerSession(object):
+    ''' a debugger process kept open on a crash dump. Commands are written to its stdin, and their output is read back
+    from its stdout up to a marker that is echoed after each command. '''
+    def __init__(self, args, setupCommands=None, startTimeout=DEFAULT_START_TIMEOUT):
+        ''' initializer takes in the args to start the debugger with (it should read commands from stdin)
+        and optionally commands to run once it is up (their output is thrown away) '''
+        self.args = args
+        self.lastUsed = time.time()
+        self._markerNumber = 0
+        self._lock = threading.Lock()
+        self._lines = queue.Queue()
+
+        logger.debug("Starting debugger session: %s" % args)
+        self.process = subprocess.Popen(args, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                        universal_newlines=True, errors='replace', start_new_session=True)
+
+        # a thread reads the output as it comes, so a command's output can be waited on with a timeout
+        self._reader = threading.Thread(target=self._readOutput, name='DebuggerSessionReader', daemon=True)
+        self._reader.start()
+
+        # the first marker comes back once the debugger is ready
+        try:
+            self.runCommands(setupCommands or [], timeout=startTimeout)
+        except:
+            self.close()
+            raise
+
+    def __enter__(self):
+        ''' called when entering via a context manager '''
+        return self
+
+    def __exit__(self, type, value, traceback):
+        ''' called when exiting via a context manager '''
+        self.close()
+
+    def _readOutput(self):
+        ''' run by the reader thread: puts each line of output in the queue, then None when the output ends '''
+        try:
+            for line in self.process.stdout:
+                self._lines.put(line)
+        finally:
+            self._lines.put(None)
+
+    def isAlive(self):
+        ''' returns True if the debugger process is still running '''
+        return self.process.poll() is None
+
+    def runCommand(self, command, timeout=DEFAULT_COMMAND_TIMEOUT):
+        ''' runs the given command and gives back its output (without prompts) '''
+        return self.runCommands([command], timeout=timeout)[0]
+
+    def runCommands(self, commands, timeout=DEFAULT_COMMAND_TIMEOUT):
+        ''' runs the given commands (in order) and gives back a list of their outputs (without prompts).
+        If the output doesn't all come back within timeout seconds, the session is closed and DebuggerSessionError is raised. '''
+        with self._lock:
+            if not self.isAlive():
+                raise DebuggerSessionError("Debugger session is not running: %s" % self.args)
+
+            # a marker is echoed before the first command and after each command. A command's output is what comes between its markers.
+            markers = []
+            script = ''
+            for command in [None] + commands:
+                self._markerNumber += 1
+                markers.append('== PDA Session Marker %d ==' % self._markerNumber)
+                script += ('%s\n' % command if command is not None else '') + '.echo %s\n' % markers[-1]
+
+            try:
+                self.process.stdin.write(script)
+                self.process.stdin.flush()
+            except OSError as ex:
+                self.close()
+                raise DebuggerSessionError("Could not write to debugger session: %s" % str(ex))
+
+            # output from before the first marker (like the startup banner or a previous command that timed out) is thrown away
+            startTime = time.time()
+            deadline = startTime + timeout
+            outputs = []
+            lines = None
+            while True:
+                try:
+                    line = self._readLine(deadline, commands)
+                except DebuggerSessionError:
+                    timedOut = time.time() > deadline
+                    Debugger.CALL_STATISTICS.record(calls=1, seconds=time.time() - startTime, timeouts=int(timedOut), failures=int(not timedOut))
+                    raise
+                if line is None:
+                    continue
+
+                line = REGEX_PROMPT.sub('', line.rstrip('\r\n'))
+                if line in markers:
+                    if lines is not None:
+                        outputs.append('\n'.join(lines).strip('\n'))
+                    if line == markers[-1]:
+                        break
+                    lines = []
+                elif lines is not None:
+                    lines.append(line)
+
+            self.lastUsed = time.time()
+            Debugger.CALL_STATISTICS.record(calls=1, seconds=self.lastUsed - startTime)
+            return outputs
+
+    def _readLine(self, deadline, commands):
+        ''' reads the next line of output. Gives back None if there was no line to read yet.
+        Closes the session and raises DebuggerSessionError if the deadline passed or the output ended. '''
+        try:
+            line = self._lines.get(timeout=min(max(deadline - time.time(), 0), .1))
+        except queue.Empty:
+            if time.time() > deadline:
+                # it is stuck, don't wait on it to quit
+                self.close(timeout=0)
+                raise DebuggerSessionError("Timed out doing this command list: %s" % commands)
+            return None
+
+        if line is None:
+            self.close()
+            raise DebuggerSessionError("Debugger session ended doing this command list: %s" % commands)
+
+        return line
+
+    def close(self, timeout=5):
+        ''' asks the debugger to quit (killing it if it doesn't in time) '''
+        if self.isAlive():
+            try:
+                self.process.stdin.write('q\n')
+                self.process.stdin.flush()
+            except OSError:
+                pass
+
+            try:
+                self.process.wait(timeout)
+            except subprocess.TimeoutExpired:
+                logger.warning("Killing debugger session that didn't quit: %s" % self.args)
+                killProcessTree(self.process)
+
+        for pipe in (self.process.stdin, self.process.stdout):
+            try:
+                pipe.close()
+            except OSError:
+                pass
+
+class DebuggerSessionPool(object):
+    ''' keeps idle DebuggerSessions (by the args they were started with, so by crash dump) for reuse.
+    At most maxSessions are open at once. Idle sessions are closed after idleTimeout seconds.
+    Sessions are only reused for the same args, so they should name a crash dump that stays put (not a temporary copy of one). '''
+    def __init__(self, maxSessions=DEFAULT_MAX_SESSIONS, idleTimeout=DEFAULT_IDLE_TIMEOUT_SECONDS):
+        ''' initializer takes in the max number of open sessions and how long (in seconds) idle sessions are kept '''
+        if maxSessions < 1:
+            raise ValueError("maxSessions must be at least 1, not %d" % maxSessions)
+
+        self.maxSessions = maxSessions
+        self.idleTimeout = idleTimeout
+        self._idleSessions = collections.OrderedDict() # session -> key (oldest used first)
+        self._openSessionCount = 0
+        self._condition = threading.Condition()
+
+    @contextlib.contextmanager
+    def getSession(self, args, setupCommands=None, timeout=DEFAULT_START_TIMEOUT):
+        ''' context manager giving a session started with the given args (an idle one from the pool if there is one).
+        It goes back in the pool after, unless something went wrong using it. Waits up to timeout seconds if maxSessions are busy. '''
+        key = tuple(args)
+        session = self._takeSession(key, timeout)
+        try:
+            if session is None:
+                session = DebuggerSession(args, setupCommands=setupCommands)
+            yield session
+        except:
+            if session is not None:
+                session.close()
+            self._sessionClosed()
+            raise
+        else:
+            self._giveBackSession(key, session)
+
+    def _takeSession(self, key, timeout):
+        ''' takes an idle session with the given key out of the pool (or gives back None after reserving room to open one) '''
+        deadline = time.time() + timeout
+        with self._condition:
+            while True:
+                self._closeIdleSessions(time.time() - self.idleTimeout)
+                for session, sessionKey in reversed(self._idleSessions.items()):
+                    if sessionKey == key:
+                        del self._idleSessions[session]
+                        if session.isAlive():
+                            return session
+                        self._openSessionCount -= 1
+                        break
+
+                if self._openSessionCount < self.maxSessions:
+                    self._openSessionCount += 1
+                    return None
+
+                # make room by closing the least recently used idle session (for another dump)
+                if self._idleSessions:
+                    session = next(iter(self._idleSessions))
+                    del self._idleSessions[session]
+                    session.close()
+                    self._openSessionCount -= 1
+                    continue
+
+                if not self._condition.wait(max(deadline - time.time(), 0)) and time.time() > deadline:
+                    raise DebuggerSessionError("Timed out waiting for a debugger session")
+
+    def _giveBackSession(self, key, session):
+        ''' gives a session back to the pool '''
+        with self._condition:
+            if session.isAlive():
+                self._idleSessions[session] = key
+            else:
+                self._openSessionCount -= 1
+            self._condition.notify()
+
+    def _sessionClosed(self):
+        ''' called when a session that was taken from the pool is closed instead of given back '''
+        with self._condition:
+            self._openSessionCount -= 1
+            self._condition.notify()
+
+    def _closeIdleSessions(self, lastUsedBefore):
+        ''' closes idle sessions last used before the given time. The condition must be held. '''
+        for session in [s for s in self._idleSessions if s.lastUsed < lastUsedBefore]:
+            del self._idleSessions[session]
+            session.close()
+            self._openSessionCount -= 1
+            self._condition.notify()
+
+    def closeIdleSessions(self):
+        ''' closes idle sessions that have been idle longer than idleTimeout. Returns how many sessions are still open. '''
+        with self._condition:
+            self._closeIdleSessions(time.time() - self.idleTimeout)
+            return self._openSessionCount
+
+    def closeAll(self):
+        ''' closes all idle sessions (busy ones are closed when they come back) '''
+        with self._condition:
+            self._closeIdleSessions(float('inf'))
+            return self._openSessionCount
@@ -0,0 +1,103 @@
+''' home to tests for debugger sessions '''
+import unittest.mock
+
+import pytest
+
+from debugger_session import DebuggerSession, DebuggerSessionError, DebuggerSessionPool
+from test_helpers import FAKE_CDB_ARGS, WinDbgWithoutCdb
+
+def test_run_commands():
+    ''' ensures commands run in the session give back just their output '''
+    with DebuggerSession(FAKE_CDB_ARGS) as session:
+        assert session.runCommand('kcn') == 'output of kcn\nsecond line'
+        assert session.runCommands(['kpn', '.echo hi', '.frame 1']) == ['output of kpn\nsecond line', 'hi', 'output of .frame 1\nsecond line']
+        assert session.runCommands([]) == []
+
+def test_session_is_kept_open():
+    ''' ensures commands go to the same debugger process '''
+    with DebuggerSession(FAKE_CDB_ARGS, setupCommands=['.symopt+0x10']) as session:
+        first = int(session.runCommand('count'))
+        second = int(session.runCommand('count'))
+
+        # each command is run between markers (.echo), so there are 3 commands between
+        assert second == first + 3
+        assert session.isAlive()
+
+    assert not session.isAlive()
+
+def test_timeout_closes_session():
+    ''' ensures a command that takes too long closes the session '''
+    session = DebuggerSession(FAKE_CDB_ARGS)
+    with pytest.raises(DebuggerSessionError):
+        session.runCommand('sleep 5', timeout=.5)
+
+    assert not session.isAlive()
+    with pytest.raises(DebuggerSessionError):
+        session.runCommand('kcn')
+
+def test_debugger_going_away():
+    ''' ensures the session raises if the debugger goes away '''
+    session = DebuggerSession(FAKE_CDB_ARGS)
+    with pytest.raises(DebuggerSessionError):
+        session.runCommand('crash')
+
+    assert not session.isAlive()
+
+def test_pool_reuses_sessions():
+    ''' ensures the pool hands back idle sessions for the same args '''
+    pool = DebuggerSessionPool(maxSessions=2)
+    with pool.getSession(FAKE_CDB_ARGS) as session:
+        process = session.process
+
+    with pool.getSession(FAKE_CDB_ARGS) as session:
+        assert session.process is process
+
+        # something else in use at the same time gets a new one
+        with pool.getSession(FAKE_CDB_ARGS) as otherSession:
+            assert otherSession.process is not process
+
+    # different args (another dump) means a different session
+    with pool.getSession(FAKE_CDB_ARGS + ['other.dmp']) as session:
+        assert session.process is not process
+
+    assert pool.closeAll() == 0
+    assert process.poll() is not None
+
+def test_pool_max_sessions_and_idle_timeout():
+    ''' ensures the pool closes idle sessions to stay under maxSessions, and closes sessions idle for too long '''
+    pool = DebuggerSessionPool(maxSessions=1, idleTimeout=60)
+    with pool.getSession(FAKE_CDB_ARGS) as session:
+        first = session
+    with pool.getSession(FAKE_CDB_ARGS + ['other.dmp']) as session:
+        assert not first.isAlive()
+        second = session
+
+    # while busy (at maxSessions), others wait for it
+    with pool.getSession(FAKE_CDB_ARGS + ['other.dmp']):
+        with pytest.raises(DebuggerSessionError):
+            with pool.getSession(FAKE_CDB_ARGS, timeout=.2):
+                pass
+
+    assert pool.closeIdleSessions() == 1
+    pool.idleTimeout = 0
+    assert pool.closeIdleSessions() == 0
+    assert not second.isAlive()
+
+def test_pool_closes_broken_session():
+    ''' ensures a session isn't given back to the pool if something went wrong using it '''
+    pool = DebuggerSessionPool(maxSessions=1)
+    with pytest.raises(DebuggerSessionError):
+        with pool.getSession(FAKE_CDB_ARGS) as session:
+            session.runCommand('sleep 5', timeout=.1)
+
+    with pool.getSession(FAKE_CDB_ARGS) as otherSession:
+        assert otherSession is not session
+
+    pool.closeAll()
+
+def test_windbg_open_session():
+    ''' ensures WinDbg opens a session on its crash dump that commands can be run in '''
+    windbg = WinDbgWithoutCdb(__file__, __file__)
+    with unittest.mock.patch.object(windbg, '_getSessionArgs', return_value=FAKE_CDB_ARGS):
+        with windbg.openSession() as session:
+            assert session.runCommand('kcn') == 'output of kcn\nsecond line'
@@ -28,3 +28,21 @@ def test_get_analysis_calls_correct_things():
             assert Debugger('', '').getAnalysis()
             gra.assert_called_once()
             gst.assert_called_once()
+
+def test_get_analysis_all_threads():
+    ''' ensure that getAnalysis() gets every thread's stack if allThreads is set '''
+    with unittest.mock.patch('debugger.Debugger.getStackTrace', return_value='Stack'):
+        with unittest.mock.patch('debugger.Debugger.getRawAnalysis'):
+            assert Debugger('', '').getAnalysis().stacks == ['Stack']
+
+            with unittest.mock.patch('debugger.Debugger.getAllStackTraces', return_value=['Stack', 'OtherStack']) as gast:
+                assert Debugger('', '').getAnalysis().stacks == ['Stack']
+                gast.assert_not_called()
+                assert Debugger('', '', allThreads=True).getAnalysis().stacks == ['Stack', 'OtherStack']
+
+            # by default, there is just the one stack
+            assert Debugger('', '').getAllStackTraces() == ['Stack']
+
+def test_open_session_defined_by_children():
+    ''' ensure a Debugger without session support gives back no session '''
+    assert Debugger('', '').openSession() is None
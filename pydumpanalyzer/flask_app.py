@@ -3,13 +3,18 @@
     2. Receiver and storer of crash dumps
     3. Analyzer of crash dumps
     4. Windows symbol server when accessible via an endpoint
+
+Crash dumps are analyzed by background workers (see analysis_worker.py). Running this file directly starts a pool of them
+(see --analysis-workers). When the app is served by a WSGI server instead, run analysis_worker.py alongside it.
 '''
+import argparse
 import datetime
 import enum
 import io
 import itertools
 import os
 import pickle
+import threading
 import traceback
 
 import flask
@@ -19,26 +24,54 @@ from werkzeug.exceptions import HTTPException
 import __version__
 import _html
 import utility
+from analysis_worker import DEFAULT_POOL_SIZE, AnalysisWorkerPool
 from csmlog_setup import enableConsoleLogging, getLogger
-from storage import Storage
+from storage import (APPLICATION_OPTIONS_DEFAULTS, APPLICATION_TABLE_DEFAULT_PAGE_SIZE, APPLICATION_TABLE_FILTERS, BLOB_COLUMNS, AnalysisJobStatus,
+                     Storage)
+from symbol_server import SEND_FILE_HEADERS, SymbolServer
 
 CACHED_ANALYSIS_FILE_NAME = 'analysis.pickle'
 THIS_DIR = os.path.abspath(os.path.dirname(__file__))
 ROOT_STORAGE_LOCATION = os.path.join(THIS_DIR, 'storage')
 WINDOWS_SYMBOLS_LOCATION = os.path.join(ROOT_STORAGE_LOCATION, "WindowsSymbols")
 
+# serves the Windows symbol store (without opening Storage). It's made on first use (see getSymbolServer()), so the store's index is
+#  only built once, with the options from the command line.
+_SYMBOL_SERVER = None
+_SYMBOL_SERVER_LOCK = threading.Lock()
+
 app = flask.Flask("PyDumpAnalyzerFlaskApp")
 auto = flask_selfdoc.Autodoc(app)
 logger = getLogger(__file__)
 
+def configureSymbolServer(sendFileHeader=None, accelRedirectPrefix='/WindowsSymbols/'):
+    ''' makes the SymbolServer for the Windows symbol store, optionally handing files off to a front proxy. Should be called before
+    the first request (getSymbolServer() makes one with the defaults otherwise). '''
+    global _SYMBOL_SERVER
+    with _SYMBOL_SERVER_LOCK:
+        _SYMBOL_SERVER = SymbolServer(Storage.WINDOWS_SYMBOL_STORE_DIRECTORY, sendFileHeader, accelRedirectPrefix)
+        return _SYMBOL_SERVER
+
+def getSymbolServer():
+    ''' gets the SymbolServer for the Windows symbol store, making it (with the defaults) if configureSymbolServer() wasn't called '''
+    global _SYMBOL_SERVER
+    with _SYMBOL_SERVER_LOCK:
+        if _SYMBOL_SERVER is None:
+            _SYMBOL_SERVER = SymbolServer(Storage.WINDOWS_SYMBOL_STORE_DIRECTORY)
+        return _SYMBOL_SERVER
+
 class WEBPAGES_NAVBAR(enum.Enum):
     ''' enum with all top level web pages for the navbar '''
     API_Docs = '/show/apidocs/'
+    Statistics = '/show/statistics'
 
 class WEBPAGES_NOT_NAVBAR(enum.Enum):
     ''' enum with all outward web pages. Ones that are in here,
     but not in WEBPAGES_NAVBAR are not shown in the navbar '''
     Add_Item = '/add'
+    Has_File = '/has/file/<applicationName>/<fileHash>'
+    Has_Windows_Symbols = '/has/windows/symbols/<fileName>/<fileId>'
+    Set_Application_Options = '/set/application_options/<applicationName>'
     Home = '/'
     View_Application_Table = '/show/application_table/<applicationName>'
     Get_Analysis = '/get/analysis/<applicationName>/<rowUid>'
@@ -65,7 +98,7 @@ def apiDocumentation():
 @app.route(WEBPAGES.Home.value, methods=['GET'])
 def home():
     ''' the home page for the app '''
-    with Storage() as storage:
+    with Storage(readOnly=True) as storage:
         cursor = storage.database.execute("SELECT Name FROM Applications")
         table = _html.HtmlTable.fromCursor(cursor, classes='content', name="Applications")
 
@@ -76,27 +109,79 @@ def home():
 
     return flask.render_template('home.html', html_content=table)
 
+@app.route(WEBPAGES.Statistics.value, methods=['GET'])
+def showStatistics():
+    ''' shows the running totals kept by PDA (like how many debugger calls have been made, and how long they took, and how often
+    symbols were found in the downstream symbol cache, and how many bytes of duplicate uploads weren't stored again), along with how this process's symbol server index has been used '''
+    with Storage(readOnly=True) as storage:
+        statistics = storage.getStatistics()
+
+    # these are for this process (and aren't saved), the index is rebuilt on start
+    statistics.update(getSymbolServer().index.getStatistics())
+    symbolIndexHits = statistics.get('SymbolIndexHits', 0) + statistics.get('SymbolIndexNegativeHits', 0)
+    symbolIndexLookups = symbolIndexHits + statistics.get('SymbolIndexMisses', 0)
+    if symbolIndexLookups:
+        statistics['SymbolIndexHitRate'] = symbolIndexHits / symbolIndexLookups
+
+    if statistics.get('DebuggerCalls'):
+        statistics['DebuggerCallAverageSeconds'] = statistics.get('DebuggerCallSeconds', 0) / statistics['DebuggerCalls']
+
+    # files referenced by hash (DedupReferencedBytes) weren't uploaded at all, so they're shown on their own
+    dedupBytesSaved = statistics.get('DedupBlobBytesSaved', 0) + statistics.get('DedupSymbolStoreBytesSkipped', 0)
+    if dedupBytesSaved:
+        statistics['DedupBytesSaved'] = dedupBytesSaved
+
+    symbolCacheLookups = statistics.get('SymbolCacheHits', 0) + statistics.get('SymbolCacheMisses', 0)
+    if symbolCacheLookups:
+        statistics['SymbolCacheHitRate'] = statistics.get('SymbolCacheHits', 0) / symbolCacheLookups
+
+    table = _html.HtmlTable(['Name', 'Value'], name='Statistics', classes='content')
+    for name, value in sorted(statistics.items()):
+        table.addRow([name, value])
+
+    return flask.render_template('base.html', html_content=table, title='Statistics')
+
 @app.route(WEBPAGES.View_Application_Table.value, methods=['GET'])
 def viewApplicationTable(applicationName):
-    ''' used to give back a view of the given database table '''
-    with Storage() as storage:
-        table = storage.getApplicationTable(applicationName)
+    ''' used to give back a view of the given database table.
+    A page of rows is shown at a time. The following optional params can be given:
+        before: IdKey to show rows before (older than)
+        pageSize: number of rows in the page
+        Tag/ApplicationVersion/OperatingSystem: only show rows with this value
+        StartTime/EndTime: only show rows with a Timestamp in this range '''
+    filters = {k : flask.request.args.get(k) for k in APPLICATION_TABLE_FILTERS + ('StartTime', 'EndTime')}
+    before = flask.request.args.get('before', default=None, type=int)
+    pageSize = flask.request.args.get('pageSize', default=APPLICATION_TABLE_DEFAULT_PAGE_SIZE, type=int)
+    with Storage(readOnly=True) as storage:
+        table = storage.getApplicationTable(applicationName, filters=filters, before=before, pageSize=pageSize)
         return flask.render_template('table_view.html', table_content=table, title=applicationName)
 
 @app.route(WEBPAGES.Get_File.value, methods=['GET'])
 def getFile(applicationName, rowUid, column):
     ''' this handler is not documented for external use.
-    From applicationName, rowUid, column (name) we can get the blob assoicated '''
-    with Storage() as s:
-        blob = s.getApplicationCell(applicationName, rowUid, column)
-        if not blob:
-            flask.abort(404)
+    From applicationName, rowUid, column (name) we can get the blob assoicated.
+    Files from the blob store are streamed from disk and support Range/If-Range requests (to resume large downloads). '''
+    blob = None
+    blobPath = None
+    with Storage(readOnly=True) as s:
+        if column in BLOB_COLUMNS:
+            blobPath = s.getApplicationBlobPath(applicationName, rowUid, column)
+            if not blobPath:
+                flask.abort(404)
+        else:
+            blob = s.getApplicationCell(applicationName, rowUid, column)
+            if not blob:
+                flask.abort(404)
 
         # if we can get the 'real name', use it
         fileName = column
         if column in ('SymbolsFile', 'ExecutableFile', 'CrashDumpFile'):
             fileName = s.getApplicationCell(applicationName, rowUid, column + "Name")
 
+    # storage is released at this point, nothing is held while the file goes out to the client
+    if blobPath:
+        return flask.send_file(blobPath, as_attachment=True, attachment_filename=fileName, mimetype='application/x-binary', conditional=True)
+
     if isinstance(blob, str):
         blob = blob.encode()
 
@@ -106,12 +191,21 @@ def getFile(applicationName, rowUid, column):
 def getAnalysis(applicationName, rowUid):
     ''' will get back an analysis page based off the given application name and uid.
     Optionally the useCache param may be used. By default it is True. If False is given, cache will be
-    removed, then analysis regenerated for the given uid's crash dump '''
+    removed, then analysis regenerated for the given uid's crash dump.
+    Analysis is done by background workers: if it isn't ready, the status of the analysis job is given back (the page refreshes itself until it is). '''
     useCache = True if flask.request.args.get('useCache', default="True", type=str) == "True" else False
     with Storage() as storage:
-        analysis = storage.getAnalysis(applicationName, rowUid, useCache)
+        analysis, job = storage.requestAnalysis(applicationName, rowUid, useCache)
+        pending = analysis is None and job.Status in (AnalysisJobStatus.QUEUED.value, AnalysisJobStatus.RUNNING.value)
+        noWorkers = pending and not storage.getLiveAnalysisWorkerCount()
+
+    if analysis is not None:
         return flask.render_template('analysis.html', analysis=utility.textToSafeHtmlText(str(analysis)), title="Analysis", uuid=rowUid, application=applicationName)
 
+    return flask.render_template('analysis_status.html', title="Analysis", uuid=rowUid, application=applicationName, status=job.Status,
+                                 error=utility.textToSafeHtmlText(job.Error) if job.Error else None, noWorkers=noWorkers,
+                                 refreshUrl=flask.url_for('getAnalysis', applicationName=applicationName, rowUid=rowUid) if pending else None), 202 if pending else 200
+
 @app.errorhandler(Exception)
 def error_handler(e):
     ''' this will handle all http errors we may encounter with a custom template '''
@@ -143,6 +237,11 @@ def addHandler():
     SymbolsFile:     File: Symbols file for the application (On Windows a .pdb file can be given)
     ExecutableFile:  File: The executable to be debugged later (Can be a .exe, .dll, etc.)
     CrashDumpFile:   File: The dump file to be analyzed. (On Windows, the crash dump can be sent at a different time from the ExecutableFile and SymbolsFile)
+                     Crash dumps are queued up to be analyzed in the background as soon as they are added.
+
+    Instead of uploading one of those files again, one that was already added for the Application can be given by its hash (see the has endpoints):
+    <File>Hash:      String: SHA-256 (hex) of the file. Like SymbolsFileHash
+    <File>Name:      String: Name of the file. Like SymbolsFileName
 
     Optional form-data Body Fields:
     ApplicationVersion: String: Version for the application
@@ -151,15 +250,89 @@ def addHandler():
     with Storage() as storage:
         return storage.addFromAddRequest(flask.request)
 
+@app.route(WEBPAGES.Has_File.value, methods=['GET'])
+@auto.doc()
+def hasFile(applicationName, fileHash):
+    ''' checks if a file was already added for the given application (so it can be given to add by hash instead of being uploaded again).
+    fileHash is the SHA-256 (hex) of the file. Gives back a 200 with the size of the file if it is here, a 404 otherwise. Can be a HEAD request. '''
+    with Storage(readOnly=True) as storage:
+        if not storage.blobStore.exists(fileHash) or not storage.applicationHasBlob(applicationName, fileHash):
+            flask.abort(404)
+
+        return str(os.path.getsize(storage.blobStore.getPath(fileHash)))
+
+@app.route(WEBPAGES.Has_Windows_Symbols.value, methods=['GET'])
+@auto.doc()
+def hasWindowsSymbols(fileName, fileId):
+    ''' checks if a symbols file or executable is already here by its name and symbol store id, without needing to hash it.
+    For a PDB, the id is its GUID (32 hex digits, no dashes) followed by its age (in hex). For an executable, the id is its
+    TimeDateStamp (8 hex digits) followed by its SizeOfImage (in hex).
+    Gives back a 200 with the SHA-256 of the file (to give to add) if it is here, a 404 otherwise. Can be a HEAD request. '''
+    with Storage(readOnly=True) as storage:
+        fileHash = storage.getSymbolStoreFileHash(fileName, fileId)
+
+    if fileHash is None:
+        flask.abort(404)
+
+    return fileHash
+
+@app.route(WEBPAGES.Set_Application_Options.value, methods=['POST'])
+@auto.doc()
+def setApplicationOptions(applicationName):
+    ''' this handler is called to change options for an application that has already been added.
+        Changes apply to crash dumps analyzed after the change (use useCache=False on an analysis to redo it).
+
+    Optional form-data Body Fields:
+    AllThreads:      String: "True" to have analysis get the stack of every thread (instead of just the one that crashed). "False" to not.
+    '''
+    with Storage() as storage:
+        if not storage.applicationExists(applicationName):
+            flask.abort(404)
+
+        # all options are flags
+        for option in APPLICATION_OPTIONS_DEFAULTS:
+            value = flask.request.form.get(option)
+            if value is None:
+                continue
+
+            if value not in ('True', 'False'):
+                msg = "request's %s should be True or False, not: %s" % (option, value)
+                logger.error(msg)
+                flask.abort(flask.Response(msg, 401))
+
+            storage.setApplicationOption(applicationName, option, value == 'True')
+
+    return 'Success'
+
 @app.route(WEBPAGES.Get_Windows_Symbols.value, methods=['GET'])
 @auto.doc()
 def getWindowsSymbols(path):
     ''' This endpoint can be used as a Windows Symbol server for all Windows executables and symbols files.
+    Files are served straight from the symbol store (no database access), with ETag/Last-Modified for conditional GETs.
     For information on Symbol Stores/Servers from Microsoft, check: https://docs.microsoft.com/en-us/windows/win32/debug/using-symsrv'''
-    with Storage() as storage:
-        return flask.send_file(storage.getWindowsSymbolFilePath(path))
+    return getSymbolServer().sendFile(path)
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Runs the PDA flask app')
+    parser.add_argument('-w', '--analysis-workers', type=int, default=DEFAULT_POOL_SIZE,
+                        help='number of background analysis worker processes. 0 means none (run analysis_worker.py separately, like when '
+                             'served by a WSGI server).')
+    parser.add_argument('--symbols-send-file-header', choices=SEND_FILE_HEADERS, default=None,
+                        help='hand sending Windows symbols off to a front proxy via this header instead of sending them from flask.')
+    parser.add_argument('--symbols-accel-redirect-prefix', default='/WindowsSymbols/',
+                        help='url prefix (mapped to the symbol store by the proxy) used with --symbols-send-file-header X-Accel-Redirect.')
+    args = parser.parse_args()
+
     app.url_map.strict_slashes = False
     enableConsoleLogging()
-    app.run()
\ No newline at end of file
+    Storage.migrate()
+    configureSymbolServer(args.symbols_send_file_header, args.symbols_accel_redirect_prefix)
+
+    analysisWorkerPool = AnalysisWorkerPool(args.analysis_workers) if args.analysis_workers else None
+    if analysisWorkerPool:
+        analysisWorkerPool.start()
+    try:
+        app.run()
+    finally:
+        if analysisWorkerPool:
+            analysisWorkerPool.stop()
@@ -1,7 +1,9 @@
 ''' home for unit tests for the flask app'''
 
+import hashlib
 import io
 import os
+import shutil
 import sys
 import unittest
 import unittest.mock
@@ -13,6 +15,7 @@ from werkzeug.exceptions import HTTPException
 import __version__
 from csmlog_setup import getLogger
 from storage_test import MockRequest, Storage
+from utility import getUniqueId
 
 logger = getLogger(__file__)
 
@@ -37,13 +40,13 @@ class TestFlaskApp(unittest.TestCase):
         self.oldCwd = os.getcwd()
 
         # clear database to have a fresh run each time.
-        if os.path.exists(Storage.DATABASE_FILE):
-            os.remove(Storage.DATABASE_FILE)
+        Storage.removeDatabase()
 
         # our app must be imported while we're in the current directory for jinja templates to be found
         os.chdir(os.path.abspath(os.path.dirname(__file__)))
         import flask_app
         flask_app.Storage = Storage # monkeypatch
+        flask_app.configureSymbolServer() # in the monkeypatched Storage's symbol store
         self.WEBPAGES = flask_app.WEBPAGES
         self.app = flask_app.app.test_client()
         self.app.testing = True
@@ -67,6 +70,45 @@ class TestFlaskApp(unittest.TestCase):
         assert 'Welcome' in result.data.decode()
         assert __version__.__version__ in result.data.decode()
 
+    def test_statistics_page(self):
+        ''' ensures the statistics page shows running totals '''
+        result = self.app.get(self.WEBPAGES.Statistics.value)
+        assert result.status_code == 200
+        assert 'DebuggerCalls' not in result.data.decode()
+        assert 'SymbolIndexEntries' in result.data.decode()
+
+        with Storage() as s:
+            s.addStatistics({'DebuggerCalls' : 4, 'DebuggerCallSeconds' : 10})
+
+        result = self.app.get(self.WEBPAGES.Statistics.value)
+        assert result.status_code == 200
+        assert 'DebuggerCalls' in result.data.decode()
+        assert 'DebuggerCallAverageSeconds' in result.data.decode()
+        assert '2.5' in result.data.decode()
+        assert 'SymbolCacheHitRate' not in result.data.decode()
+
+        with Storage() as s:
+            s.addStatistics({'SymbolCacheHits' : 3, 'SymbolCacheMisses' : 1})
+
+        result = self.app.get(self.WEBPAGES.Statistics.value)
+        assert 'SymbolCacheHitRate' in result.data.decode()
+        assert '0.75' in result.data.decode()
+        assert 'DedupBytesSaved<' not in result.data.decode()
+
+        with Storage() as s:
+            s.addStatistics({'DedupBlobBytesSaved' : 1000, 'DedupSymbolStoreBytesSkipped' : 234})
+
+        result = self.app.get(self.WEBPAGES.Statistics.value)
+        assert 'DedupBytesSaved' in result.data.decode()
+        assert '1234' in result.data.decode()
+
+        # the symbol server index's statistics may not all be there
+        import flask_app
+        with unittest.mock.patch.object(flask_app.getSymbolServer().index, 'getStatistics', return_value={'SymbolIndexMisses' : 2}):
+            result = self.app.get(self.WEBPAGES.Statistics.value)
+        assert result.status_code == 200
+        assert 'SymbolIndexHitRate' in result.data.decode()
+
     def test_apidoc_page(self):
         ''' ensures we can show the apidocs page '''
         result = self.app.get(self.WEBPAGES.API_Docs.value)
@@ -103,6 +145,49 @@ class TestFlaskApp(unittest.TestCase):
         assert result.data.decode().count('MyTag17') == 1
         assert result.status_code == 200
 
+    def test_show_table_pages_and_filters(self):
+        ''' ensures the table view is paged and can be filtered on the server '''
+        with Storage() as storage:
+            for i in range(5):
+                storage.addFromAddRequest(MockRequest({
+                    'CrashDumpFile' : io.BytesIO(b'abcdefghijklmnopqrstuvwxyz')
+                }, {
+                    'Application' : 'MyApp',
+                    'OperatingSystem' : 'Windows',
+                    'Tag' : 'PageTag%d' % i,
+                    'ApplicationVersion' : 'Even' if i % 2 == 0 else 'Odd',
+                }))
+
+        url = url_for_ish(self.WEBPAGES.View_Application_Table, applicationName="MyApp")
+        result = self.app.get(url + '?pageSize=2')
+        data = result.data.decode()
+        assert result.status_code == 200
+        assert 'PageTag4' in data and 'PageTag3' in data
+        assert 'PageTag2' not in data
+        assert data.index('PageTag4') < data.index('PageTag3')
+
+        # follow the 'Older' link
+        olderUrl = data.split('Older')[0].rsplit('href="', 1)[1].split('"')[0].replace('&amp;', '&')
+        assert 'before=' in olderUrl
+        data = self.app.get(olderUrl).data.decode()
+        assert 'PageTag2' in data and 'PageTag1' in data
+        assert 'PageTag3' not in data and 'PageTag0' not in data
+        assert 'Newest' in data
+
+        # filtering happens before paging
+        data = self.app.get(url + '?pageSize=2&ApplicationVersion=Even').data.decode()
+        assert 'PageTag4' in data and 'PageTag2' in data
+        assert 'PageTag3' not in data
+        assert 'Older' in data
+
+        data = self.app.get(url + '?Tag=PageTag1').data.decode()
+        assert 'PageTag1' in data
+        assert 'PageTag0' not in data and 'PageTag2' not in data
+        assert 'Older' not in data
+
+        data = self.app.get(url + '?StartTime=2000-01-01&EndTime=2001-01-01').data.decode()
+        assert 'Table is empty' in data
+
     def test_get_file(self):
         ''' ensures that getFile is working properly '''
         request = MockRequest({
@@ -134,33 +219,170 @@ class TestFlaskApp(unittest.TestCase):
 
         self.app.get(url_for_ish(self.WEBPAGES.Get_File, applicationName="MyApp", rowUid=uid, column='SymbolsFile2Name')).status_code == 404
 
+    def test_get_file_range(self):
+        ''' ensures that getFile supports Range/If-Range requests for files in the blob store '''
+        request = MockRequest({
+            'CrashDumpFile' : io.BytesIO(b'abcdefghijklmnopqrstuvwxyz')
+        }, {
+            'Application' : 'MyApp',
+            'OperatingSystem' : 'Windows',
+        })
+
+        with Storage() as storage:
+            uid = storage.addFromAddRequest(request).split('UID:')[-1].strip()
+
+        url = url_for_ish(self.WEBPAGES.Get_File, applicationName="MyApp", rowUid=uid, column='CrashDumpFile')
+        result = self.app.get(url)
+        assert result.status_code == 200
+        assert result.data == b'abcdefghijklmnopqrstuvwxyz'
+        etag = result.headers['ETag']
+
+        result = self.app.get(url, headers={'Range' : 'bytes=2-5'})
+        assert result.status_code == 206
+        assert result.data == b'cdef'
+        assert result.headers['Content-Range'] == 'bytes 2-5/26'
+        assert result.headers['Accept-Ranges'] == 'bytes'
+
+        result = self.app.get(url, headers={'Range' : 'bytes=20-', 'If-Range' : etag})
+        assert result.status_code == 206
+        assert result.data == b'uvwxyz'
+
+        # a stale If-Range means the whole file comes back
+        result = self.app.get(url, headers={'Range' : 'bytes=20-', 'If-Range' : '"not-the-etag"'})
+        assert result.status_code == 200
+        assert result.data == b'abcdefghijklmnopqrstuvwxyz'
+
     def test_get_analysis(self):
         ''' ensures that getAnalysis is working '''
         url = url_for_ish(self.WEBPAGES.Get_Analysis, applicationName='app', rowUid='rowUid')
-        with unittest.mock.patch('storage.Storage.getAnalysis') as getAnalysis:
-            getAnalysis.return_value = 'AnalysisReturn'
+        with unittest.mock.patch('storage.Storage.requestAnalysis') as requestAnalysis:
+            requestAnalysis.return_value = ('AnalysisReturn', None)
             result = self.app.get(url)
             assert 'AnalysisReturn' in result.data.decode()
-            getAnalysis.assert_called_with('app', 'rowUid', True)
+            requestAnalysis.assert_called_with('app', 'rowUid', True)
 
-        with unittest.mock.patch('storage.Storage.getAnalysis') as getAnalysis:
-            getAnalysis.return_value = 'AnalysisReturn'
+        with unittest.mock.patch('storage.Storage.requestAnalysis') as requestAnalysis:
+            requestAnalysis.return_value = ('AnalysisReturn', None)
             result = self.app.get(url + "?useCache=True")
             assert 'AnalysisReturn' in result.data.decode()
-            getAnalysis.assert_called_with('app', 'rowUid', True)
+            requestAnalysis.assert_called_with('app', 'rowUid', True)
 
-        with unittest.mock.patch('storage.Storage.getAnalysis') as getAnalysis:
-            getAnalysis.return_value = 'AnalysisReturn'
+        with unittest.mock.patch('storage.Storage.requestAnalysis') as requestAnalysis:
+            requestAnalysis.return_value = ('AnalysisReturn', None)
             result = self.app.get(url + "?useCache=False")
             assert 'AnalysisReturn' in result.data.decode()
-            getAnalysis.assert_called_with('app', 'rowUid', False)
+            requestAnalysis.assert_called_with('app', 'rowUid', False)
+
+    def test_get_analysis_not_ready(self):
+        ''' ensures that getAnalysis gives back the job status right away if analysis isn't done '''
+        url = url_for_ish(self.WEBPAGES.Get_Analysis, applicationName='app', rowUid='rowUid')
+        with unittest.mock.patch('storage.Storage.requestAnalysis') as requestAnalysis:
+            requestAnalysis.return_value = (None, unittest.mock.Mock(Status='queued', Error=None))
+            result = self.app.get(url + "?useCache=False")
+            assert result.status_code == 202
+            assert 'queued' in result.data.decode()
+
+            # refreshes using the cache
+            assert 'http-equiv="refresh"' in result.data.decode()
+            assert 'useCache=False' not in result.data.decode()
+
+            # says if nothing is going to work the queue
+            assert 'No analysis worker is running' in result.data.decode()
+            with Storage() as s:
+                s.recordAnalysisWorkerHeartbeat('theWorker')
+            assert 'No analysis worker is running' not in self.app.get(url).data.decode()
+
+        with unittest.mock.patch('storage.Storage.requestAnalysis') as requestAnalysis:
+            requestAnalysis.return_value = (None, unittest.mock.Mock(Status='failed', Error='TheDebuggerBroke'))
+            result = self.app.get(url)
+            assert result.status_code == 200
+            assert 'TheDebuggerBroke' in result.data.decode()
+            assert 'http-equiv="refresh"' not in result.data.decode()
+
+    def test_set_application_options(self):
+        ''' ensures application options can be set via the endpoint '''
+        url = url_for_ish(self.WEBPAGES.Set_Application_Options, applicationName='MyApp')
+        assert self.app.post(url, data={'AllThreads' : 'True'}).status_code == 404
+
+        with Storage() as s:
+            assert s.applicationAdd('MyApp')
+
+        result = self.app.post(url, data={'AllThreads' : 'True'})
+        assert result.status_code == 200
+        with Storage(readOnly=True) as s:
+            assert s.getApplicationOption('MyApp', 'AllThreads') is True
+
+        assert self.app.post(url, data={'AllThreads' : 'Maybe'}).status_code == 401
+        assert self.app.post(url, data={}).status_code == 200
+        assert self.app.post(url, data={'AllThreads' : 'False'}).status_code == 200
+        with Storage(readOnly=True) as s:
+            assert s.getApplicationOption('MyApp', 'AllThreads') is False
+
+    def test_has_file(self):
+        ''' ensures clients can check if a file was already added for an application by its hash '''
+        content = getUniqueId().encode()
+        fileHash = hashlib.sha256(content).hexdigest()
+        url = url_for_ish(self.WEBPAGES.Has_File, applicationName='MyApp', fileHash=fileHash)
+        assert self.app.get(url).status_code == 404
+        assert self.app.head(url).status_code == 404
+        assert self.app.get(url_for_ish(self.WEBPAGES.Has_File, applicationName='MyApp', fileHash='notahash')).status_code == 404
+
+        with Storage() as storage:
+            storage.addFromAddRequest(MockRequest({
+                'SymbolsFile' : io.BytesIO(content)
+            }, {
+                'Application' : 'MyApp',
+                'OperatingSystem' : 'Windows',
+            }))
+
+        result = self.app.get(url)
+        assert result.status_code == 200
+        assert result.data.decode() == str(len(content))
+        assert self.app.head(url).status_code == 200
+        assert self.app.get(url_for_ish(self.WEBPAGES.Has_File, applicationName='MyApp', fileHash=fileHash.upper())).status_code == 200
+
+        # another application doesn't get to see (or reference) it
+        assert self.app.get(url_for_ish(self.WEBPAGES.Has_File, applicationName='OtherApp', fileHash=fileHash)).status_code == 404
+
+    def test_has_windows_symbols(self):
+        ''' ensures clients can check if a symbols file is already here by its name and symbol store id '''
+        content = getUniqueId().encode()
+        fileHash = hashlib.sha256(content).hexdigest()
+        url = url_for_ish(self.WEBPAGES.Has_Windows_Symbols, fileName='TheCrasher.pdb', fileId='ABC1')
+        assert self.app.get(url).status_code == 404
+
+        with Storage() as storage:
+            storage.blobStore.addFromFile(io.BytesIO(content))
+            storage.setSymbolStoreFileHash('TheCrasher.pdb', 'ABC1', fileHash)
+
+        result = self.app.get(url)
+        assert result.status_code == 200
+        assert result.data.decode() == fileHash
+        assert self.app.head(url).status_code == 200
+        assert self.app.get(url_for_ish(self.WEBPAGES.Has_Windows_Symbols, fileName='thecrasher.PDB', fileId='abc1')).status_code == 200
+        assert self.app.get(url_for_ish(self.WEBPAGES.Has_Windows_Symbols, fileName='TheCrasher.pdb', fileId='ABC2')).status_code == 404
 
     def test_get_windows_symbols(self):
-        ''' ensures that the windows symbol server endpoint is working '''
-        url = url_for_ish(self.WEBPAGES.Get_Windows_Symbols, path='test_path')
-        with unittest.mock.patch('flask.send_file') as send_file_mock:
-            with unittest.mock.patch('storage.Storage.getWindowsSymbolFilePath', return_value=None) as mock:
-                self.app.get(url)
-                mock.assert_called_with('test_path')
-
-            send_file_mock.assert_called_once()
\ No newline at end of file
+        ''' ensures Windows symbols are served from the symbol store without opening Storage '''
+        import flask_app
+        # made once, then reused
+        symbolServer = flask_app.getSymbolServer()
+        assert flask_app.getSymbolServer() is symbolServer
+
+        relativePath = os.path.join('TheCrasher.pdb', 'ABC1', 'TheCrasher.pdb')
+        fullPath = os.path.join(symbolServer.path, relativePath)
+        os.makedirs(os.path.dirname(fullPath), exist_ok=True)
+        with open(fullPath, 'wb') as f:
+            f.write(b'abcdefghijklmnopqrstuvwxyz')
+
+        try:
+            with unittest.mock.patch.object(flask_app, 'Storage', side_effect=AssertionError("Storage should not be used")):
+                url = url_for_ish(self.WEBPAGES.Get_Windows_Symbols, path=relativePath.replace(os.sep, '/'))
+                result = self.app.get(url)
+                assert result.status_code == 200
+                assert result.data == b'abcdefghijklmnopqrstuvwxyz'
+
+                assert self.app.get(url, headers={'If-None-Match' : result.headers['ETag']}).status_code == 304
+                assert self.app.get(url_for_ish(self.WEBPAGES.Get_Windows_Symbols, path='TheCrasher.pdb/ABC2/TheCrasher.pdb')).status_code == 404
+        finally:
+            shutil.rmtree(os.path.join(symbolServer.path, 'TheCrasher.pdb'))
\ No newline at end of file
@@ -1,24 +1,32 @@
 ''' file for the storage object for pda '''
 
+import contextlib
 import datetime
 import enum
 import os
 import pickle
 import threading
+import time
 
 import flask
 
 import _html
 from abstract_database import AbstractDatabase, Column
+from blob_store import BlobStore
 from csmlog_setup import getLogger
-from utility import getUniqueId, getUniqueTableName, temporaryFilePath
+from debugger import Debugger
+from symbol_cache import DownstreamSymbolCache
+from symbol_server import SymbolServer
+from utility import callEvery, getUniqueId, getUniqueTableName, linkOrCopyFile, temporaryFilePath
 from windbg import WinDbg
+from windows_symbol_file import getSymbolStoreId
 from windows_symbol_store import WindowsSymbolStore
 
 THIS_DIR = os.path.abspath(os.path.dirname(__file__))
 ROOT_STORAGE_LOCATION = os.path.join(THIS_DIR, 'storage')
 if not os.path.isdir(ROOT_STORAGE_LOCATION): os.mkdir(ROOT_STORAGE_LOCATION)
 WINDOWS_SYMBOL_STORE = os.path.join(ROOT_STORAGE_LOCATION, 'WindowsSymbols')
+BLOB_STORE_LOCATION = os.path.join(ROOT_STORAGE_LOCATION, 'Blobs')
 
 # the following is the format of tables needed to run
 REQUIRED_TABLES = {
@@ -28,6 +36,75 @@ REQUIRED_TABLES = {
     ],
 }
 
+# unique indexes (column name or tuple of column names) on the required tables
+REQUIRED_TABLES_UNIQUE_INDEXES = {
+    'Applications': ['Name', 'ApplicationTable'],
+}
+
+# per application options, kept in columns of the Applications table (see Storage.setApplicationOption()).
+#  Options an application hasn't set get the default from APPLICATION_OPTIONS_DEFAULTS.
+APPLICATION_OPTIONS_COLUMNS = [
+    Column('AllThreads', 'INTEGER'), # if 1, analysis gets every thread's stack (instead of just the one that crashed)
+]
+APPLICATION_OPTIONS_DEFAULTS = {
+    'AllThreads' : False,
+}
+
+# columns of the table keeping track of which schema migrations have been applied
+SCHEMA_VERSIONS_COLUMNS = [
+    Column('Version'    , 'INTEGER'), # schema version (see Storage.SCHEMA_MIGRATIONS)
+    Column('Description', 'TEXT'),    # what the migration did
+    Column('Timestamp'  , 'TEXT'),    # when the migration was applied
+]
+
+# columns of the queue of crash dump analysis jobs (worked by analysis_worker.AnalysisWorker)
+ANALYSIS_JOBS_COLUMNS = [
+    Column('ApplicationName', 'TEXT'),    # application the crash dump belongs to
+    Column('RowUid'         , 'TEXT'),    # UID of the row (in the application's table) with the crash dump
+    Column('Status'         , 'TEXT'),    # see AnalysisJobStatus
+    Column('Priority'       , 'INTEGER'), # jobs with a higher priority are claimed first
+    Column('QueuedTimestamp', 'TEXT'),    # when the job was queued
+    Column('StartTimestamp' , 'TEXT'),    # when a worker claimed the job
+    Column('EndTimestamp'   , 'TEXT'),    # when the job finished
+    Column('WorkerId'       , 'TEXT'),    # the worker that claimed the job
+    Column('Error'          , 'TEXT'),    # why the job failed (if it did)
+]
+
+# columns of the table of analysis workers (see analysis_worker.AnalysisWorker) and when each was last known to be alive
+ANALYSIS_WORKERS_COLUMNS = [
+    Column('WorkerId'          , 'TEXT'), # the worker (like on AnalysisJobs)
+    Column('HeartbeatTimestamp', 'REAL'), # time.time() of the worker's last heartbeat
+]
+
+# analysis job priorities (higher is claimed first). Someone waiting on an analysis page jumps ahead of
+#  the backlog of crash dumps queued as they were uploaded.
+ANALYSIS_PRIORITY_BACKLOG = 0
+ANALYSIS_PRIORITY_INTERACTIVE = 10
+
+# indexes on the analysis job queue. The first backs claiming the next job, the second finding a row's job.
+ANALYSIS_JOBS_INDEXES = [('Status', 'Priority'), ('ApplicationName', 'RowUid')]
+
+# columns added to the analysis job queue so a claim can be told apart from one left behind by a process that went away
+ANALYSIS_JOBS_CLAIM_COLUMNS = [
+    Column('HeartbeatTimestamp', 'REAL'), # time.time() of the last heartbeat from whoever claimed the job (see Storage.analysisJobHeartbeat())
+]
+
+# columns of the table of running totals (like the number of debugger calls made, and how long they took)
+STATISTICS_COLUMNS = [
+    Column('Name' , 'TEXT'), # name of the statistic
+    Column('Value', 'REAL'), # its running total
+]
+
+# columns of the table mapping files in the Windows symbol store to the blob they were added from, so clients can ask if a
+#  symbols file or executable is already here by its symbol store id (like a PDB's GUID and age) without hashing it
+SYMBOL_STORE_FILES_COLUMNS = [
+    Column('SymbolStoreKey', 'TEXT'), # <name>/<id> of the file in the symbol store (lower case)
+    Column('Hash'          , 'TEXT'), # blob store hash of the file
+]
+
+# uploaded files (one of these, in BLOB_COLUMNS) that can be given to addFromAddRequest() by hash (of a file the application already has)
+ADD_REQUEST_FILE_COLUMNS = ('SymbolsFile', 'ExecutableFile', 'CrashDumpFile')
+
 # these columns are used in all application tables
 APPLICATION_UPLOADS_COLUMNS = [
     Column('UID'                , "TEXT"), # Unique Id for this transaction
@@ -36,15 +113,74 @@ APPLICATION_UPLOADS_COLUMNS = [
     Column('OperatingSystem'    , 'TEXT'), # OS for this artifact
     Column('Tag'                , 'TEXT'), # optional tag for this
     Column('ApplicationVersion' , 'TEXT'), # optional version for the app this artifact came from
-    Column('SymbolsFile'        , 'BLOB'), # blob of associated symbols file
-    Column('SymbolsFileName'    , 'TEXT'), # name of symbols file
-    Column('ExecutableFile'     , 'BLOB'), # blob of associated executable file
-    Column('ExecutableFileName' , 'TEXT'), # name of executable file
-    Column('CrashDumpFile'      , 'BLOB'), # blob of associated crash dump file
-    Column('CrashDumpFileName'  , 'TEXT'), # name of crash dump file
-    Column('CrashDumpAnalysis'  , 'BLOB'), # blob of the crash dump analysis file (pickled)
+    Column('SymbolsFileHash'      , 'TEXT'),    # blob store hash of associated symbols file
+    Column('SymbolsFileSize'      , 'INTEGER'), # size (in bytes) of symbols file
+    Column('SymbolsFileName'      , 'TEXT'),    # name of symbols file
+    Column('ExecutableFileHash'   , 'TEXT'),    # blob store hash of associated executable file
+    Column('ExecutableFileSize'   , 'INTEGER'), # size (in bytes) of executable file
+    Column('ExecutableFileName'   , 'TEXT'),    # name of executable file
+    Column('CrashDumpFileHash'    , 'TEXT'),    # blob store hash of associated crash dump file
+    Column('CrashDumpFileSize'    , 'INTEGER'), # size (in bytes) of crash dump file
+    Column('CrashDumpFileName'    , 'TEXT'),    # name of crash dump file
+    Column('CrashDumpAnalysisHash', 'TEXT'),    # blob store hash of the crash dump analysis (pickled)
+    Column('CrashDumpAnalysisSize', 'INTEGER'), # size (in bytes) of the crash dump analysis
+]
+
+# indexes on all application tables. UID is how a row is looked up. The others back filtering the table view
+#  (each index entry also holds the IdKey, so a filtered page is still a range scan).
+APPLICATION_UPLOADS_UNIQUE_INDEXES = ['UID']
+APPLICATION_UPLOADS_INDEXES = ['Tag', 'ApplicationVersion', 'OperatingSystem', 'Timestamp']
+
+# indexes on all application tables that back checking if the application already has a file (see applicationHasBlob())
+APPLICATION_UPLOADS_HASH_INDEXES = [column + 'Hash' for column in ADD_REQUEST_FILE_COLUMNS]
+
+# these are the logical columns whose data lives in the blob store. Application tables keep
+#  <Column>Hash and <Column>Size for them. (Older versions kept the data directly in a BLOB column of the same name.)
+BLOB_COLUMNS = ('SymbolsFile', 'ExecutableFile', 'CrashDumpFile', 'CrashDumpAnalysis')
+
+# sqlite tuning applied to each new database connection. WAL journaling lets readers run in parallel with a writer.
+DATABASE_TUNING_PROFILES = {
+    'default' : {
+        'journal_mode' : 'WAL',
+        'synchronous'  : 'NORMAL',  # durable at checkpoints, a lot fewer fsyncs
+        'mmap_size'    : 268435456, # 256 MB
+        'cache_size'   : -65536,    # 64 MB (negative is KB)
+    },
+    'durable' : {
+        'journal_mode' : 'WAL',
+        'synchronous'  : 'FULL',
+        'mmap_size'    : 268435456,
+        'cache_size'   : -65536,
+    },
+    'low_memory' : {
+        'journal_mode' : 'WAL',
+        'synchronous'  : 'NORMAL',
+        'mmap_size'    : 0,
+        'cache_size'   : -2000,
+    },
+}
+
+# what is selected from an application table to view it. No file data is touched, just names.
+APPLICATION_TABLE_VIEW_COLUMNS = [
+    'IdKey',
+    'UID',
+    'Timestamp',
+    'UploaderIP',
+    'OperatingSystem',
+    'Tag',
+    'ApplicationVersion',
+    'SymbolsFileName AS SymbolsFile',
+    'ExecutableFileName AS ExecutableFile',
+    'CrashDumpFileName AS CrashDumpFile',
 ]
 
+# columns an application table view can be filtered on (exact match)
+APPLICATION_TABLE_FILTERS = ('Tag', 'ApplicationVersion', 'OperatingSystem')
+
+# the application table view is shown a page at a time
+APPLICATION_TABLE_DEFAULT_PAGE_SIZE = 100
+APPLICATION_TABLE_MAX_PAGE_SIZE = 1000
+
 logger = getLogger(__file__)
 
 class SupportedOperatingSystems(enum.Enum):
@@ -61,53 +197,230 @@ class SupportedOperatingSystems(enum.Enum):
         ''' gets a list of values for this enum '''
         return [v.value for v in cls.__members__.values()]
 
+class AnalysisJobStatus(enum.Enum):
+    ''' enum for the states of a job in the analysis job queue '''
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
 class Storage(object):
     ''' object that keeps track of the various storage needed by this object '''
     DATABASE_FILE = os.path.join(ROOT_STORAGE_LOCATION, 'database.sqlite')
-    _LOCK = threading.Lock()
+    DATABASE_TUNING_PROFILE = 'default' # key in DATABASE_TUNING_PROFILES
+    BLOB_STORE_DIRECTORY = BLOB_STORE_LOCATION
+    WINDOWS_SYMBOL_STORE_DIRECTORY = WINDOWS_SYMBOL_STORE
+
+    # if True, each uploaded crash dump is queued for analysis (at ANALYSIS_PRIORITY_BACKLOG) so it is ready before anyone asks.
+    #  How many run at once is bounded by the number of analysis workers.
+    ANALYZE_ON_UPLOAD = True
+
+    # the Debugger class used to analyze crash dumps from each supported operating system
+    DEBUGGERS = {
+        SupportedOperatingSystems.WINDOWS.value : WinDbg,
+    }
+
+    # an analysis worker without a heartbeat in this long is no longer counted as alive (see getLiveAnalysisWorkerCount())
+    ANALYSIS_WORKER_TIMEOUT_SECONDS = 30
+
+    # whoever is running an analysis job records a heartbeat on it this often. A running job without one in
+    #  ANALYSIS_JOB_CLAIM_TIMEOUT_SECONDS was left behind (its process went away), so it can be reclaimed.
+    ANALYSIS_JOB_HEARTBEAT_INTERVAL_SECONDS = 10
+    ANALYSIS_JOB_CLAIM_TIMEOUT_SECONDS = 60
+
+    # database files (per process) whose schema has already been brought up to date by migrate()
+    _MIGRATED_DATABASES = set()
+    _MIGRATION_LOCK = threading.Lock()
+
+    def __init__(self, readOnly=False):
+        ''' initializer. If readOnly is True, this is only going to be used to look at things. Read only storage runs in parallel with
+        other readers and with a writer. Otherwise the database's write lock is taken on entry, so writers are serialized by sqlite itself. '''
+        self.readOnly = readOnly
+
     def __enter__(self):
         ''' called when entering via a context manager '''
-        Storage._LOCK.acquire()
-        self.database = AbstractDatabase(self.DATABASE_FILE, commitOnClose=True)
-        self.database.open()
-        self.windowsSymbolStore = WindowsSymbolStore(WINDOWS_SYMBOL_STORE)
-        self._setupStorage()
+        self.migrate()
+        self._open()
         return self
 
     def __exit__(self, type, value, traceback):
         ''' called when exiting via a context manager '''
         self.database.close()
-        Storage._LOCK.release()
 
-    def _setupStorage(self):
-        ''' called to ensure the environment is ready for storage, etc. '''
-        # Ensure our storage folder exists
+    def _open(self):
+        ''' opens the database (and the other stores) for use '''
+        self.database = AbstractDatabase(self.DATABASE_FILE, commitOnClose=True, pragmas=DATABASE_TUNING_PROFILES[self.DATABASE_TUNING_PROFILE],
+                                         pooled=True, immediate=not self.readOnly)
+        self.database.open()
         try:
-            os.makedirs(ROOT_STORAGE_LOCATION)
+            self.blobStore = BlobStore(self.BLOB_STORE_DIRECTORY)
+            self.windowsSymbolStore = WindowsSymbolStore(self.WINDOWS_SYMBOL_STORE_DIRECTORY)
         except:
-            pass
+            self.database.close()
+            raise
 
-        # ensure we have required table(s)
+    @classmethod
+    def closePooledConnections(cls):
+        ''' closes idle pooled connections to our database. Should be called before deleting/replacing the database file. '''
+        AbstractDatabase.closePooledConnections(cls.DATABASE_FILE)
+
+    @classmethod
+    def migrate(cls):
+        ''' brings the database schema up to date by running any SCHEMA_MIGRATIONS newer than the version recorded in SchemaVersions.
+        This is done once per process (at startup or on the first use of Storage). After that it costs nothing. '''
+        if cls.DATABASE_FILE in Storage._MIGRATED_DATABASES:
+            return
+
+        with Storage._MIGRATION_LOCK:
+            if cls.DATABASE_FILE in Storage._MIGRATED_DATABASES:
+                return
+
+            # the write lock is held for the whole migration, so other processes starting up at the same time wait on us
+            storage = cls()
+            storage._open()
+            try:
+                storage._runMigrations()
+            except:
+                storage.database.commitOnClose = False
+                raise
+            finally:
+                storage.database.close()
+
+            Storage._MIGRATED_DATABASES.add(cls.DATABASE_FILE)
+
+    def getSchemaVersion(self):
+        ''' gets the latest schema version applied to the database (0 if none) '''
+        if not self.database.tableExists('SchemaVersions'):
+            return 0
+
+        return self.database.execute("SELECT MAX(Version) AS Version FROM SchemaVersions").fetchone().Version or 0
+
+    def _runMigrations(self):
+        ''' runs each pending migration (in order) and records it in SchemaVersions '''
+        if not self.database.tableExists('SchemaVersions'):
+            assert self.database.createTable('SchemaVersions', SCHEMA_VERSIONS_COLUMNS)
+
+        currentVersion = self.getSchemaVersion()
+        for version, migration in self.SCHEMA_MIGRATIONS:
+            if version <= currentVersion:
+                continue
+
+            logger.info("Migrating database schema to version %d: %s" % (version, migration.__doc__.strip()))
+            migration(self)
+            assert self.database.addRow('SchemaVersions', {
+                'Version' : version,
+                'Description' : migration.__doc__.strip(),
+                'Timestamp' : str(datetime.datetime.now()),
+            })
+
+    def _migrateCreateRequiredTables(self):
+        ''' create the required tables '''
         for requiredTablesName, requiredTableColumns in REQUIRED_TABLES.items():
             if not self.database.tableExists(requiredTablesName):
                 assert self.database.createTable(requiredTablesName, [])
             if not self.database.ensureTableHasAtLeastTheseColumns(requiredTablesName, requiredTableColumns):
                 raise RuntimeError("Unable to ensure we have needed table: %s" % requiredTablesName)
 
+    def _migrateApplicationTablesToBlobStore(self):
+        ''' ensure application tables have all columns and move inline files to the blob store '''
         for tableRow in self.database.execute("SELECT * FROM Applications").fetchall():
             if not self.database.tableExists(tableRow.ApplicationTable):
                 assert self.database.createTable(tableRow.ApplicationTable, [])
             assert self.database.ensureTableHasAtLeastTheseColumns(tableRow.ApplicationTable, APPLICATION_UPLOADS_COLUMNS)
+            self._moveInlineBlobsToBlobStore(tableRow.ApplicationTable)
+
+    def _migrateAddIndexes(self):
+        ''' add indexes for lookups by application name, table name and row UID (and for filtering) '''
+        for tableName, uniqueIndexes in REQUIRED_TABLES_UNIQUE_INDEXES.items():
+            if not self.database.ensureTableHasAtLeastTheseColumns(tableName, REQUIRED_TABLES[tableName], uniqueIndexes=uniqueIndexes):
+                raise RuntimeError("Unable to add indexes to table: %s" % tableName)
+
+        for tableRow in self.database.execute("SELECT * FROM Applications").fetchall():
+            if not self.database.ensureTableHasAtLeastTheseColumns(tableRow.ApplicationTable, APPLICATION_UPLOADS_COLUMNS,
+                                                                   uniqueIndexes=APPLICATION_UPLOADS_UNIQUE_INDEXES, indexes=APPLICATION_UPLOADS_INDEXES):
+                raise RuntimeError("Unable to add indexes to table: %s" % tableRow.ApplicationTable)
+
+    def _moveInlineBlobsToBlobStore(self, tableName):
+        ''' older versions kept files directly in BLOB columns of the application tables.
+        Moves any of those into the blob store (one row at a time) and clears the inline copy. '''
+        columnNames = [a.name for a in self.database.getTableInfo(tableName)]
+        for column in BLOB_COLUMNS:
+            if column not in columnNames:
+                continue
+
+            idKeys = [row.IdKey for row in self.database.execute("SELECT IdKey FROM `%s` WHERE `%s` IS NOT NULL" % (tableName, column)).fetchall()]
+            for idKey in idKeys:
+                data = self.database.execute("SELECT `%s` FROM `%s` WHERE IdKey = ?" % (column, tableName), [idKey]).fetchone()[0]
+                blobHash, size = self.blobStore.add(data)
+                self.database.execute("UPDATE `%s` SET `%sHash` = ?, `%sSize` = ?, `%s` = NULL WHERE IdKey = ?" % (tableName, column, column, column),
+                                      [blobHash, size, idKey])
+
+            if idKeys:
+                logger.info("Moved %d inline %s blob(s) from %s to the blob store" % (len(idKeys), column, tableName))
+
+    def _migrateCreateAnalysisJobs(self):
+        ''' add the analysis job queue '''
+        if not self.database.tableExists('AnalysisJobs'):
+            assert self.database.createTable('AnalysisJobs', ANALYSIS_JOBS_COLUMNS, indexes=ANALYSIS_JOBS_INDEXES)
+
+    def _migrateCreateStatistics(self):
+        ''' add the statistics table '''
+        if not self.database.tableExists('Statistics'):
+            assert self.database.createTable('Statistics', STATISTICS_COLUMNS, uniqueIndexes=['Name'])
+
+    def _migrateAddApplicationOptions(self):
+        ''' add per application options to the Applications table '''
+        if not self.database.ensureTableHasAtLeastTheseColumns('Applications', REQUIRED_TABLES['Applications'] + APPLICATION_OPTIONS_COLUMNS):
+            raise RuntimeError("Unable to add application options to table: Applications")
+
+    def _migrateCreateSymbolStoreFiles(self):
+        ''' add the table mapping symbol store files to blobs '''
+        if not self.database.tableExists('SymbolStoreFiles'):
+            assert self.database.createTable('SymbolStoreFiles', SYMBOL_STORE_FILES_COLUMNS, uniqueIndexes=['SymbolStoreKey'])
+
+    def _migrateCreateAnalysisWorkers(self):
+        ''' add the table of analysis worker heartbeats '''
+        if not self.database.tableExists('AnalysisWorkers'):
+            assert self.database.createTable('AnalysisWorkers', ANALYSIS_WORKERS_COLUMNS, uniqueIndexes=['WorkerId'])
+
+    def _migrateAddAnalysisJobHeartbeats(self):
+        ''' add heartbeats to analysis jobs (so ones left running can be reclaimed) '''
+        if not self.database.ensureTableHasAtLeastTheseColumns('AnalysisJobs', ANALYSIS_JOBS_COLUMNS + ANALYSIS_JOBS_CLAIM_COLUMNS):
+            raise RuntimeError("Unable to add heartbeats to table: AnalysisJobs")
+
+    def _migrateAddApplicationHashIndexes(self):
+        ''' add indexes for checking if an application already has a file (by its hash) '''
+        for tableRow in self.database.execute("SELECT * FROM Applications").fetchall():
+            if not self.database.ensureTableHasAtLeastTheseColumns(tableRow.ApplicationTable, APPLICATION_UPLOADS_COLUMNS,
+                                                                   indexes=APPLICATION_UPLOADS_HASH_INDEXES):
+                raise RuntimeError("Unable to add indexes to table: %s" % tableRow.ApplicationTable)
+
+    # ordered (schema version, migration) pairs. Each migration's docstring is recorded as its description.
+    #  Never change or remove one that has shipped, add a new version to the end instead.
+    SCHEMA_MIGRATIONS = [
+        (1, _migrateCreateRequiredTables),
+        (2, _migrateApplicationTablesToBlobStore),
+        (3, _migrateAddIndexes),
+        (4, _migrateCreateAnalysisJobs),
+        (5, _migrateCreateStatistics),
+        (6, _migrateAddApplicationOptions),
+        (7, _migrateCreateSymbolStoreFiles),
+        (8, _migrateCreateAnalysisWorkers),
+        (9, _migrateAddAnalysisJobHeartbeats),
+        (10, _migrateAddApplicationHashIndexes),
+    ]
 
     def applicationExists(self, name):
         ''' called to check if an application exists in our tables '''
-        return bool(self.database.execute('SELECT * FROM Applications WHERE Name="%s"' % name).fetchone())
+        return bool(self.database.execute('SELECT * FROM Applications WHERE Name = ?', [name]).fetchone())
 
     def applicationAdd(self, name):
         ''' called to add a table for this application '''
         applicationTableName = getUniqueTableName()
 
-        if not self.applicationExists(name) and self.database.createTable(applicationTableName, APPLICATION_UPLOADS_COLUMNS):
+        if not self.applicationExists(name) and self.database.createTable(applicationTableName, APPLICATION_UPLOADS_COLUMNS,
+                                                                          uniqueIndexes=APPLICATION_UPLOADS_UNIQUE_INDEXES,
+                                                                          indexes=APPLICATION_UPLOADS_INDEXES + APPLICATION_UPLOADS_HASH_INDEXES):
             if not self.database.addRow('Applications', {
                 'Name' : name,
                 'ApplicationTable' : applicationTableName
@@ -122,59 +435,173 @@ class Storage(object):
 
     def getApplicationTableName(self, applicationName):
         ''' gets an application's table name '''
-        result = self.database.execute("SELECT * FROM Applications WHERE Name=\"%s\"" % applicationName).fetchone()
+        result = self.database.execute("SELECT * FROM Applications WHERE Name = ?", [applicationName]).fetchone()
         if result:
             return result.ApplicationTable
         return False
 
     def getApplicationNameFromTable(self, tableName):
         ''' gets the name of an app from the table name '''
-        result = self.database.execute("SELECT * FROM Applications WHERE ApplicationTable=\"%s\"" % tableName).fetchone()
+        result = self.database.execute("SELECT * FROM Applications WHERE ApplicationTable = ?", [tableName]).fetchone()
         if result:
             return result.Name
         return False
 
+    def getApplicationOption(self, applicationName, option):
+        ''' gets the value of one of the given application's options (a column in APPLICATION_OPTIONS_COLUMNS).
+        Gives back the default from APPLICATION_OPTIONS_DEFAULTS if the application hasn't set it (or doesn't exist). '''
+        if option not in APPLICATION_OPTIONS_DEFAULTS:
+            raise ValueError("Unknown application option: %s" % option)
+
+        result = self.database.execute("SELECT `%s` AS Value FROM Applications WHERE Name = ?" % option, [applicationName]).fetchone()
+        if not result or result.Value is None:
+            return APPLICATION_OPTIONS_DEFAULTS[option]
+
+        return type(APPLICATION_OPTIONS_DEFAULTS[option])(result.Value)
+
+    def setApplicationOption(self, applicationName, option, value):
+        ''' sets one of the given application's options (a column in APPLICATION_OPTIONS_COLUMNS). Returns True on success '''
+        if option not in APPLICATION_OPTIONS_DEFAULTS:
+            logger.warning("Unknown application option: %s" % option)
+            return False
+
+        if not self.database.execute("UPDATE Applications SET `%s` = ? WHERE Name = ?" % option, [value, applicationName]).rowcount:
+            logger.warning("Application doesn't exist: %s" % applicationName)
+            return False
+
+        return True
+
+    def applicationHasBlob(self, applicationName, blobHash, columns=ADD_REQUEST_FILE_COLUMNS):
+        ''' checks if any of the given application's rows has the file with the given blob store hash in one of the given columns
+        (from ADD_REQUEST_FILE_COLUMNS) '''
+        tableName = self.getApplicationTableName(applicationName)
+        if not tableName:
+            return False
+
+        blobHash = blobHash.lower()
+        for column in columns:
+            if self.database.execute("SELECT IdKey FROM `%s` WHERE `%sHash` = ? LIMIT 1" % (tableName, column), [blobHash]).fetchone():
+                return True
+
+        return False
+
     def getApplicationCell(self, applicationName, rowUid, column):
-        ''' finds the application database, then goes to a specific row and returns the given column '''
+        ''' finds the application database, then goes to a specific row and returns the given column.
+        Columns in BLOB_COLUMNS are resolved through the blob store (the bytes are returned). '''
         tableName = self.getApplicationTableName(applicationName)
         if not tableName:
             logger.warning("Application doesn't exist")
             return False
 
-        result = self.database.execute("SELECT * FROM `%s` WHERE UID=\"%s\"" % (tableName, rowUid)).fetchone()
+        result = self.database.execute("SELECT * FROM `%s` WHERE UID = ?" % tableName, [rowUid]).fetchone()
         if not result:
             logger.warning("UID didn't exist: %s" % rowUid)
             return False
 
+        if column in BLOB_COLUMNS:
+            blobHash = getattr(result, column + 'Hash')
+            if not blobHash:
+                return None
+
+            blob = self.blobStore.get(blobHash)
+            if blob is None:
+                logger.error("Blob for %s (%s) is missing from the blob store" % (column, blobHash))
+                return False
+            return blob
+
         if not hasattr(result, column):
             logger.warning("Column %s doesn't exist" % column)
             return False
 
         return getattr(result, column)
 
+    def getApplicationBlobPath(self, applicationName, rowUid, column):
+        ''' like getApplicationCell() for columns in BLOB_COLUMNS, though this gives back the path of the file in the blob store
+        instead of reading it all into memory. Returns None if there is no file for this cell, False on failure. '''
+        if column not in BLOB_COLUMNS:
+            logger.warning("Column %s is not a blob column" % column)
+            return False
+
+        blobHash = self.getApplicationCell(applicationName, rowUid, column + 'Hash')
+        if not blobHash:
+            return blobHash
+
+        if not self.blobStore.exists(blobHash):
+            logger.error("Blob for %s (%s) is missing from the blob store" % (column, blobHash))
+            return False
+
+        return self.blobStore.getPath(blobHash)
+
     def setApplicationCell(self, applicationName, rowUid, column, value):
-        ''' finds the application database, then goes to a specific row and modifies the given column to the given value '''
+        ''' finds the application database, then goes to a specific row and modifies the given column to the given value.
+        Values for columns in BLOB_COLUMNS are put in the blob store (the row keeps the hash and size). '''
         tableName = self.getApplicationTableName(applicationName)
         if not tableName:
             logger.warning("Application doesn't exist")
             return False
 
-        result = self.database.execute("UPDATE `%s` SET `%s` = ? WHERE UID = ?" % (tableName, column), [value, rowUid])
+        if column in BLOB_COLUMNS:
+            blobHash, size = self.blobStore.add(value) if value is not None else (None, None)
+            result = self.database.execute("UPDATE `%s` SET `%sHash` = ?, `%sSize` = ? WHERE UID = ?" % (tableName, column, column), [blobHash, size, rowUid])
+        else:
+            result = self.database.execute("UPDATE `%s` SET `%s` = ? WHERE UID = ?" % (tableName, column), [value, rowUid])
         if not result:
             logger.warning("Unable to update cell with row UID: %s" % rowUid)
             return False
 
         return True
 
-    def getApplicationTable(self, applicationName):
-        ''' used to get back a view of the given application's table '''
+    def getApplicationTable(self, applicationName, filters=None, before=None, pageSize=APPLICATION_TABLE_DEFAULT_PAGE_SIZE):
+        ''' used to get back a view of (a page of) the given application's table, newest first.
+        filters is an optional dict with any of APPLICATION_TABLE_FILTERS (exact match) and/or StartTime/EndTime (a range on Timestamp).
+        before is the IdKey to start the page before (from the previous page's 'Older' link). Only pageSize rows are fetched. '''
         tableName = self.getApplicationTableName(applicationName)
         if not tableName:
             logger.warning("User requested application (%s) which doesn't have a matching table" % applicationName)
             flask.abort(404)
 
-        cursor = self.database.execute("SELECT * FROM %s" % tableName)
+        filters = {k : v for k, v in (filters or {}).items() if v}
+        pageSize = max(1, min(pageSize, APPLICATION_TABLE_MAX_PAGE_SIZE))
+
+        # keyset pagination: walk IdKey (the primary key, so in insertion order) backwards from the cursor
+        conditions = []
+        params = []
+        for column in APPLICATION_TABLE_FILTERS:
+            if column in filters:
+                conditions.append('`%s` = ?' % column)
+                params.append(filters[column])
+        if 'StartTime' in filters:
+            conditions.append('Timestamp >= ?')
+            params.append(filters['StartTime'])
+        if 'EndTime' in filters:
+            conditions.append('Timestamp <= ?')
+            params.append(filters['EndTime'])
+        if before is not None:
+            conditions.append('IdKey < ?')
+            params.append(before)
+
+        # only the metadata is selected. The file columns are shown as the file's name (which links to the file)
+        # one extra row is fetched to know if there is another page
+        cursor = self.database.execute("SELECT %s FROM `%s` %s ORDER BY IdKey DESC LIMIT %d" % (', '.join(APPLICATION_TABLE_VIEW_COLUMNS), tableName,
+                                       ('WHERE ' + ' AND '.join(conditions)) if conditions else '', pageSize + 1), params)
         table = _html.HtmlTable.fromCursor(cursor, classes='content', name=applicationName)
+
+        hasOlder = len(table.rows) > pageSize
+        del table.rows[pageSize:]
+
+        # the table shows the last added row first, so flip our newest-first rows
+        table.rows.reverse()
+
+        table.header = _html.getFilterForm([(c, c) for c in APPLICATION_TABLE_FILTERS] + [('StartTime', 'Start (YYYY-MM-DD HH:MM:SS)'), ('EndTime', 'End (YYYY-MM-DD HH:MM:SS)')],
+                                           filters, classes='content')
+        pageLinks = []
+        if before is not None:
+            pageLinks.append(_html.getHtmlLinkString(flask.url_for('viewApplicationTable', applicationName=applicationName, pageSize=pageSize, **filters), 'Newest'))
+        if hasOlder:
+            oldestIdKey = table.getCellFromRow(table.rows[0], 'IdKey')
+            pageLinks.append(_html.getHtmlLinkString(flask.url_for('viewApplicationTable', applicationName=applicationName, pageSize=pageSize, before=oldestIdKey, **filters), 'Older'))
+        table.footer = '<p class="content">%s</p>' % ' | '.join(pageLinks)
+
         table.addColumn('Actions')
 
         def getLinks(row):
@@ -183,7 +610,7 @@ class Storage(object):
             for columnName in 'SymbolsFile', 'ExecutableFile', 'CrashDumpFile':
                 url = flask.url_for("getFile", applicationName=applicationName, rowUid=rowUid, column=columnName)
                 index = table.tableHeaders.index(columnName)
-                cellValue = self.getApplicationCell(applicationName, rowUid, columnName + "Name")
+                cellValue = row[index]
                 if cellValue:
                     row[index] = _html.getHtmlLinkString(url, cellValue)
 
@@ -196,25 +623,51 @@ class Storage(object):
             return row
 
         table.modifyAllRows(getLinks)
-        table.removeColumns(['SymbolsFileName', 'ExecutableFileName', 'CrashDumpFileName', 'CrashDumpAnalysis'])
-
         return table
 
+    def _getCachedAnalysis(self, applicationName, rowUid):
+        ''' gets the cached Analysis object for the given rowUid. Returns None if there isn't a usable one '''
+        dataBlob = self.getApplicationCell(applicationName, rowUid, 'CrashDumpAnalysis')
+        if dataBlob:
+            logger.debug("Returning from cache, analysis: %s / %s" % (applicationName, rowUid))
+            try:
+                return pickle.loads(dataBlob)
+            except Exception as ex:
+                logger.error("Failed to de-serialize pickle data: %s" % str(ex))
+
+        return None
+
     def getAnalysis(self, applicationName, rowUid, useCache=True):
-        ''' internal function called to get the Analysis object for the given rowUid '''
+        ''' internal function called to get the Analysis object for the given rowUid.
+        This runs the debugger right here (if needed). The flask app uses requestAnalysis() (and the analysis workers) instead, to not wait on it.
+        Storage's transaction is committed while the debugger runs, so nothing else is held up. '''
         if useCache:
-            dataBlob = self.getApplicationCell(applicationName, rowUid, 'CrashDumpAnalysis')
-            if dataBlob:
-                logger.debug("Returning from cache, analysis: %s / %s" % (applicationName, rowUid))
-                try:
-                    return pickle.loads(dataBlob)
-                except Exception as ex:
-                    logger.error("Failed to de-serialize pickle data: %s" % str(ex))
+            analysis = self._getCachedAnalysis(applicationName, rowUid)
+            if analysis is not None:
+                return analysis
 
         logger.info("Attempting to generate Analysis for: %s / %s" % (applicationName, rowUid))
+        analysisInputs = self.getAnalysisInputs(applicationName, rowUid)
+
+        # let go of the database while the debugger runs
+        self.database.commit(begin=False)
+        try:
+            analysis = self.generateAnalysis(*analysisInputs)
+        finally:
+            self.database.begin()
+            self.addProcessStatistics()
 
-        crashDumpBinary = self.getApplicationCell(applicationName, rowUid, 'CrashDumpFile')
-        if not crashDumpBinary:
+        if not self.saveAnalysis(applicationName, rowUid, analysis):
+            flask.abort(500)
+
+        return analysis
+
+    def getAnalysisInputs(self, applicationName, rowUid):
+        ''' gets what is needed to analyze the given rowUid's crash dump as a tuple of:
+            (path of the crash dump in the blob store, original name of the crash dump, operating system, the AllThreads option)
+        Aborts with a 404 if the row doesn't have a crash dump. '''
+        crashDumpPath = self.getApplicationBlobPath(applicationName, rowUid, 'CrashDumpFile')
+        if not crashDumpPath:
             logger.error("Crash dump file was not available with the given uid")
             flask.abort(404)
 
@@ -223,43 +676,230 @@ class Storage(object):
             logger.error("Operating system was not available with the given uid... this should not be possible!")
             flask.abort(404)
 
-        with temporaryFilePath() as crashDumpBinaryFilePath:
-            with open(crashDumpBinaryFilePath, 'wb') as f:
-                f.write(crashDumpBinary)
+        return (crashDumpPath, self.getApplicationCell(applicationName, rowUid, 'CrashDumpFileName'), operatingSystem,
+                self.getApplicationOption(applicationName, 'AllThreads'))
 
-            if operatingSystem == SupportedOperatingSystems.WINDOWS.value:
-                debugger = WinDbg(crashDumpBinaryFilePath, WINDOWS_SYMBOL_STORE)
-            else:
-                logger.error("Unsupported OS is somehow in the database")
-                logger.abort(500)
-
-            analysis = debugger.getAnalysis()
-        analysisAsPickledData = pickle.dumps(analysis)
-        if not self.setApplicationCell(applicationName, rowUid, 'CrashDumpAnalysis', analysisAsPickledData):
+    @classmethod
+    def generateAnalysis(cls, crashDumpPath, crashDumpFileName, operatingSystem, allThreads=False):
+        ''' runs the debugger for the given operating system on the given crash dump and returns the Analysis.
+        If allThreads is True, the Analysis has every thread's stack (all gotten in the same debugger run, if the debugger can).
+        This doesn't touch the database, so it should be called without a Storage open (it can take a while). '''
+        debuggerClass = cls.DEBUGGERS.get(operatingSystem)
+        if debuggerClass is None:
+            raise ValueError("Unsupported operating system: %s" % operatingSystem)
+
+        # the debugger gets the crash dump under its original name
+        with temporaryFilePath(fileName=os.path.basename(crashDumpFileName) if crashDumpFileName else None) as crashDumpBinaryFilePath:
+            linkOrCopyFile(crashDumpPath, crashDumpBinaryFilePath)
+            debugger = debuggerClass(crashDumpBinaryFilePath, cls.WINDOWS_SYMBOL_STORE_DIRECTORY, allThreads=allThreads)
+            return debugger.getAnalysis()
+
+    def saveAnalysis(self, applicationName, rowUid, analysis):
+        ''' caches the given Analysis object for the given rowUid. Returns True on success '''
+        if not self.setApplicationCell(applicationName, rowUid, 'CrashDumpAnalysis', pickle.dumps(analysis)):
             logger.warning("Failed to save off crash dump analysis pickle data.. uid=%s" % rowUid)
+            return False
+
+        return True
+
+    def requestAnalysis(self, applicationName, rowUid, useCache=True):
+        ''' used to get the Analysis for the given rowUid without waiting on the debugger. Returns a tuple of (Analysis, job).
+        If a job for the row is queued/running, (None, that job) is given back.
+        Otherwise if useCache is True and there is a cached Analysis (or the last job failed), that is given back.
+        Otherwise a new job is queued and (None, the new job) is given back.
+        Since someone is waiting on it, the job is queued (or bumped up) to ANALYSIS_PRIORITY_INTERACTIVE. '''
+        job = self.getAnalysisJob(applicationName, rowUid)
+        if job and job.Status in (AnalysisJobStatus.QUEUED.value, AnalysisJobStatus.RUNNING.value):
+            return None, self.enqueueAnalysis(applicationName, rowUid, priority=ANALYSIS_PRIORITY_INTERACTIVE)
+
+        if useCache:
+            analysis = self._getCachedAnalysis(applicationName, rowUid)
+            if analysis is not None:
+                return analysis, job
+
+            # don't keep retrying a failed job on every refresh. Not using the cache will retry it.
+            if job and job.Status == AnalysisJobStatus.FAILED.value:
+                return None, job
+
+        return None, self.enqueueAnalysis(applicationName, rowUid, priority=ANALYSIS_PRIORITY_INTERACTIVE)
+
+    def enqueueAnalysis(self, applicationName, rowUid, priority=ANALYSIS_PRIORITY_BACKLOG):
+        ''' queues up analysis of the given rowUid's crash dump for an analysis worker. Jobs with a higher priority are run first.
+        If the row already has a job queued/running, that job is given back instead of queueing another (a queued job's priority is raised
+        to the given one if it is lower). Otherwise the new job is given back. Aborts with a 404 if the row doesn't have a crash dump. '''
+        job = self.getAnalysisJob(applicationName, rowUid)
+        if job and job.Status in (AnalysisJobStatus.QUEUED.value, AnalysisJobStatus.RUNNING.value):
+            if job.Status == AnalysisJobStatus.QUEUED.value and job.Priority < priority:
+                self.database.execute("UPDATE AnalysisJobs SET Priority = ? WHERE IdKey = ?", [priority, job.IdKey])
+                job = job._replace(Priority=priority)
+            return job
+
+        if not self.getApplicationCell(applicationName, rowUid, 'CrashDumpFileHash'):
+            logger.error("Crash dump file was not available with the given uid")
+            flask.abort(404)
+
+        if not self.database.addRow('AnalysisJobs', {
+            'ApplicationName' : applicationName,
+            'RowUid' : rowUid,
+            'Status' : AnalysisJobStatus.QUEUED.value,
+            'Priority' : priority,
+            'QueuedTimestamp' : str(datetime.datetime.now()),
+        }):
+            logger.error("Failed to queue analysis for: %s / %s" % (applicationName, rowUid))
             flask.abort(500)
 
-        return analysis
+        logger.info("Queued analysis for: %s / %s" % (applicationName, rowUid))
+        return self.getAnalysisJob(applicationName, rowUid)
+
+    def getAnalysisJob(self, applicationName, rowUid):
+        ''' gets the latest analysis job for the given rowUid. Returns None if there never was one '''
+        return self.database.execute("SELECT * FROM AnalysisJobs WHERE ApplicationName = ? AND RowUid = ? ORDER BY IdKey DESC LIMIT 1",
+                                     [applicationName, rowUid]).fetchone()
+
+    def claimAnalysisJob(self, workerId):
+        ''' claims the next queued analysis job (highest priority, then oldest) for the given worker and gives it back (now running).
+        Jobs left behind by processes that went away are requeued first. Returns None if nothing is queued.
+        Must not be read only storage: the write lock is what keeps two workers from claiming one job. '''
+        self.requeueStaleAnalysisJobs()
+        job = self.database.execute("SELECT IdKey FROM AnalysisJobs WHERE Status = ? ORDER BY Priority DESC, IdKey LIMIT 1",
+                                    [AnalysisJobStatus.QUEUED.value]).fetchone()
+        if not job:
+            return None
+
+        self.database.execute("UPDATE AnalysisJobs SET Status = ?, WorkerId = ?, StartTimestamp = ?, HeartbeatTimestamp = ? WHERE IdKey = ?",
+                              [AnalysisJobStatus.RUNNING.value, workerId, str(datetime.datetime.now()), time.time(), job.IdKey])
+        return self.database.execute("SELECT * FROM AnalysisJobs WHERE IdKey = ?", [job.IdKey]).fetchone()
+
+    def recordAnalysisJobHeartbeat(self, jobId, workerId):
+        ''' records that the given worker is still running the given analysis job. Returns False if the job isn't its anymore
+        (like if it was reclaimed after the worker went quiet for too long). '''
+        return bool(self.database.execute("UPDATE AnalysisJobs SET HeartbeatTimestamp = ? WHERE IdKey = ? AND Status = ? AND WorkerId = ?",
+                                          [time.time(), jobId, AnalysisJobStatus.RUNNING.value, workerId]).rowcount)
+
+    @classmethod
+    @contextlib.contextmanager
+    def analysisJobHeartbeat(cls, jobId, workerId):
+        ''' context manager that records a heartbeat on the given analysis job (claimed by the given worker) every
+        ANALYSIS_JOB_HEARTBEAT_INTERVAL_SECONDS (on a background thread) while the job is run inside of it '''
+        def recordHeartbeat():
+            with cls() as storage:
+                if not storage.recordAnalysisJobHeartbeat(jobId, workerId):
+                    logger.warning("Analysis job %d is no longer claimed by: %s" % (jobId, workerId))
+
+        with callEvery(recordHeartbeat, cls.ANALYSIS_JOB_HEARTBEAT_INTERVAL_SECONDS):
+            yield
+
+    def isAnalysisJobClaimedBy(self, jobId, workerId):
+        ''' checks if the given analysis job is still being run by the given worker (it isn't if it was reclaimed after the worker went
+        quiet for too long) '''
+        return bool(self.database.execute("SELECT IdKey FROM AnalysisJobs WHERE IdKey = ? AND Status = ? AND WorkerId = ?",
+                                          [jobId, AnalysisJobStatus.RUNNING.value, workerId]).fetchone())
+
+    def finishAnalysisJob(self, jobId, workerId, error=None):
+        ''' marks the given analysis job (being run by the given worker) as done. If an error is given, it is marked as failed (with that
+        error) instead. Returns False (and changes nothing) if the job isn't being run by that worker anymore. '''
+        status = AnalysisJobStatus.FAILED.value if error else AnalysisJobStatus.DONE.value
+        return bool(self.database.execute("UPDATE AnalysisJobs SET Status = ?, EndTimestamp = ?, Error = ? "
+                                          "WHERE IdKey = ? AND Status = ? AND WorkerId = ?",
+                                          [status, str(datetime.datetime.now()), error, jobId, AnalysisJobStatus.RUNNING.value, workerId]).rowcount)
+
+    def requeueStaleAnalysisJobs(self, jobId=None):
+        ''' puts running jobs without a heartbeat in ANALYSIS_JOB_CLAIM_TIMEOUT_SECONDS (left behind by a process that went away) back
+        in the queue. Jobs that are still being run are left alone. If jobId is given, only that job is looked at.
+        Returns the number of jobs requeued. '''
+        sqlStatement = ("UPDATE AnalysisJobs SET Status = ?, WorkerId = NULL, StartTimestamp = NULL, HeartbeatTimestamp = NULL "
+                        "WHERE Status = ? AND (HeartbeatTimestamp IS NULL OR HeartbeatTimestamp < ?)")
+        args = [AnalysisJobStatus.QUEUED.value, AnalysisJobStatus.RUNNING.value, time.time() - self.ANALYSIS_JOB_CLAIM_TIMEOUT_SECONDS]
+        if jobId is not None:
+            sqlStatement += " AND IdKey = ?"
+            args.append(jobId)
+
+        cursor = self.database.execute(sqlStatement, args)
+        if cursor.rowcount:
+            logger.warning("Requeued %d analysis job(s) left running" % cursor.rowcount)
+        return cursor.rowcount
+
+    def recordAnalysisWorkerHeartbeat(self, workerId):
+        ''' records that the given analysis worker is alive (right now). Workers that are long gone are forgotten. '''
+        now = time.time()
+        self.database.execute("DELETE FROM AnalysisWorkers WHERE HeartbeatTimestamp < ?", [now - self.ANALYSIS_WORKER_TIMEOUT_SECONDS])
+        if not self.database.execute("UPDATE AnalysisWorkers SET HeartbeatTimestamp = ? WHERE WorkerId = ?", [now, workerId]).rowcount:
+            self.database.addRow('AnalysisWorkers', {'WorkerId' : workerId, 'HeartbeatTimestamp' : now})
+
+    def removeAnalysisWorker(self, workerId):
+        ''' forgets the given analysis worker (like when it stops) '''
+        self.database.execute("DELETE FROM AnalysisWorkers WHERE WorkerId = ?", [workerId])
+
+    def getLiveAnalysisWorkerCount(self):
+        ''' gets the number of analysis workers (in any process) with a heartbeat in the last ANALYSIS_WORKER_TIMEOUT_SECONDS '''
+        return self.database.execute("SELECT COUNT(*) AS Count FROM AnalysisWorkers WHERE HeartbeatTimestamp >= ?",
+                                     [time.time() - self.ANALYSIS_WORKER_TIMEOUT_SECONDS]).fetchone().Count
+
+    def addStatistics(self, statistics):
+        ''' adds the given dict of statistic name -> value to the running totals '''
+        for name, value in statistics.items():
+            if not value:
+                continue
+
+            if not self.database.execute("UPDATE Statistics SET Value = Value + ? WHERE Name = ?", [value, name]).rowcount:
+                self.database.addRow('Statistics', {'Name' : name, 'Value' : value})
+
+    def addProcessStatistics(self):
+        ''' adds the statistics counted in this process since the last call (debugger calls, symbol cache use, deduplication) to the
+        running totals '''
+        self.addStatistics(Debugger.CALL_STATISTICS.takeStatistics())
+        self.addStatistics(DownstreamSymbolCache.STATISTICS.takeStatistics())
+        self.addStatistics(BlobStore.STATISTICS.takeStatistics())
+
+    def getStatistics(self):
+        ''' gets a dict of statistic name -> running total '''
+        return {row.Name : row.Value for row in self.database.execute("SELECT Name, Value FROM Statistics ORDER BY Name").fetchall()}
 
     def getWindowsSymbolFilePath(self, path):
-        ''' internal function used to serve back a Windows Symbol Store path '''
-        fullPath = os.path.abspath(os.path.join(WINDOWS_SYMBOL_STORE, path))
+        ''' internal function used to serve back a Windows Symbol Store path. The flask app serves symbols with SymbolServer directly
+        (without opening Storage). '''
+        fullPath = SymbolServer(self.WINDOWS_SYMBOL_STORE_DIRECTORY).getFilePath(path)
+        if fullPath is None:
+            flask.abort(404)
 
-        # the right side of the and is to make sure that somehow we aren't out of the symbols directory
-        if os.path.isfile(fullPath) and os.path.normpath(WINDOWS_SYMBOL_STORE) in os.path.normpath(fullPath):
-            return fullPath
+        return fullPath
 
-        flask.abort(404)
+    @classmethod
+    def _getSymbolStoreKey(cls, fileName, fileId):
+        ''' gets the key for the given file in the SymbolStoreFiles table '''
+        return ('%s/%s' % (fileName, fileId)).lower()
+
+    def setSymbolStoreFileHash(self, fileName, fileId, blobHash):
+        ''' records that the given file (by name and symbol store id) in the Windows symbol store came from the blob with the given hash '''
+        symbolStoreKey = self._getSymbolStoreKey(fileName, fileId)
+        if not self.database.execute("UPDATE SymbolStoreFiles SET Hash = ? WHERE SymbolStoreKey = ?", [blobHash, symbolStoreKey]).rowcount:
+            self.database.addRow('SymbolStoreFiles', {'SymbolStoreKey' : symbolStoreKey, 'Hash' : blobHash})
+
+    def getSymbolStoreFileHash(self, fileName, fileId):
+        ''' gets the blob store hash of the given file (by name and symbol store id, see windows_symbol_file) that was added to the
+        Windows symbol store. Gives back None if it wasn't (or its blob is gone). '''
+        result = self.database.execute("SELECT Hash FROM SymbolStoreFiles WHERE SymbolStoreKey = ?",
+                                       [self._getSymbolStoreKey(fileName, fileId)]).fetchone()
+        if not result or not self.blobStore.exists(result.Hash):
+            return None
+
+        return result.Hash
 
     def addFromAddRequest(self, request):
         ''' called by the flask app to add something for the given request to addHandler
-        Note that this will return the status that will be returned by addHandler() '''
+        Note that this will return the status that will be returned by addHandler()
+        The database's write lock is let go while the request's files come in and are streamed into the blob store and symbol store.
+        It's only taken again to add the rows. '''
 
         def failAnd401(msg):
             ''' helper to at this moment and log to the logger with the given message '''
             logger.error(msg)
             flask.abort(flask.Response(msg, 401))
 
+        # uploads (and storing them) can take a while, don't hold up everyone else (job claims, heartbeats, ...) in the meantime.
+        #  Until the rows are added, each statement runs (and commits) on its own.
+        self.database.commit(begin=False)
+
         # verify valid request 1st.
 
         # need to have the operating system set
@@ -275,16 +915,76 @@ class Storage(object):
         if not application:
             failAnd401("request was missing required field: Application")
 
-        # need at least one of: SymbolsFile, ExecutableFile, CrashDumpFile
+        # need at least one of: SymbolsFile, ExecutableFile, CrashDumpFile. Each can be uploaded, or one the application already has can be
+        #  referenced with <Column>Hash and <Column>Name (so one application's files can't be pulled into another by hash)
         symbolsFile = request.files.get("SymbolsFile")
         executableFile = request.files.get("ExecutableFile")
         crashDumpFile = request.files.get("CrashDumpFile")
+        fileHashes = {column : request.form.get(column + 'Hash') for column in ADD_REQUEST_FILE_COLUMNS if request.form.get(column + 'Hash')}
+
+        if not (symbolsFile or executableFile or crashDumpFile or fileHashes):
+            failAnd401("request needed to include at least one of the following: SymbolsFile, ExecutableFile, CrashDumpFile (or their Hash)")
 
-        if not (symbolsFile or executableFile or crashDumpFile):
-            failAnd401("request needed to include at least one of the following: SymbolsFile, ExecutableFile, CrashDumpFile")
+        for column, fileHash in fileHashes.items():
+            if request.files.get(column):
+                failAnd401("request included both %s and %sHash" % (column, column))
+            if not request.form.get(column + 'Name'):
+                failAnd401("request included %sHash without %sName" % (column, column))
+            # only as the same kind of file (a symbols file can't be given as a crash dump)
+            if not self.blobStore.exists(fileHash) or not self.applicationHasBlob(application, fileHash, [column]):
+                failAnd401("request's %sHash is not already stored for %s (upload the file instead): %s" % (column, application, fileHash))
 
         # if we made it here, the request is valid
 
+        # get binary file names
+        fileNames = {
+            'SymbolsFile' : symbolsFile.filename if symbolsFile else None,
+            'ExecutableFile' : executableFile.filename if executableFile else None,
+            'CrashDumpFile' : crashDumpFile.filename if crashDumpFile else None,
+        }
+
+        # stream each file into the blob store (hashing on the way) so we never hold a whole file in memory
+        blobs = {}
+        for column, uploadedFile in (('SymbolsFile', symbolsFile), ('ExecutableFile', executableFile), ('CrashDumpFile', crashDumpFile)):
+            if uploadedFile:
+                blobs[column] = self.blobStore.addFromFile(uploadedFile)
+
+        # files given by hash were already stored. Nothing was uploaded for them, so they're counted as references (not uploads)
+        for column, fileHash in fileHashes.items():
+            fileNames[column] = os.path.basename(request.form.get(column + 'Name'))
+            blobs[column] = (fileHash.lower(), os.path.getsize(self.blobStore.getPath(fileHash)))
+            BlobStore.STATISTICS.record(references=1, referenceBytes=blobs[column][1])
+
+        # add objects to symbol store. Their symbol store ids are recorded with the rows (below).
+        #  Files given by hash were added to it when they were uploaded.
+        symbolStoreFiles = []
+        if operatingSystem == SupportedOperatingSystems.WINDOWS.value:
+            for column, description in (('SymbolsFile', 'symbols file'), ('ExecutableFile', 'executable file')):
+                if column not in blobs or column in fileHashes or not blobs[column][1]:
+                    continue
+
+                # additions must have original name (to work in symbol store). Link the stored blob to that name.
+                with temporaryFilePath(fileName=fileNames[column]) as temp:
+                    linkOrCopyFile(self.blobStore.getPath(blobs[column][0]), temp)
+
+                    # the same file is often uploaded with every crash from a build, don't compress and add it again
+                    if self.windowsSymbolStore.contains(temp, compressed=True):
+                        logger.debug("Not adding %s to store since it is already there: %s" % (description, fileNames[column]))
+                        BlobStore.STATISTICS.record(symbolStoreAdds=1, symbolStoreBytes=blobs[column][1])
+                    else:
+                        try:
+                            self.windowsSymbolStore.add(temp, compressed=True)
+                        except Exception as ex:
+                            failAnd401("Failed to add %s to store: %s" % (description, str(ex)))
+
+                    # so clients can ask for it by its symbol store id later
+                    fileId = getSymbolStoreId(temp)
+                    if fileId is not None:
+                        symbolStoreFiles.append((fileNames[column], fileId, blobs[column][0]))
+
+        # the files are stored, take the write lock again for the rows
+        self.database.begin()
+
         # ensure we have a table for this application
         if not self.applicationExists(application):
             if not self.applicationAdd(application):
@@ -292,59 +992,39 @@ class Storage(object):
 
         applicationTableName = self.getApplicationTableName(application)
 
-        # get binary data
-        symbolsFileBinary = symbolsFile.read() if symbolsFile else None
-        executableFileBinary = executableFile.read() if executableFile else None
-        crashDumpFileBinary = crashDumpFile.read() if crashDumpFile else None
-
-        # get binary file names
-        symbolsFileName = symbolsFile.filename if symbolsFile else None
-        executableFileName = executableFile.filename if executableFile else None
-        crashDumpFileName = crashDumpFile.filename if crashDumpFile else None
-
-        # add objects to symbol store
-        if operatingSystem == SupportedOperatingSystems.WINDOWS.value:
-            if symbolsFileBinary:
-                # additions must have original name (to work in symbol store)
-                with temporaryFilePath(fileName=symbolsFileName) as temp:
-                    with open(temp, 'wb') as f:
-                        f.write(symbolsFileBinary)
-
-                    try:
-                        self.windowsSymbolStore.add(temp, compressed=True)
-                    except Exception as ex:
-                        failAnd401("Failed to add symbols file to store: %s" % str(ex))
-
-            if executableFileBinary:
-                 # additions must have original name (to work in symbol store)
-                with temporaryFilePath(fileName=executableFileName) as temp:
-                    with open(temp, 'wb') as f:
-                        f.write(executableFileBinary)
-
-                    try:
-                        self.windowsSymbolStore.add(temp, compressed=True)
-                    except Exception as ex:
-                        failAnd401("Failed to add executable file to store: %s" % str(ex))
+        for fileName, fileId, blobHash in symbolStoreFiles:
+            self.setSymbolStoreFileHash(fileName, fileId, blobHash)
 
         # add to database
         uid = getUniqueId()
-        if not self.database.addRow(applicationTableName, {
+        row = {
             'UID' : uid,
             'Timestamp' : str(datetime.datetime.now()),
             'UploaderIP' : request.remote_addr,
             'OperatingSystem' : operatingSystem,
             'Tag' : request.form.get('Tag'),
             'ApplicationVersion' : request.form.get('ApplicationVersion'),
-            'SymbolsFile' : symbolsFileBinary,
-            'SymbolsFileName' : symbolsFileName,
-            'ExecutableFile' : executableFileBinary,
-            'ExecutableFileName' : executableFileName,
-            'CrashDumpFile' : crashDumpFileBinary,
-            'CrashDumpFileName' : crashDumpFileName,
+            'SymbolsFileName' : fileNames['SymbolsFile'],
+            'ExecutableFileName' : fileNames['ExecutableFile'],
+            'CrashDumpFileName' : fileNames['CrashDumpFile'],
             # CrashDumpAnalysis is not given here, it can be generated later.
-        }):
+        }
+
+        # the files themselves are in the blob store, the row just references them
+        for column, (blobHash, size) in blobs.items():
+            row[column + 'Hash'] = blobHash
+            row[column + 'Size'] = size
+
+        if not self.database.addRow(applicationTableName, row):
             failAnd401("Unable to add to database")
 
+        # includes how much was deduplicated
+        self.addProcessStatistics()
+
+        # get the analysis going now, so it is likely done by the time someone wants to see it
+        if 'CrashDumpFile' in blobs and self.ANALYZE_ON_UPLOAD:
+            self.enqueueAnalysis(application, uid, priority=ANALYSIS_PRIORITY_BACKLOG)
+
         # success!
         return "Successfully added! UID: %s" % uid
 
@@ -1,17 +1,44 @@
 ''' home to tests for the Storage class '''
+import atexit
+import hashlib
 import io
 import os
+import shutil
+import tempfile
+import time
 import unittest
 import unittest.mock
 
 import pytest
 from werkzeug.exceptions import HTTPException
 
-from storage import REQUIRED_TABLES, ROOT_STORAGE_LOCATION, Storage as _Storage, WINDOWS_SYMBOL_STORE
+from abstract_database import AbstractDatabase, Column
+from blob_store import BlobStore
+from debugger import Debugger
+from storage import (ANALYSIS_PRIORITY_BACKLOG, ANALYSIS_PRIORITY_INTERACTIVE, DATABASE_TUNING_PROFILES, REQUIRED_TABLES, AnalysisJobStatus,
+                     Storage as _Storage)
+from symbol_cache import DownstreamSymbolCache
+from test_helpers import makePe
+from utility import getUniqueId, temporaryFilePath
+from windows_symbol_store import WindowsSymbolStore
 
 class Storage(_Storage):
-    ''' overloaded class to swap the DATABASE_FILE location '''
-    DATABASE_FILE = os.path.join(ROOT_STORAGE_LOCATION, 'database_unit_tests.sqlite')
+    ''' overloaded class to swap the DATABASE_FILE, BLOB_STORE_DIRECTORY and WINDOWS_SYMBOL_STORE_DIRECTORY locations to a temp directory
+    (so tests don't write into the real storage) '''
+    TEMP_DIRECTORY = tempfile.mkdtemp(prefix='pda_unit_tests_')
+    atexit.register(shutil.rmtree, TEMP_DIRECTORY, ignore_errors=True)
+    DATABASE_FILE = os.path.join(TEMP_DIRECTORY, 'database_unit_tests.sqlite')
+    BLOB_STORE_DIRECTORY = os.path.join(TEMP_DIRECTORY, 'Blobs')
+    WINDOWS_SYMBOL_STORE_DIRECTORY = os.path.join(TEMP_DIRECTORY, 'WindowsSymbols')
+
+    @classmethod
+    def removeDatabase(cls):
+        ''' closes pooled connections then deletes the database file (and its WAL files) '''
+        cls.closePooledConnections()
+        _Storage._MIGRATED_DATABASES.discard(cls.DATABASE_FILE)
+        for path in (cls.DATABASE_FILE, cls.DATABASE_FILE + '-wal', cls.DATABASE_FILE + '-shm'):
+            if os.path.isfile(path):
+                os.remove(path)
 
 class MockRequest(object):
     ''' mocked out flask request object. '''
@@ -26,8 +53,7 @@ class TestStorage(unittest.TestCase):
     ''' all tests for storage are in here '''
     def setUp(self):
         ''' called at the start of all tests '''
-        if os.path.isfile(Storage.DATABASE_FILE):
-            os.remove(Storage.DATABASE_FILE)
+        Storage.removeDatabase()
 
     def test_storage_context_manager(self):
         ''' ensure we can use Storage as a contextmanager '''
@@ -38,18 +64,75 @@ class TestStorage(unittest.TestCase):
         with Storage() as s:
             pass
 
-        # deleting this file at this point means we closed it up.
+        # deleting this file at this point means we closed it up (other than the idle pooled connection).
+        Storage.closePooledConnections()
         os.remove(Storage.DATABASE_FILE)
 
+    def test_read_only_storage_runs_alongside_writer(self):
+        ''' ensures read only storage can be used while a writer has the database (and only sees committed data) '''
+        with Storage() as s:
+            assert s.applicationAdd('CommittedApp')
+
+        with Storage() as writer:
+            assert writer.applicationAdd('UncommittedApp')
+
+            # this would hang (or time out) if readers had to wait on the writer
+            with Storage(readOnly=True) as reader:
+                assert reader.applicationExists('CommittedApp')
+                assert not reader.applicationExists('UncommittedApp')
+
+        with Storage(readOnly=True) as reader:
+            assert reader.applicationExists('UncommittedApp')
+
+    def test_storage_uses_wal_and_tuning_profile(self):
+        ''' ensures the tuning profile is applied to storage's database connection '''
+        with Storage(readOnly=True) as s:
+            assert s.database.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+            assert s.database.execute('PRAGMA cache_size').fetchone()[0] == DATABASE_TUNING_PROFILES[Storage.DATABASE_TUNING_PROFILE]['cache_size']
+
     def test_storage_creates_needed_tables(self):
         ''' ensures required tables are auto created '''
         with Storage() as s:
             for tableName in REQUIRED_TABLES.keys():
                 assert s.database.tableExists(tableName)
 
-        # deleting this file at this point means we closed it up.
+        # deleting this file at this point means we closed it up (other than the idle pooled connection).
+        Storage.closePooledConnections()
         os.remove(Storage.DATABASE_FILE)
 
+    def test_migrations_run_once(self):
+        ''' ensures schema migrations are recorded and not repeated for later uses of storage '''
+        with Storage() as s:
+            assert s.getSchemaVersion() == Storage.SCHEMA_MIGRATIONS[-1][0]
+            versions = [row.Version for row in s.database.execute("SELECT Version FROM SchemaVersions").fetchall()]
+            assert versions == [version for version, migration in Storage.SCHEMA_MIGRATIONS]
+            assert s.applicationAdd('MyApp')
+
+        with unittest.mock.patch('abstract_database.AbstractDatabase.execute', side_effect=AbstractDatabase.execute, autospec=True) as execute:
+            with Storage() as s:
+                pass
+
+            # no schema queries, just the BEGIN
+            assert [c[0][1] for c in execute.call_args_list] == ['BEGIN IMMEDIATE']
+
+        # a new process (or upgrade) with an up to date database doesn't redo anything
+        _Storage._MIGRATED_DATABASES.discard(Storage.DATABASE_FILE)
+        with Storage() as s:
+            assert s.database.execute("SELECT COUNT(*) AS Count FROM SchemaVersions").fetchone().Count == len(Storage.SCHEMA_MIGRATIONS)
+
+    def test_lookups_use_indexes(self):
+        ''' ensures application/row lookups are index lookups, not table scans '''
+        with Storage() as s:
+            assert s.applicationAdd('MyApp')
+            tableName = s.getApplicationTableName('MyApp')
+
+            for sqlStatement in ("SELECT * FROM Applications WHERE Name = ?",
+                                 "SELECT * FROM Applications WHERE ApplicationTable = ?",
+                                 "SELECT * FROM `%s` WHERE UID = ?" % tableName,
+                                 "SELECT IdKey FROM `%s` WHERE SymbolsFileHash = ? LIMIT 1" % tableName):
+                plan = str(s.database.execute("EXPLAIN QUERY PLAN " + sqlStatement, ['x']).fetchall())
+                assert 'USING INDEX' in plan or 'USING COVERING INDEX' in plan, plan
+
     def test_storage_get_application_table_name_and_reverse(self):
         ''' ensures that we can get the an application table '''
         with Storage() as s:
@@ -79,6 +162,35 @@ class TestStorage(unittest.TestCase):
             assert s.applicationAdd('mytable')
             assert not s.applicationAdd('mytable')
 
+    def test_application_options(self):
+        ''' ensures per application options can be set, and default if they aren't '''
+        with Storage() as s:
+            assert s.getApplicationOption('MyApp', 'AllThreads') is False
+            assert not s.setApplicationOption('MyApp', 'AllThreads', True)
+
+            assert s.applicationAdd('MyApp')
+            assert s.getApplicationOption('MyApp', 'AllThreads') is False
+            assert s.setApplicationOption('MyApp', 'AllThreads', True)
+            assert s.getApplicationOption('MyApp', 'AllThreads') is True
+
+            assert not s.setApplicationOption('MyApp', 'NotAnOption', True)
+            with pytest.raises(ValueError):
+                s.getApplicationOption('MyApp', 'NotAnOption')
+
+            # analysis uses the option
+            uid = s.addFromAddRequest(MockRequest({
+                'CrashDumpFile' : io.BytesIO(b'abcdefghijklmnopqrstuvwxyz'),
+            }, {
+                'Application' : 'MyApp',
+                'OperatingSystem' : 'Windows',
+            })).split('UID:')[-1].strip()
+            assert s.getAnalysisInputs('MyApp', uid)[1:] == ('THEFILENAME', 'Windows', True)
+
+            with unittest.mock.patch('windbg.WinDbg.__init__', return_value=None) as init:
+                with unittest.mock.patch('windbg.WinDbg.getAnalysis', return_value='Hello'):
+                    assert s.generateAnalysis(*s.getAnalysisInputs('MyApp', uid)) == 'Hello'
+                assert init.call_args[1]['allThreads'] is True
+
     def test_add_invalid_request_due_to_missing_operating_system(self):
         ''' ensure that adding with an invalid operating system fails '''
         request = MockRequest({
@@ -157,6 +269,211 @@ class TestStorage(unittest.TestCase):
 
             assert s.setApplicationCell('MyApp2345', uid, 'Tag', 'NewTag!') is False
 
+    def test_files_are_kept_in_blob_store(self):
+        ''' ensures uploaded files are kept in the blob store and rows only reference them '''
+        request = MockRequest({
+            'SymbolsFile' : io.BytesIO(b'abcdefghijklmnopqrstuvwxyz'),
+            'CrashDumpFile' : io.BytesIO(b'zyxwvutsrqponmlkjihgfedcba'),
+        }, {
+            'Application' : 'MyApp234',
+            'OperatingSystem' : 'Windows',
+        })
+        with Storage() as s:
+            uid = s.addFromAddRequest(request).split('UID:')[-1].strip()
+            tableName = s.getApplicationTableName('MyApp234')
+            row = s.database.execute("SELECT * FROM %s WHERE UID=?" % tableName, [uid]).fetchone()
+
+            assert s.blobStore.get(row.SymbolsFileHash) == b'abcdefghijklmnopqrstuvwxyz'
+            assert row.SymbolsFileSize == 26
+            assert row.ExecutableFileHash is None
+            assert not hasattr(row, 'SymbolsFile')
+
+            assert s.getApplicationCell('MyApp234', uid, 'SymbolsFile') == b'abcdefghijklmnopqrstuvwxyz'
+            assert s.getApplicationCell('MyApp234', uid, 'CrashDumpFile') == b'zyxwvutsrqponmlkjihgfedcba'
+            assert s.getApplicationCell('MyApp234', uid, 'ExecutableFile') is None
+
+    def test_duplicate_uploads_are_stored_once(self):
+        ''' ensures the same file uploaded again is stored once, isn't added to the symbol store again, and the bytes saved are counted '''
+        pe = makePe(0x5E9B1A2C, 0x2F000)
+        BlobStore.STATISTICS.takeStatistics()
+        with temporaryFilePath() as blobStorePath, temporaryFilePath() as symbolStorePath:
+            with Storage() as s:
+                s.blobStore = BlobStore(blobStorePath)
+                s.windowsSymbolStore = WindowsSymbolStore(symbolStorePath)
+                with unittest.mock.patch.object(s.windowsSymbolStore, 'add', wraps=s.windowsSymbolStore.add) as add:
+                    for i in range(3):
+                        assert 'Success' in s.addFromAddRequest(MockRequest({
+                            'ExecutableFile' : io.BytesIO(pe),
+                            'CrashDumpFile' : io.BytesIO(b'crash %d' % i),
+                        }, {
+                            'Application' : 'MyApp234',
+                            'OperatingSystem' : 'Windows',
+                        }))
+                    add.assert_called_once()
+
+                rows = s.database.execute("SELECT * FROM %s" % s.getApplicationTableName('MyApp234')).fetchall()
+                assert len(set(row.ExecutableFileHash for row in rows)) == 1
+                assert len(set(row.CrashDumpFileHash for row in rows)) == 3
+
+                statistics = s.getStatistics()
+                assert statistics['DedupBlobs'] == 2
+                assert statistics['DedupBlobBytesSaved'] == 2 * len(pe)
+                assert statistics['DedupSymbolStoreAddsSkipped'] == 2
+                assert statistics['DedupSymbolStoreBytesSkipped'] == 2 * len(pe)
+
+    def test_add_request_stores_files_without_write_lock(self):
+        ''' ensures the database's write lock isn't held while an add request's files are stored, only while its rows are added '''
+        pe = makePe(0x5E9B1A2E, 0x2F000)
+        inTransaction = []
+        with temporaryFilePath() as symbolStorePath:
+            with Storage() as s:
+                s.windowsSymbolStore = WindowsSymbolStore(symbolStorePath)
+                addFromFile = s.blobStore.addFromFile
+                add = s.windowsSymbolStore.add
+
+                def recordTransaction(function):
+                    ''' wraps function to record if we are in a transaction when it's called '''
+                    def wrapper(*args, **kwargs):
+                        inTransaction.append(s.database.database.in_transaction)
+                        return function(*args, **kwargs)
+                    return wrapper
+
+                with unittest.mock.patch.object(s.blobStore, 'addFromFile', side_effect=recordTransaction(addFromFile)), \
+                     unittest.mock.patch.object(s.windowsSymbolStore, 'add', side_effect=recordTransaction(add)):
+                    uid = s.addFromAddRequest(MockRequest({
+                        'ExecutableFile' : io.BytesIO(pe),
+                        'CrashDumpFile' : io.BytesIO(getUniqueId().encode()),
+                    }, {
+                        'Application' : 'MyApp',
+                        'OperatingSystem' : 'Windows',
+                    })).split('UID:')[-1].strip()
+
+                # the rows are added in a transaction
+                assert s.database.database.in_transaction
+                assert s.getApplicationCell('MyApp', uid, 'ExecutableFile') == pe
+                assert s.getSymbolStoreFileHash('THEFILENAME', '5E9B1A2E2f000') == hashlib.sha256(pe).hexdigest()
+
+        assert inTransaction == [False, False, False]
+
+    def test_add_by_hash(self):
+        ''' ensures files already stored can be referenced by hash instead of being uploaded again '''
+        pe = makePe(0x5E9B1A2D, 0x2F000)
+        fileHash = hashlib.sha256(pe).hexdigest()
+        BlobStore.STATISTICS.takeStatistics()
+        with temporaryFilePath() as blobStorePath, temporaryFilePath() as symbolStorePath:
+            with Storage() as s:
+                s.blobStore = BlobStore(blobStorePath)
+                s.windowsSymbolStore = WindowsSymbolStore(symbolStorePath)
+                assert s.getSymbolStoreFileHash('THEFILENAME', '5E9B1A2D2f000') is None
+
+                uid = s.addFromAddRequest(MockRequest({
+                    'ExecutableFile' : io.BytesIO(pe),
+                }, {
+                    'Application' : 'MyApp234',
+                    'OperatingSystem' : 'Windows',
+                })).split('UID:')[-1].strip()
+                assert s.getSymbolStoreFileHash('THEFILENAME', '5E9B1A2D2f000') == fileHash
+                assert s.getSymbolStoreFileHash('TheFileName', '5e9b1a2d2F000') == fileHash
+
+                uid2 = s.addFromAddRequest(MockRequest({
+                    'CrashDumpFile' : io.BytesIO(b'crash'),
+                }, {
+                    'Application' : 'MyApp234',
+                    'OperatingSystem' : 'Windows',
+                    'ExecutableFileHash' : fileHash.upper(),
+                    'ExecutableFileName' : 'THEFILENAME',
+                })).split('UID:')[-1].strip()
+
+                tableName = s.getApplicationTableName('MyApp234')
+                row, row2 = [s.database.execute("SELECT * FROM %s WHERE UID = ?" % tableName, [u]).fetchone() for u in (uid, uid2)]
+                assert (row2.ExecutableFileHash, row2.ExecutableFileSize, row2.ExecutableFileName) == (fileHash, len(pe), 'THEFILENAME')
+                assert (row.ExecutableFileHash, row.ExecutableFileSize) == (row2.ExecutableFileHash, row2.ExecutableFileSize)
+
+                statistics = s.getStatistics()
+                assert statistics['DedupFilesReferenced'] == 1
+                assert statistics['DedupReferencedBytes'] == len(pe)
+
+                # a referenced file was already added to the symbol store, so it isn't counted as skipped there too
+                assert 'DedupSymbolStoreBytesSkipped' not in statistics
+
+                # a crash dump given by hash is queued for analysis like an uploaded one
+                uid3 = s.addFromAddRequest(MockRequest({}, {
+                    'Application' : 'MyApp234',
+                    'OperatingSystem' : 'Windows',
+                    'CrashDumpFileHash' : row2.CrashDumpFileHash,
+                    'CrashDumpFileName' : 'crash.dmp',
+                })).split('UID:')[-1].strip()
+                assert s.getAnalysisJob('MyApp234', uid3).Status == AnalysisJobStatus.QUEUED.value
+
+    def test_add_by_hash_invalid(self):
+        ''' ensures bad references by hash are rejected '''
+        content = getUniqueId().encode()
+        fileHash = hashlib.sha256(content).hexdigest()
+        with Storage() as s:
+            for files, form in (
+                ({}, {'SymbolsFileHash' : fileHash, 'SymbolsFileName' : 'TheCrasher.pdb'}), # not stored
+                ({}, {'SymbolsFileHash' : '../../database.sqlite', 'SymbolsFileName' : 'TheCrasher.pdb'}), # not a hash
+            ):
+                form.update({'Application' : 'MyApp', 'OperatingSystem' : 'Windows'})
+                with pytest.raises(HTTPException):
+                    s.addFromAddRequest(MockRequest(files, form))
+
+            s.addFromAddRequest(MockRequest({'SymbolsFile' : io.BytesIO(content)}, {'Application' : 'OtherApp', 'OperatingSystem' : 'Windows'}))
+            assert s.applicationHasBlob('OtherApp', fileHash.upper())
+            assert not s.applicationHasBlob('MyApp', fileHash)
+            for files, form in (
+                ({}, {'SymbolsFileHash' : fileHash}), # no name
+                ({'SymbolsFile' : io.BytesIO(b'abc')}, {'SymbolsFileHash' : fileHash, 'SymbolsFileName' : 'TheCrasher.pdb'}), # both
+                ({}, {'SymbolsFileHash' : fileHash, 'SymbolsFileName' : 'TheCrasher.pdb'}), # another application's file
+            ):
+                form.update({'Application' : 'MyApp', 'OperatingSystem' : 'Windows'})
+                with pytest.raises(HTTPException):
+                    s.addFromAddRequest(MockRequest(files, form))
+
+            # the application's symbols file can't be referenced as its crash dump
+            assert not s.applicationHasBlob('OtherApp', fileHash, ['CrashDumpFile'])
+            with pytest.raises(HTTPException):
+                s.addFromAddRequest(MockRequest({}, {'CrashDumpFileHash' : fileHash, 'CrashDumpFileName' : 'TheCrasher.dmp',
+                                                     'Application' : 'OtherApp', 'OperatingSystem' : 'Windows'}))
+
+    def test_symbol_store_gets_stored_file_with_original_name(self):
+        ''' ensures the symbol store is handed the streamed file (under its original name) '''
+        added = []
+        def add(path, compressed=False):
+            ''' mock'd WindowsSymbolStore.add that remembers the name/content it was given '''
+            with open(path, 'rb') as f:
+                added.append((os.path.basename(path), f.read()))
+
+        request = MockRequest({
+            'SymbolsFile' : io.BytesIO(b'abcdefghijklmnopqrstuvwxyz'),
+            'CrashDumpFile' : io.BytesIO(b'zyxwvutsrqponmlkjihgfedcba'),
+        }, {
+            'Application' : 'MyApp234',
+            'OperatingSystem' : 'Windows',
+        })
+        with Storage() as s:
+            with unittest.mock.patch.object(s.windowsSymbolStore, 'add', side_effect=add):
+                assert 'Success' in s.addFromAddRequest(request)
+
+        assert added == [('THEFILENAME', b'abcdefghijklmnopqrstuvwxyz')]
+
+    def test_inline_blobs_are_moved_to_blob_store(self):
+        ''' ensures tables from older versions (with files in BLOB columns) get moved to the blob store '''
+        with Storage() as s:
+            assert s.database.createTable('table_old', [Column('UID', 'TEXT'), Column('SymbolsFile', 'BLOB'), Column('SymbolsFileName', 'TEXT')])
+            assert s.database.addRow('table_old', {'UID' : 'oldUid', 'SymbolsFile' : b'oldbytes', 'SymbolsFileName' : 'old.pdb'})
+            assert s.database.addRow('Applications', {'Name' : 'OldApp', 'ApplicationTable' : 'table_old'})
+
+            # pretend this database is from before the blob store
+            s.database.execute("DELETE FROM SchemaVersions WHERE Version >= 2")
+        _Storage._MIGRATED_DATABASES.discard(Storage.DATABASE_FILE)
+
+        with Storage() as s:
+            row = s.database.execute("SELECT * FROM table_old").fetchone()
+            assert row.SymbolsFile is None
+            assert row.SymbolsFileSize == len(b'oldbytes')
+            assert s.getApplicationCell('OldApp', 'oldUid', 'SymbolsFile') == b'oldbytes'
+
     def test_get_analysis_with_and_without_cache(self):
         ''' ensures we can get analysis for an app name/rowUid '''
         request = MockRequest({
@@ -172,10 +489,14 @@ class TestStorage(unittest.TestCase):
             msg = s.addFromAddRequest(request)
             uid = msg.split('UID:')[-1].strip()
 
-            with unittest.mock.patch('windbg.WinDbg.getAnalysis') as getAnalysis:
-                getAnalysis.return_value = "Hello"
+            def getAnalysis():
+                ''' the database isn't held while the debugger runs '''
+                assert not s.database.database.in_transaction
+                return "Hello"
+
+            with unittest.mock.patch('windbg.WinDbg.getAnalysis', side_effect=getAnalysis) as getAnalysisMock:
                 analysis = s.getAnalysis('MyApp234', uid, useCache=False)
-                getAnalysis.assert_called_once()
+                getAnalysisMock.assert_called_once()
                 assert analysis ==  "Hello"
 
             # shouldn't need to mock since we're using the cache now
@@ -205,9 +526,215 @@ class TestStorage(unittest.TestCase):
             with pytest.raises(HTTPException):
                 s.getAnalysis('NotARealApp', uid, False)
 
+    def test_analysis_job_queue(self):
+        ''' ensures analysis jobs are queued once per row, claimed by priority, and finished '''
+        uids = []
+        with Storage() as s:
+            for i in range(3):
+                request = MockRequest({
+                    'CrashDumpFile' : io.BytesIO(b'dump%d' % i),
+                }, {
+                    'Application' : 'MyApp',
+                    'OperatingSystem' : 'Windows',
+                })
+                uids.append(s.addFromAddRequest(request).split('UID:')[-1].strip())
+
+            # uploading queued them up as backlog
+            job = s.getAnalysisJob('MyApp', uids[0])
+            assert job.Status == AnalysisJobStatus.QUEUED.value
+            assert job.Priority == ANALYSIS_PRIORITY_BACKLOG
+
+            # already queued, so the same job comes back (with its priority raised if asked)
+            assert s.enqueueAnalysis('MyApp', uids[0]).IdKey == job.IdKey
+            assert s.enqueueAnalysis('MyApp', uids[1]).IdKey != job.IdKey
+            job = s.enqueueAnalysis('MyApp', uids[2], priority=ANALYSIS_PRIORITY_INTERACTIVE)
+            assert job.Priority == ANALYSIS_PRIORITY_INTERACTIVE
+            assert s.getAnalysisJob('MyApp', uids[2]).Priority == ANALYSIS_PRIORITY_INTERACTIVE
+            assert s.enqueueAnalysis('MyApp', uids[2], priority=ANALYSIS_PRIORITY_BACKLOG).Priority == ANALYSIS_PRIORITY_INTERACTIVE
+
+            with pytest.raises(HTTPException):
+                s.enqueueAnalysis('MyApp', 'NotARealUid')
+
+            # highest priority first, then oldest
+            assert s.claimAnalysisJob('worker').RowUid == uids[2]
+            claimed = s.claimAnalysisJob('worker')
+            assert claimed.RowUid == uids[0]
+            assert claimed.Status == AnalysisJobStatus.RUNNING.value
+            assert claimed.WorkerId == 'worker'
+
+            # running jobs are not claimed again, but are requeued if left behind (no heartbeat in a while)
+            assert s.claimAnalysisJob('worker').RowUid == uids[1]
+            assert s.claimAnalysisJob('worker') is None
+            assert s.requeueStaleAnalysisJobs() == 0
+            assert s.recordAnalysisJobHeartbeat(claimed.IdKey, 'worker')
+            assert not s.recordAnalysisJobHeartbeat(claimed.IdKey, 'someOtherWorker')
+            with unittest.mock.patch('time.time', return_value=time.time() + Storage.ANALYSIS_JOB_CLAIM_TIMEOUT_SECONDS + 1):
+                assert s.claimAnalysisJob('worker').RowUid == uids[2]
+                assert s.getAnalysisJob('MyApp', uids[0]).Status == AnalysisJobStatus.QUEUED.value
+                assert s.requeueStaleAnalysisJobs() == 0
+            for i in range(2):
+                s.claimAnalysisJob('worker')
+
+            # only the worker running a job can finish it
+            assert s.isAnalysisJobClaimedBy(claimed.IdKey, 'worker')
+            assert not s.isAnalysisJobClaimedBy(claimed.IdKey, 'someOtherWorker')
+            assert not s.finishAnalysisJob(claimed.IdKey, 'someOtherWorker')
+            assert s.getAnalysisJob('MyApp', uids[0]).Status == AnalysisJobStatus.RUNNING.value
+
+            assert s.finishAnalysisJob(claimed.IdKey, 'worker')
+            assert s.getAnalysisJob('MyApp', uids[0]).Status == AnalysisJobStatus.DONE.value
+            assert not s.finishAnalysisJob(claimed.IdKey, 'worker')
+            s.finishAnalysisJob(s.getAnalysisJob('MyApp', uids[1]).IdKey, 'worker', error='it broke')
+            job = s.getAnalysisJob('MyApp', uids[1])
+            assert job.Status == AnalysisJobStatus.FAILED.value
+            assert job.Error == 'it broke'
+
+            # a finished job can be queued again
+            assert s.enqueueAnalysis('MyApp', uids[0]).Status == AnalysisJobStatus.QUEUED.value
+
+    def test_upload_queues_analysis(self):
+        ''' ensures uploading a crash dump queues it for analysis (unless turned off), and other uploads don't '''
+        class NoAnalyzeOnUploadStorage(Storage):
+            ANALYZE_ON_UPLOAD = False
+
+        uids = []
+        for storageClass, files in ((Storage, {'CrashDumpFile' : io.BytesIO(b'dump')}),
+                                    (Storage, {'SymbolsFile' : io.BytesIO(b'symbols')}),
+                                    (NoAnalyzeOnUploadStorage, {'CrashDumpFile' : io.BytesIO(b'dump')})):
+            with storageClass() as s:
+                uids.append(s.addFromAddRequest(MockRequest(files, {'Application' : 'MyApp', 'OperatingSystem' : 'Windows'})).split('UID:')[-1].strip())
+
+        with Storage(readOnly=True) as s:
+            assert s.getAnalysisJob('MyApp', uids[0]).Status == AnalysisJobStatus.QUEUED.value
+            assert s.getAnalysisJob('MyApp', uids[1]) is None
+            assert s.getAnalysisJob('MyApp', uids[2]) is None
+
+    def test_request_analysis(self):
+        ''' ensures requestAnalysis gives back the cached analysis or the job that will make it '''
+        request = MockRequest({
+            'CrashDumpFile' : io.BytesIO(b'abcdefghijklmnopqrstuvwxyz'),
+        }, {
+            'Application' : 'MyApp',
+            'OperatingSystem' : 'Windows',
+        })
+        with Storage() as s:
+            uid = s.addFromAddRequest(request).split('UID:')[-1].strip()
+
+            # someone is waiting on it now, so it jumps ahead of the backlog
+            analysis, job = s.requestAnalysis('MyApp', uid)
+            assert analysis is None
+            assert job.Status == AnalysisJobStatus.QUEUED.value
+            assert job.Priority == ANALYSIS_PRIORITY_INTERACTIVE
+
+            # failed jobs are not retried unless the cache isn't used
+            s.finishAnalysisJob(s.claimAnalysisJob('worker').IdKey, 'worker', error='it broke')
+            analysis, job = s.requestAnalysis('MyApp', uid)
+            assert analysis is None
+            assert job.Status == AnalysisJobStatus.FAILED.value
+            analysis, job = s.requestAnalysis('MyApp', uid, useCache=False)
+            assert job.Status == AnalysisJobStatus.QUEUED.value
+
+            # while a job is pending, the (old) cached analysis isn't given back
+            assert s.saveAnalysis('MyApp', uid, 'Hello')
+            assert s.requestAnalysis('MyApp', uid)[0] is None
+
+            s.finishAnalysisJob(s.claimAnalysisJob('worker').IdKey, 'worker')
+            analysis, job = s.requestAnalysis('MyApp', uid)
+            assert analysis == 'Hello'
+            assert job.Status == AnalysisJobStatus.DONE.value
+
+    def test_analysis_worker_heartbeats(self):
+        ''' ensures analysis workers are counted as alive until their heartbeats stop (or they are removed) '''
+        with Storage() as s:
+            assert s.getLiveAnalysisWorkerCount() == 0
+            s.recordAnalysisWorkerHeartbeat('worker1')
+            s.recordAnalysisWorkerHeartbeat('worker2')
+            s.recordAnalysisWorkerHeartbeat('worker1')
+            assert s.getLiveAnalysisWorkerCount() == 2
+
+            s.removeAnalysisWorker('worker2')
+            assert s.getLiveAnalysisWorkerCount() == 1
+
+            with unittest.mock.patch('time.time', return_value=time.time() + Storage.ANALYSIS_WORKER_TIMEOUT_SECONDS + 1):
+                assert s.getLiveAnalysisWorkerCount() == 0
+
+                # long gone workers are forgotten
+                s.recordAnalysisWorkerHeartbeat('worker3')
+                assert s.database.execute("SELECT COUNT(*) AS Count FROM AnalysisWorkers").fetchone().Count == 1
+
+    def test_analysis_job_heartbeat(self):
+        ''' ensures a heartbeat is kept on a job while it is being run '''
+        class FastHeartbeatStorage(Storage):
+            ANALYSIS_JOB_HEARTBEAT_INTERVAL_SECONDS = .05
+
+        with Storage() as s:
+            uid = s.addFromAddRequest(MockRequest({
+                'CrashDumpFile' : io.BytesIO(b'abcdefghijklmnopqrstuvwxyz'),
+            }, {
+                'Application' : 'MyApp',
+                'OperatingSystem' : 'Windows',
+            })).split('UID:')[-1].strip()
+            job = s.claimAnalysisJob('worker')
+
+        with FastHeartbeatStorage.analysisJobHeartbeat(job.IdKey, 'worker'):
+            time.sleep(.2)
+            with Storage(readOnly=True) as s:
+                assert s.getAnalysisJob('MyApp', uid).HeartbeatTimestamp > job.HeartbeatTimestamp
+
+    def test_statistics(self):
+        ''' ensures statistics are kept as running totals '''
+        with Storage() as s:
+            assert s.getStatistics() == {}
+            s.addStatistics({'DebuggerCalls' : 2, 'DebuggerCallSeconds' : 1.5, 'DebuggerCallTimeouts' : 0})
+            s.addStatistics({'DebuggerCalls' : 1, 'DebuggerCallSeconds' : .25})
+            assert s.getStatistics() == {'DebuggerCalls' : 3, 'DebuggerCallSeconds' : 1.75}
+
+    def test_add_process_statistics(self):
+        ''' ensures the statistics counted in this process are added to the running totals (and only once) '''
+        Debugger.CALL_STATISTICS.takeStatistics()
+        DownstreamSymbolCache.STATISTICS.takeStatistics()
+        DownstreamSymbolCache.STATISTICS.record(hits=2, misses=1)
+        with Storage() as s:
+            s.addProcessStatistics()
+            s.addProcessStatistics()
+            statistics = s.getStatistics()
+            assert statistics['SymbolCacheHits'] == 2
+            assert statistics['SymbolCacheMisses'] == 1
+            assert 'DebuggerCalls' not in statistics
+
+    def test_get_application_table_is_one_query(self):
+        ''' ensures viewing an application table is a single (metadata only) query, not a query per row '''
+        with Storage() as s:
+            for i in range(3):
+                s.addFromAddRequest(MockRequest({
+                    'CrashDumpFile' : io.BytesIO(b'abcdefghijklmnopqrstuvwxyz'),
+                }, {
+                    'Application' : 'MyApp',
+                    'OperatingSystem' : 'Windows',
+                    'Tag' : 'Tag%d' % i,
+                }))
+
+        # url_for needs the app's endpoints
+        import flask_app
+        with flask_app.app.test_request_context():
+            with Storage(readOnly=True) as s:
+                with unittest.mock.patch('abstract_database.AbstractDatabase.execute', side_effect=AbstractDatabase.execute, autospec=True) as execute:
+                    table = s.getApplicationTable('MyApp')
+
+                # one to find the table, one to get the rows
+                assert execute.call_count == 2
+                assert 'CrashDumpFileHash' not in execute.call_args_list[-1][0][1]
+
+        assert len(table.rows) == 3
+        assert table.tableHeaders == ['IdKey', 'UID', 'Timestamp', 'UploaderIP', 'OperatingSystem', 'Tag', 'ApplicationVersion',
+                                      'SymbolsFile', 'ExecutableFile', 'CrashDumpFile', 'Actions']
+        assert 'THEFILENAME</a>' in table.getCellFromRow(table.rows[0], 'CrashDumpFile')
+        assert table.getCellFromRow(table.rows[0], 'SymbolsFile') is None
+
     def test_get_windows_symbol_file(self):
         ''' ensures we can get a file from the windows symbol store '''
-        testPath = os.path.join(WINDOWS_SYMBOL_STORE, 'test_file.txt')
+        os.makedirs(Storage.WINDOWS_SYMBOL_STORE_DIRECTORY, exist_ok=True)
+        testPath = os.path.join(Storage.WINDOWS_SYMBOL_STORE_DIRECTORY, 'test_file.txt')
         with open(testPath, 'w') as f:
             f.write("Hello")
 
@@ -0,0 +1,141 @@
+''' this file is home to the DownstreamSymbolCache class, which keeps the debugger's downstream symbol store (where symbols from
+upstream symbol stores are cached) under a size cap by evicting the least recently used entries '''
+
+import collections
+import os
+import shutil
+import threading
+import time
+
+from csmlog_setup import getLogger
+from symbol_store_layout import NOT_ENTRIES, scanEntries, isPrefixDirectoryName
+from utility import Statistics
+
+# default cap on the size of a downstream symbol cache
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024 * 1024
+
+# by default, a cache is scanned for eviction at most this often (per process). Scanning walks the whole cache.
+DEFAULT_SCAN_INTERVAL_SECONDS = 60
+
+logger = getLogger(__file__)
+
+# an entry in the cache: the <name>/<id> directory (<prefix>/<name>/<id> if two tier) holding a symbol file, its size (in bytes) and
+#  when it was last used
+SymbolCacheEntry = collections.namedtuple('SymbolCacheEntry', ['path', 'size', 'lastUsed'])
+
+class DownstreamSymbolCache(object):
+    ''' a downstream symbol store (in either layout, see symbol_store_layout) kept under maxBytes.
+    When an entry is used, its directory's modified time is set to now (see recordUse()). evict() deletes the entries used longest ago
+    until the cache is under maxBytes. '''
+
+    # counts for every cache in this process
+    STATISTICS = Statistics({
+        'hits' : 'SymbolCacheHits',
+        'misses' : 'SymbolCacheMisses',
+        'evictions' : 'SymbolCacheEvictions',
+        'evictedBytes' : 'SymbolCacheEvictedBytes',
+    })
+
+    def __init__(self, path, maxBytes=DEFAULT_MAX_BYTES, scanIntervalSeconds=DEFAULT_SCAN_INTERVAL_SECONDS):
+        ''' initializer takes in the directory of the cache, the most bytes it should hold and how often (in seconds) evictIfNeeded()
+        scans it '''
+        self.path = path
+        self.maxBytes = maxBytes
+        self.scanIntervalSeconds = scanIntervalSeconds
+        self._lastScanTime = 0
+        self._lock = threading.Lock()
+
+    def getEntryPath(self, path):
+        ''' gets the path of the entry (its id directory) the given file in the cache is in. Gives back None if it isn't in the cache. '''
+        relativePath = os.path.relpath(os.path.normcase(os.path.abspath(path)), os.path.normcase(os.path.abspath(self.path)))
+        parts = relativePath.split(os.sep)
+        if len(parts) < 3 or parts[0] in (os.pardir, os.curdir) or parts[0] in NOT_ENTRIES:
+            return None
+
+        if isPrefixDirectoryName(parts[0]):
+            if len(parts) < 4:
+                return None
+            return os.path.join(self.path, *parts[:3])
+
+        return os.path.join(self.path, *parts[:2])
+
+    def recordUse(self, paths, since):
+        ''' records that the given files (like the symbol files the debugger loaded) were used, by marking their entries as used now.
+        Entries written after since (a time.time(), like when the debugger started) were just downloaded, so they count as misses.
+        Others count as hits. Files not in the cache are ignored. Returns a tuple of (hits, misses). '''
+        hits = 0
+        misses = 0
+        for entryPath in set(filter(None, (self.getEntryPath(path) for path in paths))):
+            try:
+                newest = max(entry.stat().st_mtime for entry in os.scandir(entryPath))
+                os.utime(entryPath)
+            except (OSError, ValueError):
+                # gone (evicted by someone else) or empty
+                continue
+
+            if newest >= since:
+                misses += 1
+            else:
+                hits += 1
+
+        self.STATISTICS.record(hits=hits, misses=misses)
+        return hits, misses
+
+    def scan(self):
+        ''' gets a list of SymbolCacheEntry for every entry in the cache, least recently used first '''
+        entries = []
+        for _, idEntry in scanEntries(self.path):
+            try:
+                size = sum(fileEntry.stat().st_size for fileEntry in os.scandir(idEntry.path) if fileEntry.is_file())
+                entries.append(SymbolCacheEntry(idEntry.path, size, idEntry.stat().st_mtime))
+            except OSError:
+                # evicted by someone else while we looked
+                continue
+
+        return sorted(entries, key=lambda entry: entry.lastUsed)
+
+    def evict(self):
+        ''' deletes the least recently used entries until the cache is under maxBytes. Entries that can't be deleted (like ones open in
+        a debugger) are skipped. Returns a tuple of (entries evicted, bytes evicted). '''
+        with self._lock:
+            self._lastScanTime = time.time()
+            entries = self.scan()
+            totalBytes = sum(entry.size for entry in entries)
+
+            evictions = 0
+            evictedBytes = 0
+            for entry in entries:
+                if totalBytes <= self.maxBytes:
+                    break
+
+                try:
+                    shutil.rmtree(entry.path)
+                except OSError as ex:
+                    logger.warning("Could not evict symbol cache entry %s: %s" % (entry.path, str(ex)))
+                    continue
+
+                totalBytes -= entry.size
+                evictions += 1
+                evictedBytes += entry.size
+
+                # get rid of the <name> directory (and <prefix> directory if two tier) once it has no more entries
+                try:
+                    namePath = os.path.dirname(entry.path)
+                    os.rmdir(namePath)
+                    if os.path.dirname(namePath) != self.path:
+                        os.rmdir(os.path.dirname(namePath))
+                except OSError:
+                    pass
+
+            if evictions:
+                logger.info("Evicted %d entries (%d bytes) from the symbol cache: %s" % (evictions, evictedBytes, self.path))
+
+        self.STATISTICS.record(evictions=evictions, evictedBytes=evictedBytes)
+        return evictions, evictedBytes
+
+    def evictIfNeeded(self):
+        ''' calls evict() if it hasn't been called (in this process) in the last scanIntervalSeconds. Returns what it returns, or (0, 0). '''
+        if time.time() - self._lastScanTime < self.scanIntervalSeconds:
+            return 0, 0
+
+        return self.evict()
@@ -0,0 +1,110 @@
+''' this file contains tests for the downstream symbol cache '''
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from symbol_cache import DownstreamSymbolCache
+
+class TestDownstreamSymbolCache(unittest.TestCase):
+    ''' test class for DownstreamSymbolCache '''
+    def setUp(self):
+        ''' makes an empty cache in self.cache '''
+        self.tempPath = tempfile.mkdtemp()
+        self.cache = DownstreamSymbolCache(self.tempPath, maxBytes=100)
+        DownstreamSymbolCache.STATISTICS.takeStatistics()
+
+    def tearDown(self):
+        ''' cleans up after each test '''
+        shutil.rmtree(self.tempPath)
+        DownstreamSymbolCache.STATISTICS.takeStatistics()
+
+    def _makeEntry(self, fileName, fileId, size, lastUsed, prefix=''):
+        ''' makes an entry in the cache holding a file of the given size, last used lastUsed seconds ago (under the given prefix directory
+        if two tier). Gives back the file's path. '''
+        entryPath = os.path.join(self.tempPath, prefix, fileName, fileId)
+        os.makedirs(entryPath)
+        path = os.path.join(entryPath, fileName)
+        with open(path, 'wb') as f:
+            f.write(b'a' * size)
+
+        then = time.time() - lastUsed
+        os.utime(path, (then, then))
+        os.utime(entryPath, (then, then))
+        return path
+
+    def test_get_entry_path(self):
+        ''' ensures files are mapped to their <name>/<id> entry '''
+        path = self._makeEntry('TheCrasher.pdb', 'ABC1', 10, 0)
+        assert self.cache.getEntryPath(path) == os.path.join(self.tempPath, 'TheCrasher.pdb', 'ABC1')
+        assert self.cache.getEntryPath(os.path.join(self.tempPath, '000Admin', 'something', 'else')) is None
+        assert self.cache.getEntryPath(os.path.join(self.tempPath, 'pingme.txt')) is None
+        assert self.cache.getEntryPath(os.path.join(tempfile.gettempdir(), 'a', 'b', 'c')) is None
+
+    def test_record_use(self):
+        ''' ensures used entries are marked as used now and counted as hits (or misses if they were just written) '''
+        oldPath = self._makeEntry('Old.pdb', 'ABC1', 10, 1000)
+        newPath = self._makeEntry('New.pdb', 'ABC1', 10, 0)
+
+        assert self.cache.recordUse([oldPath, oldPath, newPath, os.path.join(self.tempPath, 'Missing.pdb', 'ABC1', 'Missing.pdb')],
+                                    since=time.time() - 100) == (1, 1)
+        assert time.time() - os.stat(os.path.dirname(oldPath)).st_mtime < 100
+        assert DownstreamSymbolCache.STATISTICS.getStatistics()['SymbolCacheHits'] == 1
+        assert DownstreamSymbolCache.STATISTICS.getStatistics()['SymbolCacheMisses'] == 1
+
+    def test_scan(self):
+        ''' ensures scan() lists the entries least recently used first '''
+        self._makeEntry('A.pdb', 'ABC1', 10, 10)
+        self._makeEntry('B.pdb', 'ABC1', 20, 30)
+        self._makeEntry('B.pdb', 'ABC2', 30, 20)
+        os.makedirs(os.path.join(self.tempPath, '000Admin', 'notAnEntry'))
+
+        entries = self.cache.scan()
+        assert [os.path.relpath(entry.path, self.tempPath) for entry in entries] == [os.path.join('B.pdb', 'ABC1'),
+                                                                                       os.path.join('B.pdb', 'ABC2'),
+                                                                                       os.path.join('A.pdb', 'ABC1')]
+        assert [entry.size for entry in entries] == [20, 30, 10]
+
+    def test_evict(self):
+        ''' ensures evict() deletes the least recently used entries until the cache is under the cap '''
+        self._makeEntry('A.pdb', 'ABC1', 40, 40)
+        self._makeEntry('B.pdb', 'ABC1', 40, 30)
+        self._makeEntry('C.pdb', 'ABC1', 40, 20)
+        self._makeEntry('C.pdb', 'ABC2', 40, 10)
+
+        assert self.cache.evict() == (2, 80)
+        assert sorted(os.listdir(self.tempPath)) == ['C.pdb']
+        assert DownstreamSymbolCache.STATISTICS.getStatistics()['SymbolCacheEvictions'] == 2
+        assert DownstreamSymbolCache.STATISTICS.getStatistics()['SymbolCacheEvictedBytes'] == 80
+
+        # using an entry keeps it around
+        self.cache.recordUse([os.path.join(self.tempPath, 'C.pdb', 'ABC1', 'C.pdb')], since=time.time())
+        self.cache.maxBytes = 40
+        assert self.cache.evict() == (1, 40)
+        assert os.listdir(os.path.join(self.tempPath, 'C.pdb')) == ['ABC1']
+
+        # nothing to do under the cap
+        assert self.cache.evict() == (0, 0)
+
+    def test_evict_two_tier(self):
+        ''' ensures entries in a two tier cache are found and evicted (along with their prefix directory) '''
+        path = self._makeEntry('A.pdb', 'ABC1', 80, 20, prefix='a')
+        self._makeEntry('B.pdb', 'ABC1', 80, 10, prefix='b')
+        assert self.cache.getEntryPath(path) == os.path.join(self.tempPath, 'a', 'A.pdb', 'ABC1')
+        assert self.cache.evict() == (1, 80)
+        assert os.listdir(self.tempPath) == ['b']
+
+    def test_evict_if_needed(self):
+        ''' ensures evictIfNeeded() only scans the cache once per scan interval '''
+        self.cache.scanIntervalSeconds = 1000
+        self._makeEntry('A.pdb', 'ABC1', 200, 10)
+        assert self.cache.evictIfNeeded() == (1, 200)
+
+        self._makeEntry('B.pdb', 'ABC1', 200, 10)
+        assert self.cache.evictIfNeeded() == (0, 0)
+        assert os.path.isdir(os.path.join(self.tempPath, 'B.pdb'))
+
+        self.cache.scanIntervalSeconds = 0
+        assert self.cache.evictIfNeeded() == (1, 200)
@@ -0,0 +1,66 @@
+''' this file is home to the SymbolServer class, which serves files out of a symbol store (like symsrv asks for them) straight from the
+filesystem. It doesn't use Storage (or the database), so symbol requests don't wait on uploads or analyses. '''
+
+import os
+import urllib.parse
+
+import flask
+
+from csmlog_setup import getLogger
+from symbol_store_index import SymbolStoreIndex
+
+# headers that can be used to hand sending a file off to a front proxy
+X_SENDFILE = 'X-Sendfile'             # like Apache's mod_xsendfile and lighttpd: the value is the file's path
+X_ACCEL_REDIRECT = 'X-Accel-Redirect' # like nginx: the value is a (internal) url the proxy maps to the file
+SEND_FILE_HEADERS = (X_SENDFILE, X_ACCEL_REDIRECT)
+
+logger = getLogger(__file__)
+
+class SymbolServer(object):
+    ''' serves files from the symbol store at path. Files are sent with ETag and Last-Modified headers so clients can do conditional
+    GETs (If-None-Match/If-Modified-Since) and get a 304 if they already have the file.
+    Files are looked up in the store's SymbolStoreIndex, so most lookups (even for files that aren't there) don't touch the filesystem.
+    If sendFileHeader is set (to X-Sendfile or X-Accel-Redirect), the file isn't sent by us. The header is set so a front proxy sends it.
+    For X-Accel-Redirect, the url given to the proxy is the path of the file in the store under accelRedirectPrefix. '''
+    def __init__(self, path, sendFileHeader=None, accelRedirectPrefix='/WindowsSymbols/'):
+        ''' initializer. Takes in the location of the symbol store, and optionally how to hand sending files off to a front proxy '''
+        if sendFileHeader not in (None,) + SEND_FILE_HEADERS:
+            raise ValueError("sendFileHeader must be one of: %s" % str(SEND_FILE_HEADERS))
+
+        self.path = os.path.abspath(path)
+        self.sendFileHeader = sendFileHeader
+        self.accelRedirectPrefix = accelRedirectPrefix
+        self.index = SymbolStoreIndex.getIndex(self.path)
+
+    def getFilePath(self, path):
+        ''' gets the full path of the given file (relative to the symbol store). Gives back None if it doesn't exist or is outside
+        of the symbol store. '''
+        return self.index.getFilePath(path)
+
+    def sendFile(self, path):
+        ''' gets a flask response for the given file (relative to the symbol store). Aborts with a 404 if it isn't there. '''
+        fullPath = self.getFilePath(path)
+        if fullPath is None:
+            flask.abort(404)
+
+        if self.sendFileHeader is None:
+            try:
+                return flask.send_file(fullPath, mimetype='application/octet-stream', conditional=True)
+            except FileNotFoundError:
+                # moved or removed by something that isn't updating the index (like another process migrating the store).
+                #  Look for it again (on disk) in case it was moved.
+                self.index.remove(path)
+                fullPath = self.getFilePath(path)
+                if fullPath is None:
+                    flask.abort(404)
+                return flask.send_file(fullPath, mimetype='application/octet-stream', conditional=True)
+
+        response = flask.Response(mimetype='application/octet-stream')
+        if self.sendFileHeader == X_SENDFILE:
+            response.headers[X_SENDFILE] = fullPath
+        else:
+            relativePath = os.path.relpath(fullPath, self.path).replace(os.sep, '/')
+            response.headers[X_ACCEL_REDIRECT] = self.accelRedirectPrefix.rstrip('/') + '/' + urllib.parse.quote(relativePath)
+
+        logger.debug("Handing off %s to the front proxy via %s" % (fullPath, self.sendFileHeader))
+        return response
@@ -0,0 +1,77 @@
+''' this file contains tests for the symbol server '''
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import flask
+import pytest
+
+from symbol_server import X_ACCEL_REDIRECT, X_SENDFILE, SymbolServer
+
+class TestSymbolServer(unittest.TestCase):
+    ''' test class for SymbolServer '''
+    def setUp(self):
+        ''' makes a symbol store with a file in it, and a flask app serving it with self.symbolServer '''
+        self.tempPath = tempfile.mkdtemp()
+        self.storePath = os.path.join(self.tempPath, 'store')
+        os.makedirs(os.path.join(self.storePath, 'TheCrasher.pdb', 'ABC1'))
+        with open(os.path.join(self.storePath, 'TheCrasher.pdb', 'ABC1', 'TheCrasher.pdb'), 'wb') as f:
+            f.write(b'abcdefghijklmnopqrstuvwxyz')
+        with open(os.path.join(self.tempPath, 'secret.txt'), 'wb') as f:
+            f.write(b'secret')
+
+        self.symbolServer = SymbolServer(self.storePath)
+        app = flask.Flask(__name__)
+        app.add_url_rule('/symbols/<path:path>', 'symbols', lambda path: self.symbolServer.sendFile(path))
+        self.app = app.test_client()
+
+    def tearDown(self):
+        ''' cleans up after each test '''
+        shutil.rmtree(self.tempPath)
+
+    def test_get_file_path(self):
+        ''' ensures only files in the symbol store are found '''
+        assert self.symbolServer.getFilePath('TheCrasher.pdb/ABC1/TheCrasher.pdb') == os.path.join(self.storePath, 'TheCrasher.pdb', 'ABC1', 'TheCrasher.pdb')
+        assert self.symbolServer.getFilePath('TheCrasher.pdb/ABC1') is None
+        assert self.symbolServer.getFilePath('TheCrasher.pdb/ABC2/TheCrasher.pdb') is None
+        assert self.symbolServer.getFilePath('../secret.txt') is None
+        assert self.symbolServer.getFilePath(os.path.join(self.tempPath, 'secret.txt')) is None
+
+    def test_send_file(self):
+        ''' ensures files are sent, with support for conditional GETs '''
+        result = self.app.get('/symbols/TheCrasher.pdb/ABC1/TheCrasher.pdb')
+        assert result.status_code == 200
+        assert result.data == b'abcdefghijklmnopqrstuvwxyz'
+        assert result.headers['ETag']
+        assert result.headers['Last-Modified']
+
+        notModified = self.app.get('/symbols/TheCrasher.pdb/ABC1/TheCrasher.pdb', headers={'If-None-Match' : result.headers['ETag']})
+        assert notModified.status_code == 304
+        assert notModified.data == b''
+
+        notModified = self.app.get('/symbols/TheCrasher.pdb/ABC1/TheCrasher.pdb', headers={'If-Modified-Since' : result.headers['Last-Modified']})
+        assert notModified.status_code == 304
+
+        assert self.app.get('/symbols/TheCrasher.pdb/ABC2/TheCrasher.pdb').status_code == 404
+        assert self.app.get('/symbols/../secret.txt').status_code == 404
+
+    def test_send_file_via_front_proxy(self):
+        ''' ensures sending files can be handed off to a front proxy '''
+        self.symbolServer = SymbolServer(self.storePath, X_SENDFILE)
+        result = self.app.get('/symbols/TheCrasher.pdb/ABC1/TheCrasher.pdb')
+        assert result.status_code == 200
+        assert result.data == b''
+        assert result.headers[X_SENDFILE] == os.path.join(self.storePath, 'TheCrasher.pdb', 'ABC1', 'TheCrasher.pdb')
+
+        self.symbolServer = SymbolServer(self.storePath, X_ACCEL_REDIRECT, accelRedirectPrefix='/internal/symbols')
+        result = self.app.get('/symbols/TheCrasher.pdb/ABC1/TheCrasher.pdb')
+        assert result.data == b''
+        assert result.headers[X_ACCEL_REDIRECT] == '/internal/symbols/TheCrasher.pdb/ABC1/TheCrasher.pdb'
+
+        # missing files are still a 404 from us
+        assert self.app.get('/symbols/TheCrasher.pdb/ABC2/TheCrasher.pdb').status_code == 404
+
+        with pytest.raises(ValueError):
+            SymbolServer(self.storePath, 'X-Not-A-Header')
@@ -0,0 +1,161 @@
+''' this file is home to the SymbolStoreIndex class, an in memory index of the files in a symbol store so lookups (including ones for
+files that aren't there, which debuggers ask for a lot) don't need to touch the filesystem '''
+
+import collections
+import os
+import threading
+import time
+
+from csmlog_setup import getLogger
+from symbol_store_layout import getEntryKey, getPrefix, scanEntries
+
+# misses are remembered for this long before the filesystem is checked again (another process may have added the file since)
+DEFAULT_NEGATIVE_TTL_SECONDS = 60
+
+# at most this many misses are remembered. The oldest are forgotten first.
+DEFAULT_MAX_NEGATIVE_ENTRIES = 100000
+
+logger = getLogger(__file__)
+
+class SymbolStoreIndex(object):
+    ''' an index of the <name>/<id>/<file> files in the symbol store at path. It is built by walking the store once, then kept up to date
+    by WindowsSymbolStore.add() (see recordAdd()). Lookups not in the index go to the filesystem once (another process may have added the
+    file), then the miss is remembered for negativeTtlSeconds.
+    Files are found whichever layout they are in, and can be looked up with a path in either layout (see symbol_store_layout).
+    Use getIndex() to get the index for a store, so every user in the process shares it. '''
+
+    # path of symbol store -> SymbolStoreIndex, for every index in this process
+    _INDEXES = {}
+    _INDEXES_LOCK = threading.Lock()
+
+    def __init__(self, path, negativeTtlSeconds=DEFAULT_NEGATIVE_TTL_SECONDS, maxNegativeEntries=DEFAULT_MAX_NEGATIVE_ENTRIES):
+        ''' initializer. Takes in the location of the symbol store and how long/how many misses to remember. Call build() to fill it. '''
+        self.path = os.path.abspath(path)
+        self.negativeTtlSeconds = negativeTtlSeconds
+        self.maxNegativeEntries = maxNegativeEntries
+
+        self._lock = threading.Lock()
+        self._entries = {} # key -> full path
+        self._negativeEntries = collections.OrderedDict() # key -> when it expires
+
+        self.hits = 0
+        self.negativeHits = 0
+        self.misses = 0
+
+    @classmethod
+    def getIndex(cls, path):
+        ''' gets the (built) index for the symbol store at path, making it if it doesn't exist yet '''
+        path = os.path.abspath(path)
+        with cls._INDEXES_LOCK:
+            if path not in cls._INDEXES:
+                index = cls(path)
+                index.build()
+                cls._INDEXES[path] = index
+            return cls._INDEXES[path]
+
+    @classmethod
+    def recordAdd(cls, path, relativePath, removedRelativePath=None):
+        ''' called when a file is added to the symbol store at path (and optionally another is removed). Updates the index for that store
+        if there is one in this process. '''
+        with cls._INDEXES_LOCK:
+            index = cls._INDEXES.get(os.path.abspath(path))
+
+        if index is not None:
+            index.add(relativePath)
+            if removedRelativePath is not None:
+                index.remove(removedRelativePath)
+
+    @classmethod
+    def _getKey(cls, relativePath):
+        ''' gets the key used for the given path (relative to the store) in the index '''
+        return os.path.normcase(getEntryKey(relativePath))
+
+    def build(self):
+        ''' (re)builds the index by walking the symbol store '''
+        entries = {}
+        for name, idEntry in scanEntries(self.path):
+            try:
+                fileEntries = [fileEntry for fileEntry in os.scandir(idEntry.path) if fileEntry.is_file()]
+            except OSError:
+                continue
+
+            for fileEntry in fileEntries:
+                entries[self._getKey('/'.join((name, idEntry.name, fileEntry.name)))] = fileEntry.path
+
+        with self._lock:
+            self._entries = entries
+            self._negativeEntries.clear()
+
+        logger.debug("Indexed %d files in the symbol store: %s" % (len(entries), self.path))
+
+    def add(self, relativePath):
+        ''' adds the given file (relative to the store, in the layout it is in) to the index '''
+        key = self._getKey(relativePath)
+        fullPath = os.path.join(self.path, *relativePath.replace('\\', '/').split('/'))
+        with self._lock:
+            self._entries[key] = fullPath
+            self._negativeEntries.pop(key, None)
+
+    def remove(self, relativePath):
+        ''' removes the given file (relative to the store) from the index '''
+        with self._lock:
+            self._entries.pop(self._getKey(relativePath), None)
+
+    def _getFilePathFromDisk(self, relativePath):
+        ''' gets the full path of the given file (relative to the store) by looking on disk in both layouts. Gives back None if it doesn't
+        exist or is outside of the symbol store. '''
+        key = getEntryKey(relativePath)
+        candidates = [key]
+        if len(key.split('/')) == 3:
+            candidates.append(getPrefix(key) + '/' + key)
+
+        for candidate in candidates:
+            fullPath = os.path.abspath(os.path.join(self.path, candidate))
+
+            # make sure that somehow we aren't out of the symbols directory
+            if os.path.commonpath([self.path, fullPath]) == self.path and os.path.isfile(fullPath):
+                return fullPath
+
+        return None
+
+    def getFilePath(self, relativePath):
+        ''' gets the full path of the given file (relative to the store). Gives back None if it isn't in the store. '''
+        key = self._getKey(relativePath)
+        now = time.time()
+        with self._lock:
+            fullPath = self._entries.get(key)
+            if fullPath is not None:
+                self.hits += 1
+                return fullPath
+
+            expires = self._negativeEntries.get(key)
+            if expires is not None and expires > now:
+                self.negativeHits += 1
+                return None
+
+            self.misses += 1
+
+        fullPath = self._getFilePathFromDisk(relativePath)
+        with self._lock:
+            parts = key.split('/')
+            if fullPath is not None and len(parts) == 3 and os.pardir not in parts and os.curdir not in parts:
+                # added by something that isn't updating this index (like another process)
+                self._entries[key] = fullPath
+            elif fullPath is None:
+                self._negativeEntries.pop(key, None)
+                self._negativeEntries[key] = now + self.negativeTtlSeconds
+                while len(self._negativeEntries) > self.maxNegativeEntries:
+                    self._negativeEntries.popitem(last=False)
+
+        return fullPath
+
+    def getStatistics(self):
+        ''' gets a dict of statistic name -> value for this index '''
+        with self._lock:
+            return {
+                'SymbolIndexEntries' : len(self._entries),
+                'SymbolIndexNegativeEntries' : len(self._negativeEntries),
+                'SymbolIndexHits' : self.hits,
+                'SymbolIndexNegativeHits' : self.negativeHits,
+                'SymbolIndexMisses' : self.misses,
+            }
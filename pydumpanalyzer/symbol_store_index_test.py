@@ -0,0 +1,107 @@
+''' this file contains tests for the symbol store index '''
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import unittest.mock
+
+from symbol_store_index import SymbolStoreIndex
+
+class TestSymbolStoreIndex(unittest.TestCase):
+    ''' test class for SymbolStoreIndex '''
+    def setUp(self):
+        ''' makes a symbol store with a file in it, and an index of it in self.index '''
+        self.tempPath = tempfile.mkdtemp()
+        self._makeFile('TheCrasher.pdb', 'ABC1', 'TheCrasher.pdb')
+        self._makeFile('000Admin', 'notAnEntry', 'history.txt')
+        self.index = SymbolStoreIndex(self.tempPath)
+        self.index.build()
+
+    def tearDown(self):
+        ''' cleans up after each test '''
+        shutil.rmtree(self.tempPath)
+
+    def _makeFile(self, *parts):
+        ''' makes a file in the symbol store, giving back its path '''
+        path = os.path.join(self.tempPath, *parts)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(b'abcdefghijklmnopqrstuvwxyz')
+        return path
+
+    def test_build(self):
+        ''' ensures the files in the store are indexed and found without going to disk '''
+        assert self.index.getStatistics()['SymbolIndexEntries'] == 1
+        with unittest.mock.patch('os.path.isfile', side_effect=AssertionError("should not go to disk")):
+            assert self.index.getFilePath('TheCrasher.pdb/ABC1/TheCrasher.pdb') == os.path.join(self.tempPath, 'TheCrasher.pdb', 'ABC1', 'TheCrasher.pdb')
+            assert self.index.getFilePath('TheCrasher.pdb\\ABC1\\TheCrasher.pdb') == os.path.join(self.tempPath, 'TheCrasher.pdb', 'ABC1', 'TheCrasher.pdb')
+        assert self.index.getStatistics()['SymbolIndexHits'] == 2
+
+    def test_two_tier(self):
+        ''' ensures files are found in either layout, by a path in either layout '''
+        path = self._makeFile('ot', 'Other.pdb', 'ABC1', 'Other.pdb')
+        self.index.build()
+        assert self.index.getStatistics()['SymbolIndexEntries'] == 2
+        for layoutPath in ('Other.pdb/ABC1/Other.pdb', 'ot/Other.pdb/ABC1/Other.pdb'):
+            assert self.index.getFilePath(layoutPath) == path
+        assert self.index.getFilePath('th/TheCrasher.pdb/ABC1/TheCrasher.pdb') == os.path.join(self.tempPath, 'TheCrasher.pdb', 'ABC1', 'TheCrasher.pdb')
+
+        # not indexed yet, found on disk
+        path = self._makeFile('ne', 'New.pdb', 'ABC1', 'New.pdb')
+        assert self.index.getFilePath('New.pdb/ABC1/New.pdb') == path
+        assert self.index.getStatistics()['SymbolIndexEntries'] == 3
+
+    def test_negative_cache(self):
+        ''' ensures misses are remembered (until they expire) '''
+        assert self.index.getFilePath('TheCrasher.pdb/ABC2/TheCrasher.pdb') is None
+        assert self.index.getStatistics()['SymbolIndexMisses'] == 1
+
+        # added by someone else, but the miss is still remembered
+        self._makeFile('TheCrasher.pdb', 'ABC2', 'TheCrasher.pdb')
+        assert self.index.getFilePath('TheCrasher.pdb/ABC2/TheCrasher.pdb') is None
+        assert self.index.getStatistics()['SymbolIndexNegativeHits'] == 1
+
+        with unittest.mock.patch('time.time', return_value=time.time() + self.index.negativeTtlSeconds + 1):
+            assert self.index.getFilePath('TheCrasher.pdb/ABC2/TheCrasher.pdb') is not None
+        assert self.index.getStatistics()['SymbolIndexMisses'] == 2
+        assert self.index.getStatistics()['SymbolIndexEntries'] == 2
+
+        # only so many misses are remembered
+        self.index.maxNegativeEntries = 2
+        for i in range(5):
+            assert self.index.getFilePath('Other.pdb/ABC%d/Other.pdb' % i) is None
+        assert self.index.getStatistics()['SymbolIndexNegativeEntries'] == 2
+
+    def test_add_and_remove(self):
+        ''' ensures adding a file replaces a remembered miss, and removing one takes it out of the index '''
+        assert self.index.getFilePath('TheCrasher.pdb/ABC2/TheCrasher.pdb') is None
+        path = self._makeFile('TheCrasher.pdb', 'ABC2', 'TheCrasher.pdb')
+        self.index.add('TheCrasher.pdb/ABC2/TheCrasher.pdb')
+        assert self.index.getFilePath('TheCrasher.pdb/ABC2/TheCrasher.pdb') == path
+
+        os.remove(path)
+        self.index.remove('TheCrasher.pdb/ABC2/TheCrasher.pdb')
+        assert self.index.getFilePath('TheCrasher.pdb/ABC2/TheCrasher.pdb') is None
+
+    def test_outside_of_store(self):
+        ''' ensures files outside of the store (or that aren't entries) aren't indexed '''
+        assert self.index.getFilePath('../' + os.path.basename(self.tempPath) + '/TheCrasher.pdb/ABC1/TheCrasher.pdb') is not None
+        assert self.index.getFilePath('000Admin/notAnEntry/../../../secret.txt') is None
+        assert self.index.getStatistics()['SymbolIndexEntries'] == 1
+
+    def test_get_index(self):
+        ''' ensures there is one (built) index per store, and adds are passed on to it '''
+        index = SymbolStoreIndex.getIndex(self.tempPath)
+        assert SymbolStoreIndex.getIndex(os.path.join(self.tempPath, 'TheCrasher.pdb', '..')) is index
+        assert index.getStatistics()['SymbolIndexEntries'] == 1
+
+        SymbolStoreIndex.recordAdd(self.tempPath, 'TheCrasher.pdb/ABC2/TheCrasher.pd_', 'TheCrasher.pdb/ABC2/TheCrasher.pdb')
+        assert index.getStatistics()['SymbolIndexEntries'] == 2
+
+        SymbolStoreIndex.recordAdd(self.tempPath, 'TheCrasher.pdb/ABC2/TheCrasher.pdb', 'TheCrasher.pdb/ABC2/TheCrasher.pd_')
+        assert index.getStatistics()['SymbolIndexEntries'] == 2
+
+        # stores without an index are ignored
+        SymbolStoreIndex.recordAdd(os.path.join(self.tempPath, 'other'), 'TheCrasher.pdb/ABC2/TheCrasher.pdb')
@@ -0,0 +1,68 @@
+''' this file is home to helpers for the layouts of a (Windows) symbol store on disk:
+    single tier: <name>/<id>/<file>, like TheCrasher.pdb/<id>/TheCrasher.pdb
+    two tier: <prefix>/<name>/<id>/<file>, where the prefix is the first two characters of the name, like th/TheCrasher.pdb/<id>/TheCrasher.pdb
+A store is two tier if it has an index2.txt file at its top. Two tier keeps any one directory from holding every name in a large store. '''
+
+import os
+
+INDEX2_FILE_NAME = 'index2.txt'
+
+# directories (and files) at the top of a symbol store that aren't entries
+NOT_ENTRIES = ('000Admin', 'pingme.txt', INDEX2_FILE_NAME)
+
+# length of the prefix directory names in a two tier store
+PREFIX_LENGTH = 2
+
+def isTwoTier(path):
+    ''' returns True if the symbol store at path uses the two tier layout '''
+    return os.path.isfile(os.path.join(path, INDEX2_FILE_NAME))
+
+def getPrefix(fileName):
+    ''' gets the prefix directory the given name is under in a two tier store '''
+    return fileName[:PREFIX_LENGTH].lower()
+
+def isPrefixDirectoryName(name):
+    ''' returns True if the given directory name (at the top of a store) is a two tier prefix directory rather than a name.
+    Names are longer than prefixes since they have an extension. '''
+    return len(name) <= PREFIX_LENGTH and name not in NOT_ENTRIES
+
+def getEntryParts(fileName, fileId, twoTier):
+    ''' gets a list of the parts of the path (relative to the store) of the directory for the given name and id '''
+    if twoTier:
+        return [getPrefix(fileName), fileName, fileId]
+    return [fileName, fileId]
+
+def getEntryKey(relativePath):
+    ''' gets the path of a file (relative to the store) the way it would be in a single tier store (as a / separated string). Paths from
+    either layout give back the same key, so a file can be looked up no matter which layout it (or the request for it) uses. '''
+    parts = [part for part in relativePath.replace('\\', '/').split('/') if part]
+    if len(parts) == 4 and isPrefixDirectoryName(parts[0]) and getPrefix(parts[1]) == parts[0].lower():
+        parts = parts[1:]
+    return '/'.join(parts)
+
+def scanEntries(path):
+    ''' yields a tuple of (name, os.DirEntry of the id directory) for every entry in the symbol store at path, in either layout (or a mix of both,
+    like during a migration) '''
+    if not os.path.isdir(path):
+        return
+
+    for topEntry in os.scandir(path):
+        if topEntry.name in NOT_ENTRIES or not topEntry.is_dir():
+            continue
+
+        # directories can go away while we look (like if evicted or migrated by someone else)
+        try:
+            nameEntries = [topEntry]
+            if isPrefixDirectoryName(topEntry.name):
+                nameEntries = [nameEntry for nameEntry in os.scandir(topEntry.path) if nameEntry.is_dir()]
+        except OSError:
+            continue
+
+        for nameEntry in nameEntries:
+            try:
+                idEntries = [idEntry for idEntry in os.scandir(nameEntry.path) if idEntry.is_dir()]
+            except OSError:
+                continue
+
+            for idEntry in idEntries:
+                yield nameEntry.name, idEntry
@@ -0,0 +1,50 @@
+''' this file contains tests for the symbol store layout helpers '''
+
+import os
+import shutil
+import tempfile
+
+from symbol_store_layout import getEntryKey, getEntryParts, getPrefix, isPrefixDirectoryName, isTwoTier, scanEntries
+
+def test_get_entry_parts():
+    ''' ensures entries go in the right place for each layout '''
+    assert getPrefix('TheCrasher.pdb') == 'th'
+    assert getEntryParts('TheCrasher.pdb', 'ABC1', twoTier=False) == ['TheCrasher.pdb', 'ABC1']
+    assert getEntryParts('TheCrasher.pdb', 'ABC1', twoTier=True) == ['th', 'TheCrasher.pdb', 'ABC1']
+
+def test_get_entry_key():
+    ''' ensures paths in either layout give the same key '''
+    assert getEntryKey('TheCrasher.pdb/ABC1/TheCrasher.pdb') == 'TheCrasher.pdb/ABC1/TheCrasher.pdb'
+    assert getEntryKey('th/TheCrasher.pdb/ABC1/TheCrasher.pdb') == 'TheCrasher.pdb/ABC1/TheCrasher.pdb'
+    assert getEntryKey('Th\\TheCrasher.pdb\\ABC1\\TheCrasher.pdb') == 'TheCrasher.pdb/ABC1/TheCrasher.pdb'
+    assert getEntryKey('/TheCrasher.pdb//ABC1/TheCrasher.pdb') == 'TheCrasher.pdb/ABC1/TheCrasher.pdb'
+
+    # the prefix has to match the name
+    assert getEntryKey('ab/TheCrasher.pdb/ABC1/TheCrasher.pdb') == 'ab/TheCrasher.pdb/ABC1/TheCrasher.pdb'
+    assert getEntryKey('pingme.txt') == 'pingme.txt'
+
+def test_is_prefix_directory_name():
+    ''' ensures prefix directories can be told apart from names '''
+    assert isPrefixDirectoryName('th')
+    assert isPrefixDirectoryName('a.')
+    assert not isPrefixDirectoryName('TheCrasher.pdb')
+    assert not isPrefixDirectoryName('000Admin')
+
+def test_scan_entries():
+    ''' ensures entries are found in either layout (or both at once) '''
+    path = tempfile.mkdtemp()
+    try:
+        assert not isTwoTier(path)
+        for parts in (['TheCrasher.pdb', 'ABC1'], ['th', 'TheCrasher.exe', 'ABC2'], ['000Admin', 'notAnEntry']):
+            os.makedirs(os.path.join(path, *parts))
+        open(os.path.join(path, 'index2.txt'), 'w').close()
+        assert isTwoTier(path)
+
+        assert sorted((name, idEntry.path) for name, idEntry in scanEntries(path)) == [
+            ('TheCrasher.exe', os.path.join(path, 'th', 'TheCrasher.exe', 'ABC2')),
+            ('TheCrasher.pdb', os.path.join(path, 'TheCrasher.pdb', 'ABC1')),
+        ]
+    finally:
+        shutil.rmtree(path)
+
+    assert list(scanEntries(path)) == []
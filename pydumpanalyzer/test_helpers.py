@@ -0,0 +1,136 @@
+''' home to helpers shared by the tests (made up files, debugger output and the like). When run directly, this file acts like cdb
+(reading commands from stdin) for the tests '''
+import json
+import os
+import struct
+import sys
+import time
+import uuid
+import zlib
+
+from cabinet import CAB_BLOCK_SIZE, CAB_DATA, CAB_FILE, CAB_FOLDER, CAB_HEADER, CAB_SIGNATURE, COMPRESSION_MSZIP, MSZIP_SIGNATURE
+from windbg import WinDbg
+from windbg_parser import UNWIND_WARNING
+from windows_symbol_file import MSF_MAGIC, MSF_NIL_STREAM_SIZE, PE_SIGNATURE
+
+class WinDbgWithoutCdb(WinDbg):
+    ''' WinDbg without the requirement for CDB to be installed '''
+    CDB_DBG_PATH = __file__
+
+def makeExampleStackOutput(frameCount):
+    ''' makes kpn-like output with the given number of frames (with an unwind warning halfway through) '''
+    lines = [' # ChildEBP RetAddr']
+    for idx in range(frameCount):
+        if idx == frameCount // 2:
+            lines.append('WARNING: %s. Following frames may be wrong.' % UNWIND_WARNING)
+        lines.append('%02x 010ffc14 00889ad9 TheCrasher!recurse(int depth = 0n%d)+0x1b [c:\\source.cpp @ %d]' % (idx, idx, idx + 1))
+    return '\n'.join(lines)
+
+EXAMPLE_GUID = uuid.UUID('12345678-9abc-def0-1122-334455667788')
+
+def makePe(timeDateStamp, sizeOfImage, pe32Plus=False):
+    ''' makes the bytes of a minimal PE file (just its headers) with the given TimeDateStamp and SizeOfImage '''
+    dosHeader = (b'MZ' + b'\0' * 58 + struct.pack('<I', 0x80)).ljust(0x80, b'\0')
+    coffHeader = struct.pack('<HHIIIHH', 0x14c, 0, timeDateStamp, 0, 0, 224, 0x102)
+    optionalHeader = bytearray(224)
+    struct.pack_into('<H', optionalHeader, 0, 0x20b if pe32Plus else 0x10b)
+    struct.pack_into('<I', optionalHeader, 56, sizeOfImage)
+    return dosHeader + PE_SIGNATURE + coffHeader + bytes(optionalHeader)
+
+def makePdb(guid, age, dbiAge=None, blockSize=512):
+    ''' makes the bytes of a minimal MSF 7.0 PDB with the given GUID (a uuid.UUID) and ages (no DBI stream if dbiAge is None).
+    The info stream spans 2 blocks (out of order) to make sure streams are read through the directory. '''
+    infoStream = struct.pack('<III', 20000404, 0x5e9b1a2c, age) + guid.bytes_le + b'\x01' * blockSize
+    dbiStream = struct.pack('<iII', -1, 19990903, dbiAge) if dbiAge is not None else None
+    streams = [b'', infoStream, None, dbiStream]
+
+    # block 0 is the super block, 1 and 2 are free block maps, 3 is the block map and 4 is the stream directory
+    blocks = {}
+    nextBlock = 5
+    streamBlocks = []
+    for stream in streams:
+        blockCount = (len(stream or b'') + blockSize - 1) // blockSize
+        indices = list(reversed(range(nextBlock, nextBlock + blockCount)))
+        nextBlock += blockCount
+        for i, index in enumerate(indices):
+            blocks[index] = stream[i * blockSize:(i + 1) * blockSize]
+        streamBlocks.append(indices)
+
+    directory = struct.pack('<I', len(streams))
+    directory += b''.join(struct.pack('<I', MSF_NIL_STREAM_SIZE if stream is None else len(stream)) for stream in streams)
+    directory += b''.join(struct.pack('<%dI' % len(indices), *indices) for indices in streamBlocks)
+    blocks[4] = directory
+    blocks[3] = struct.pack('<I', 4)
+    blocks[0] = MSF_MAGIC + struct.pack('<6I', blockSize, 1, nextBlock, len(directory), 0, 3)
+    return b''.join(blocks.get(i, b'').ljust(blockSize, b'\0') for i in range(nextBlock))
+
+def readCabinet(data):
+    ''' reads the given cabinet (bytes) with a single MSZIP compressed file. Gives back a tuple of (file name, file contents) '''
+    signature, _, cabinetSize, _, filesOffset, _, minor, major, folderCount, fileCount, flags, _, _ = CAB_HEADER.unpack_from(data, 0)
+    assert signature == CAB_SIGNATURE
+    assert (major, minor) == (1, 3)
+    assert cabinetSize == len(data)
+    assert (folderCount, fileCount, flags) == (1, 1, 0)
+
+    dataOffset, blockCount, compression = CAB_FOLDER.unpack_from(data, CAB_HEADER.size)
+    assert compression == COMPRESSION_MSZIP
+
+    fileSize, folderOffset, folderIndex, date, time, attributes = CAB_FILE.unpack_from(data, filesOffset)
+    fileName = data[filesOffset + CAB_FILE.size:data.index(b'\0', filesOffset + CAB_FILE.size)].decode('utf-8')
+
+    contents = b''
+    offset = dataOffset
+    for i in range(blockCount):
+        checksum, compressedSize, size = CAB_DATA.unpack_from(data, offset)
+        offset += CAB_DATA.size
+        block = data[offset:offset + compressedSize]
+        offset += compressedSize
+
+        assert block.startswith(MSZIP_SIGNATURE)
+        assert size <= CAB_BLOCK_SIZE
+        uncompressed = zlib.decompressobj(-zlib.MAX_WBITS).decompress(block[len(MSZIP_SIGNATURE):])
+        assert len(uncompressed) == size
+        contents += uncompressed
+
+    assert offset == len(data)
+    assert len(contents) == fileSize
+    return fileName, contents
+
+FAKE_CDB_ARGS = [sys.executable, __file__]
+
+# environment variable with a json dict of command -> the output the fake cdb gives for it
+FAKE_CDB_OUTPUTS_VARIABLE = 'PDA_FAKE_CDB_OUTPUTS'
+
+def _fakeCdb():
+    ''' acts like cdb reading commands from stdin: a banner, then a prompt before each command is read (so the prompt is in front of
+    each command's output, like the real one) '''
+    cannedOutputs = json.loads(os.environ.get(FAKE_CDB_OUTPUTS_VARIABLE, '{}'))
+    print("Microsoft (R) Windows Debugger Version 10.0 X86")
+    print("Loading Dump File [%s]" % ' '.join(sys.argv[1:]))
+    commandCount = 0
+    while True:
+        sys.stdout.write('0:000> ')
+        sys.stdout.flush()
+
+        command = sys.stdin.readline()
+        if not command or command.strip() == 'q':
+            break
+
+        command = command.strip()
+        commandCount += 1
+        if command.startswith('.echo '):
+            print(command.split('.echo ', 1)[1])
+        elif command.startswith('sleep '):
+            time.sleep(float(command.split()[1]))
+        elif command == 'crash':
+            sys.exit(1)
+        elif command == 'count':
+            print(commandCount)
+        elif command in cannedOutputs:
+            print(cannedOutputs[command])
+        else:
+            print('output of %s' % command)
+            print('second line')
+
+if __name__ == '__main__':
+    _fakeCdb()
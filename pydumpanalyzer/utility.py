@@ -4,7 +4,11 @@ import contextlib
 import io
 import os
 import shutil
+import signal
+import subprocess
 import tempfile
+import threading
+import traceback
 import uuid
 
 from csmlog_setup import getLogger
@@ -41,6 +45,118 @@ def temporaryFilePath(delete=True, fileName=None):
         if delete:
             shutil.rmtree(folderPath, ignore_errors=True)
 
+def linkOrCopyFile(source, destination):
+    ''' hard links source to destination so no data needs to be copied.
+    Falls back to copying if a link isn't possible (different volumes, unsupported filesystem, etc.) '''
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
+
+def killProcessTree(process):
+    ''' kills the given subprocess.Popen process along with everything it started, then reaps it.
+    On POSIX, the process should have been started with start_new_session=True (so its children are in its process group). '''
+    try:
+        if os.name == 'nt':
+            subprocess.call(['taskkill', '/T', '/F', '/PID', str(process.pid)], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        else:
+            # the process isn't reaped yet, so its group id can't have been reused
+            os.killpg(process.pid, signal.SIGKILL)
+    except OSError as ex:
+        logger.debug("Could not kill process tree for %d: %s" % (process.pid, str(ex)))
+
+    if process.poll() is None:
+        process.kill()
+    process.wait()
+
+@contextlib.contextmanager
+def lockFile(path):
+    ''' context manager holding an exclusive lock on the given (lock) file, so only one thread/process at a time is in it.
+    The file is created if needed. Blocks until the lock is gotten. '''
+    with open(path, 'a+b') as f:
+        if os.name == 'nt':
+            import msvcrt
+            f.seek(0)
+            while True:
+                try:
+                    # gives up after trying for 10 seconds
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    pass
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+@contextlib.contextmanager
+def callEvery(function, intervalSeconds):
+    ''' context manager that calls the given function right away, then every intervalSeconds (on a background thread) until it is left.
+    Exceptions from the function are logged, then it keeps being called. '''
+    stopEvent = threading.Event()
+    def run():
+        while True:
+            try:
+                function()
+            except Exception:
+                logger.error("Periodic call to %s failed: %s" % (function, traceback.format_exc()))
+
+            if stopEvent.wait(intervalSeconds):
+                break
+
+    thread = threading.Thread(target=run, name='callEvery', daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stopEvent.set()
+        thread.join()
+
+class Statistics(object):
+    ''' thread safe counts kept in this process (like how many calls were made, and how long they took).
+    Counts are recorded by keyword (like record(calls=1, seconds=.5)), and given back by their statistic names. '''
+    def __init__(self, names):
+        ''' initializer takes in a dict of keyword -> statistic name (like 'calls' -> 'DebuggerCalls') '''
+        self._names = dict(names)
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        ''' zeros out all counts '''
+        self._counts = {keyword : 0 for keyword in self._names}
+
+    def record(self, **counts):
+        ''' adds the given counts (by keyword) '''
+        with self._lock:
+            for keyword, value in counts.items():
+                if keyword not in self._counts:
+                    raise KeyError("Unknown statistic: %s" % keyword)
+                self._counts[keyword] += value
+
+    def _getStatistics(self):
+        ''' gets a dict of statistic name -> value. The lock must be held. '''
+        return {self._names[keyword] : value for keyword, value in self._counts.items()}
+
+    def getStatistics(self):
+        ''' gets a dict of statistic name -> value '''
+        with self._lock:
+            return self._getStatistics()
+
+    def takeStatistics(self):
+        ''' like getStatistics() but the counts are zeroed after (so they can be added to storage's running totals) '''
+        with self._lock:
+            statistics = self._getStatistics()
+            self._reset()
+            return statistics
+
 def textToSafeHtmlText(s):
     ''' coerces a string into html-safe text '''
     return s.replace(' ', '&nbsp;').replace('<', '&lt;').replace('>', '&gt;').replace('\n', '<br>')
@@ -1,7 +1,14 @@
 ''' this is where we have tests for utilities '''
 import os
+import subprocess
+import sys
+import threading
+import time
 
-from utility import getUniqueId, getUniqueTableName, textToSafeHtmlText, temporaryFilePath, zipDirectoryToBytesIo
+import pytest
+
+from utility import (Statistics, callEvery, getUniqueId, getUniqueTableName, killProcessTree, linkOrCopyFile, lockFile, textToSafeHtmlText,
+                     temporaryFilePath, zipDirectoryToBytesIo)
 
 def test_unique_id():
     ''' makes sure we get unique ids on each getUniqueId() call '''
@@ -82,6 +89,19 @@ def test_temp_file_path_with_a_directory():
 
     assert not os.path.exists(testPath)
 
+def test_link_or_copy_file():
+    ''' ensures linkOrCopyFile() gives us the same content at the new path '''
+    with temporaryFilePath() as source:
+        with open(source, 'wb') as f:
+            f.write(b'bleh')
+
+        with temporaryFilePath(fileName='other_name') as destination:
+            linkOrCopyFile(source, destination)
+            with open(destination, 'rb') as f:
+                assert f.read() == b'bleh'
+
+        assert os.path.isfile(source)
+
 def test_zip_directory_to_bytes_io():
     ''' ensures we can zip a directory to io.BytesIO '''
     with temporaryFilePath() as tempFile:
@@ -94,4 +114,72 @@ def test_zip_directory_to_bytes_io():
 
         binaryData = zipDirectoryToBytesIo(tempFile).read()
         assert len(binaryData) > 10
-        assert binaryData[0] == 0x50 # all zip files start with 0x50
\ No newline at end of file
+        assert binaryData[0] == 0x50 # all zip files start with 0x50
+
+def test_kill_process_tree():
+    ''' ensures a process (that started its own child) is killed and reaped '''
+    code = 'import subprocess, sys, time; subprocess.Popen([sys.executable, "-c", "import time; time.sleep(60)"]); time.sleep(60)'
+    process = subprocess.Popen([sys.executable, '-c', code], start_new_session=True)
+    time.sleep(.5)
+
+    startTime = time.time()
+    killProcessTree(process)
+    assert process.returncode is not None
+    assert time.time() - startTime < 10
+
+    # killing something that already exited is fine too
+    killProcessTree(process)
+
+def test_call_every():
+    ''' ensures the function is called repeatedly (even after failing) until the with block is left '''
+    calls = []
+    def function():
+        calls.append(1)
+        if len(calls) == 1:
+            raise RuntimeError("keep going")
+
+    with callEvery(function, .01):
+        deadline = time.time() + 10
+        while len(calls) < 3 and time.time() < deadline:
+            time.sleep(.01)
+
+    count = len(calls)
+    assert count >= 3
+    time.sleep(.05)
+    assert len(calls) == count
+
+def test_statistics():
+    ''' ensures counts are recorded by keyword, given back by statistic name and zeroed when taken '''
+    statistics = Statistics({'calls' : 'Calls', 'seconds' : 'CallSeconds'})
+    assert statistics.getStatistics() == {'Calls' : 0, 'CallSeconds' : 0}
+
+    statistics.record(calls=1, seconds=.5)
+    statistics.record(calls=1)
+    assert statistics.takeStatistics() == {'Calls' : 2, 'CallSeconds' : .5}
+    assert statistics.getStatistics() == {'Calls' : 0, 'CallSeconds' : 0}
+
+    with pytest.raises(KeyError):
+        statistics.record(notAStatistic=1)
+
+def test_lock_file():
+    ''' ensures only one thread at a time holds the lock on a file '''
+    with temporaryFilePath() as lockPath:
+        holding = []
+        overlapped = []
+        def work():
+            for i in range(20):
+                with lockFile(lockPath):
+                    holding.append(1)
+                    if len(holding) > 1:
+                        overlapped.append(1)
+                    time.sleep(.001)
+                    holding.pop()
+
+        threads = [threading.Thread(target=work) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert not overlapped
+        assert os.path.isfile(lockPath)
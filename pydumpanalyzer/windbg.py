@@ -1,21 +1,44 @@
 ''' this contains the implementation for the WinDbg Debugger '''
 
+import collections
 import os
+import queue
 import re
 import subprocess
 import sys
 import tempfile
+import threading
 import time
 
+from analysis import Analysis
 from csmlog_setup import getLogger
 from debugger import Debugger
+from debugger_session import REGEX_PROMPT, DebuggerSession
 from frame import Frame
 from stack import Stack
+from symbol_cache import DownstreamSymbolCache
+from utility import killProcessTree
 from variable import Variable
+from windbg_parser import getModuleAndFunction, getSourceFileAndLine, parseStackOutput, splitThreadsOutput
 from windows_symbol_store import WindowsSymbolStore
 
-MAX_STACK_DEPTH = 100
-REGEX_FILE_AND_LINE_FROM_FRAME = re.compile(r'\[(.*)@\s*(\d+)')
+# cdb's k commands only show 256 frames unless given a frame count (in hex), and recursion can go thousands deep. So they're asked for the most frames cdb allows.
+MAX_STACK_DEPTH = 0xffff
+STACK_COMMAND_CLEAN = 'kcn %x' % MAX_STACK_DEPTH
+STACK_COMMAND_EXTENDED = 'kpn %x' % MAX_STACK_DEPTH
+ALL_THREADS_STACK_COMMAND_CLEAN = '~*' + STACK_COMMAND_CLEAN
+ALL_THREADS_STACK_COMMAND_EXTENDED = '~*' + STACK_COMMAND_EXTENDED
+REGEX_MARKER = re.compile(r'^== (Start|End) Calling (.*) ==$')
+
+# the symbol file at the end of a module's line from lm, like: 00880000 008a0000   TheCrasher C (private pdb symbols)  c:\symbols\TheCrasher.pdb
+REGEX_LOADED_SYMBOL_FILE = re.compile(r'pdb symbols\)\s+(.+?)\s*$')
+
+# timeout (in seconds) for the single cdb run that does a whole analysis
+BATCH_TIMEOUT = 600
+
+# number of lines from the end of cdb's output that are kept to log if it fails
+ERROR_OUTPUT_LINES = 50
+
 DOWNSTREAM_TEMP_SYMBOLS = os.path.join(tempfile.gettempdir(), "DownstreamSymbols")
 
 # think py2 would need this
@@ -24,8 +47,43 @@ if not hasattr(subprocess, 'DEVNULL'):
 
 logger = getLogger(__file__)
 
+class CommandOutputSplitter(object):
+    ''' splits up debugger output (given a line at a time, as it comes) into the output of each command, using the
+    Start/End Calling markers echoed around each command. onSection(command, output) is called as each command's output completes.
+    Lines outside of the markers aren't kept. '''
+    def __init__(self, onSection):
+        ''' initializer takes in the function to call with each (command, output) '''
+        self.onSection = onSection
+        self._lines = None
+
+    def feedLine(self, line):
+        ''' takes the next line of output. The debugger's prompt is taken off the front first: when commands come from stdin, the
+        prompt is in front of each command's (first line of) output, including each marker. The debugger's echo of each command given
+        with -c doesn't match a marker. '''
+        line = REGEX_PROMPT.sub('', line)
+        match = REGEX_MARKER.match(line.strip())
+        if not match:
+            if self._lines is not None:
+                self._lines.append(line)
+        elif match.group(1) == 'Start':
+            self._lines = []
+        elif self._lines is not None:
+            self.onSection(match.group(2), '\n'.join(self._lines))
+            self._lines = None
+
 class WinDbg(Debugger):
     CDB_DBG_PATH = r'C:\Program Files (x86)\Windows Kits\10\Debuggers\x86\cdb.exe'
+
+    # if True, getAnalysis() runs cdb once for everything instead of once per command (each run reloads the dump and symbols)
+    BATCH_ANALYSIS = True
+
+    # commands run when a session is opened (see openSession())
+    SESSION_SETUP_COMMANDS = ['.symopt+0x10']
+
+    # keeps DOWNSTREAM_TEMP_SYMBOLS (where symbols from upstream symbol stores are cached) under a size cap, evicting the least recently
+    #  used symbols. Set its maxBytes to change the cap.
+    DOWNSTREAM_SYMBOL_CACHE = DownstreamSymbolCache(DOWNSTREAM_TEMP_SYMBOLS)
+
     def _platformSetup(self):
         if not os.path.isfile(self.CDB_DBG_PATH):
             raise EnvironmentError("Could not find CDB: %s" % self.CDB_DBG_PATH)
@@ -86,71 +144,212 @@ class WinDbg(Debugger):
 
             debugCommandsList = finalCommandList
 
-        # cheap... this will get deleted immediately but we'll have the path
-        with tempfile.NamedTemporaryFile() as tempFile:
-            tempFileName = tempFile.name
-
         if exeOverload is not None:
             exe = exeOverload
         else:
             exe = self.CDB_DBG_PATH
 
         cmdsWithSemiColons = ';'.join(debugCommandsList)
-        args = [exe,
+
+        # used to get rid of output we don't need: only the output of each command is kept as it streams in
+        if getJustCommandOutput and outputHeader and outputFooter:
+            sections = []
+            splitter = CommandOutputSplitter(lambda command, output: sections.append((command, output)))
+            self._runCdb(["-c", cmdsWithSemiColons], debugCommandsList, exe=exe, timeout=timeout, onLine=splitter.feedLine)
+
+            # the auto added commands come first, don't consider them part of this
+            autoAddedCount = 2 if gotoExceptionContext else 1
+            return self._formatCommandOutputs(sections[autoAddedCount:])
+
+        return self._runCdb(["-c", cmdsWithSemiColons], debugCommandsList, exe=exe, timeout=timeout)
+
+    def _getSessionArgs(self):
+        args = [self.CDB_DBG_PATH,
                 "-z",
                 self.crashDump,
                 "-y",
-                self.symbols,
-                "-logo",
-                tempFileName,
-                "-c",
-                cmdsWithSemiColons]
+                self.symbols]
 
         if self.executable:
             args.extend(["-i", self.executable])
+        return args
+
+    def openSession(self):
+        ''' opens a cdb session on our crash dump. Commands can then be run (one after another) with session.runCommand() '''
+        return DebuggerSession(self._getSessionArgs(), setupCommands=self.SESSION_SETUP_COMMANDS)
+
+    def _formatCommandOutputs(self, commandsAndOutputs):
+        ''' formats (command, output) pairs like _callWinDbg() gives back output: each output between its Start/End Calling markers '''
+        return '\n'.join('== Start Calling %s ==\n%s\n== End Calling %s ==' % (command, output, command) for command, output in commandsAndOutputs)
+
+    def _runCdb(self, commandArgs, debugCommandsList, exe=None, timeout=60, commandsText=None, onLine=None):
+        ''' runs the debugger on our crash dump with the given args, reading its output from a pipe as it comes (nothing goes through disk).
+        If given, commandsText is written to its stdin for it to run. It can be a string, or an iterable of strings (written as each is
+        given, so more commands can be sent based on the output so far). If onLine is given, it is called with each line of output
+        (and '' is given back), otherwise the whole output is given back. debugCommandsList is just used for error messages. '''
+        args = [exe or self.CDB_DBG_PATH,
+                "-z",
+                self.crashDump,
+                "-y",
+                self.symbols] + commandArgs
+
+        if self.executable:
+            args.extend(["-i", self.executable])
+
+        logger.debug("About to call: %s" % args)
+        startTime = time.time()
+
+        # in its own session (on POSIX) so the whole process tree can be killed on a timeout
+        process = subprocess.Popen(args, stdin=subprocess.DEVNULL if commandsText is None else subprocess.PIPE,
+                                   stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True, errors='replace',
+                                   start_new_session=True)
+
+        # the output is read until the debugger closes it, so a timer kills the debugger if it takes too long
+        timedOut = threading.Event()
+        def kill():
+            timedOut.set()
+            killProcessTree(process)
+        timer = threading.Timer(min(timeout, threading.TIMEOUT_MAX), kill)
+        timer.daemon = True
+        timer.start()
+
+        lines = []
+        lastLines = collections.deque(maxlen=ERROR_OUTPUT_LINES)
         try:
-            logger.debug("About to call: %s" % args)
-            process = subprocess.Popen(args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-
-            deathTime = time.time() + timeout
-            process.poll()
-            while deathTime > time.time():
-                if process.returncode is None:
-                    time.sleep(.01)
-                    process.poll()
+            if commandsText is not None:
+                threading.Thread(target=self._writeCommands, args=(process, commandsText), name='CdbCommandWriter', daemon=True).start()
+
+            for line in process.stdout:
+                line = line.rstrip('\n')
+                lastLines.append(line)
+                if onLine is None:
+                    lines.append(line)
                 else:
-                    break
-            else:
-                process.terminate()
-                raise RuntimeError("Timed out doing this command list: %s" % debugCommandsList)
+                    onLine(line)
 
-            fullOutput = ''
-            if os.path.exists(tempFile.name):
-                with open(tempFile.name, 'r') as f:
-                    fullOutput = f.read()
+            process.wait()
+        except:
+            killProcessTree(process)
+            raise
+        finally:
+            timer.cancel()
+            process.stdout.close()
+
+        wallTime = time.time() - startTime
+        if timedOut.is_set():
+            self.CALL_STATISTICS.record(calls=1, seconds=wallTime, timeouts=1)
+            raise RuntimeError("Timed out doing this command list: %s" % debugCommandsList)
+
+        logger.debug("cdb took %.3f seconds" % wallTime)
+        self.CALL_STATISTICS.record(calls=1, seconds=wallTime, failures=int(process.returncode != 0))
+        if process.returncode != 0:
+            logger.error("cdb error! The end of its output:\n%s" % '\n'.join(lastLines))
+            raise subprocess.CalledProcessError(process.returncode, args)
+
+        fullOutput = '\n'.join(lines)
+        if onLine is None:
+            logger.debug("Output:\n%s" % fullOutput)
+        return fullOutput
 
-            if process.returncode != 0:
-                logger.error("cdb error!\n%s" % fullOutput)
-                raise subprocess.CalledProcessError(process.returncode, args)
+    @staticmethod
+    def _writeCommands(process, commandsText):
+        ''' writes the given commands (a string or an iterable of strings) to the debugger's stdin, then closes it.
+        This is done on its own thread so neither side can block on a full pipe while the other waits. '''
+        if isinstance(commandsText, str):
+            commandsText = [commandsText]
 
-            logger.debug("Output:\n%s" % fullOutput)
+        try:
+            for chunk in commandsText:
+                process.stdin.write(chunk)
+                process.stdin.flush()
+            process.stdin.close()
+        except OSError:
+            # it went away (or was killed), its return code says why
+            pass
+
+    def _callWinDbgBatch(self, debugCommandGroups, timeout=BATCH_TIMEOUT, onGroupOutput=None, getFollowUpGroups=None):
+        ''' runs every group of commands (each group is a list of commands) in a single cdb run, writing the commands to its stdin.
+        Each command is wrapped in Start/End Calling markers, which are used to split up the output as it streams in.
+        Gives back a list with the output for each group, formatted like _callWinDbg() would give it back for that group alone.
+        If given, onGroupOutput(index, output) is called as each group's output completes (while cdb works on the rest)
+        and what it gives back is put in the list instead of the output.
+        If given, getFollowUpGroups(outputs) is called once every group's output is in. The groups it gives back (like ones that depend on
+        the output so far) are run next in the same cdb run, and their output is added to the list. '''
+        def getCommandsText(groups):
+            ''' gets the text written to cdb's stdin to run the given groups '''
+            debugCommandsList = []
+            for group in groups:
+                for dc in group:
+                    debugCommandsList.extend(['.echo == Start Calling %s ==' % dc, dc, '.echo == End Calling %s ==' % dc])
+            return ''.join(dc + '\n' for dc in debugCommandsList)
+
+        debugCommandGroups = list(debugCommandGroups)
+        initialGroupCount = len(debugCommandGroups)
+        initialCommandsText = '.symopt+0x10\n.ecxr\n' + getCommandsText(debugCommandGroups)
+        followUpCommandsText = queue.Queue()
+        followUpAdded = []
+
+        def getCommandsChunks():
+            ''' yields the text for cdb's stdin. cdb waits on its stdin for the follow up groups while they are figured out. '''
+            yield initialCommandsText
+            if getFollowUpGroups is not None:
+                yield followUpCommandsText.get()
+            yield 'q\n'
+
+        def addFollowUpGroups():
+            ''' called once every (initial) group's output is in, to send the follow up groups to cdb '''
+            if getFollowUpGroups is None or followUpAdded:
+                return
+
+            followUpAdded.append(True)
+            followUpGroups = getFollowUpGroups(list(outputs))
+            debugCommandGroups.extend(followUpGroups)
+            followUpCommandsText.put(getCommandsText(followUpGroups))
+
+        outputs = []
+        groupSections = []
+
+        def finishGroup(output):
+            ''' called once all of the current group's output is in '''
+            del groupSections[:]
+            if onGroupOutput is not None:
+                output = onGroupOutput(len(outputs), output)
+            outputs.append(output)
+
+        def onSection(command, output):
+            ''' called with each command's output, in order '''
+            if len(outputs) == len(debugCommandGroups):
+                return
+
+            group = debugCommandGroups[len(outputs)]
+            groupSections.append((command, output))
+            if len(groupSections) == len(group):
+                if [c for c, o in groupSections] != group:
+                    logger.warning("Did not get output for all of: %s" % group)
+                    finishGroup('')
+                else:
+                    finishGroup(self._formatCommandOutputs(groupSections))
 
-        finally:
-            if os.path.isfile(tempFileName):
-                try:
-                    os.remove(tempFileName)
-                except OSError:
-                    pass
+                if len(outputs) == initialGroupCount:
+                    addFollowUpGroups()
 
-        # used to get rid of output we don't need
-        if getJustCommandOutput and outputHeader and outputFooter:
-            fullOutput = fullOutput.split(cmdsWithSemiColons, 1)[1]
-            newOutput = fullOutput.split(outputHeader, 1)[1]
-            fullOutput = newOutput.split(outputFooter, 1)[0]
+        def finishMissingGroups():
+            ''' gives empty output to groups cdb didn't get to '''
+            while len(outputs) < len(debugCommandGroups):
+                logger.warning("Did not get output for all of: %s" % debugCommandGroups[len(outputs)])
+                finishGroup('')
 
-            fullOutput = outputHeader + '\n' + fullOutput + '\n' + outputFooter
+        splitter = CommandOutputSplitter(onSection)
+        try:
+            self._runCdb([], debugCommandGroups, timeout=timeout, commandsText=getCommandsChunks(), onLine=splitter.feedLine)
+        finally:
+            # don't leave the writer waiting on follow up groups that won't come (like if cdb went away first)
+            followUpCommandsText.put('')
 
-        return fullOutput
+        finishMissingGroups()
+        addFollowUpGroups()
+        finishMissingGroups()
+        return outputs
 
     def _callCommandOnEveryStackFrame(self, cmd):
         return self._callWinDbg(['!for_each_frame %s' % cmd])
@@ -158,31 +357,17 @@ class WinDbg(Debugger):
     def _getRawStackTraceForEachFrame(self, formatCode='p'):
         return self._callCommandOnEveryStackFrame('k' + formatCode)
 
-    def _getLineAndWarningForStackTrace(self, index, trace):
-        warning = False
-        for line in trace.splitlines():
-            if not line.strip():
-                continue
-
-            if 'Stack unwind information not available' in line:
-                warning = True
-                continue
-
-            firstThing = line.split()[0]
-            try:
-                int(firstThing)
-            except ValueError:
-                continue
-
-            if int(firstThing) == index:
-                return line.strip(), warning
-
     def _getVariablesForFrame(self, index):
-        rawOutput = self._callWinDbg([
-            '.frame %d' % index,
+        return self._parseVariables(self._callWinDbg(self._getVariablesForFrameCommands(index)))
+
+    def _getVariablesForFrameCommands(self, index):
+        # cdb reads numbers in hex unless told otherwise, so the frame number is given as decimal (0n)
+        return [
+            '.frame 0n%d' % index,
             'dv /t *',
-        ])
+        ]
 
+    def _parseVariables(self, rawOutput):
         r"""example output
         == Start Calling .frame 0 ==
 
@@ -218,9 +403,11 @@ class WinDbg(Debugger):
         return variables
 
     def _getThreadId(self):
-        rawOutput = self._callWinDbg([
+        return self._parseThreadId(self._callWinDbg([
             '~.',
-        ])
+        ]))
+
+    def _parseThreadId(self, rawOutput):
         r"""example output
         == Start Calling ~. ==
 
@@ -234,47 +421,156 @@ class WinDbg(Debugger):
                 return int(line.split('Id', 1)[1].split('.', 1)[1].split()[0], 16)
 
     def getStackTrace(self):
-        rawOutputClean = self._callWinDbg('kcn')
-        rawOutputExtended = self._callWinDbg('kpn')
+        rawOutputClean = self._callWinDbg(STACK_COMMAND_CLEAN)
+        rawOutputExtended = self._callWinDbg(STACK_COMMAND_EXTENDED)
+        return self._parseStackTrace(rawOutputClean, rawOutputExtended, self._getVariablesForFrame, self._getThreadId)
 
-        frames = []
+    def _parseStackTrace(self, rawOutputClean, rawOutputExtended, getVariablesForFrame, getThreadId):
+        ''' makes a Stack from kcn/kpn output. getVariablesForFrame(index) and getThreadId() are called to fill in the rest '''
+        # each output is walked once, then frames are looked up by number
+        frames = self._parseFrames(parseStackOutput(rawOutputClean), parseStackOutput(rawOutputExtended), getVariablesForFrame)
 
-        for idx in range(MAX_STACK_DEPTH):
-            x = self._getLineAndWarningForStackTrace(idx, rawOutputClean)
-            if not x:
-                break
+        threadId = getThreadId()
+        return Stack(frames, threadId)
 
-            stackLine, warning = x
-            moduleAndFunction = stackLine.split()[1]
-            if '!' in moduleAndFunction:
-                module, function = moduleAndFunction.split('!')
-            else:
-                module = moduleAndFunction
-                function = None
+    def _parseFrames(self, cleanRecords, extendedRecords, getVariablesForFrame):
+        ''' makes a list of Frames from the (frame number -> windbg_parser.StackFrameRecord) dicts for kcn/kpn output.
+        Every frame is kept (in order), however deep the stack is. '''
+        frames = []
+        for idx, record in cleanRecords.items():
+            module, function = getModuleAndFunction(record.text)
+            warning = record.warning
 
-            x = self._getLineAndWarningForStackTrace(idx, rawOutputExtended)
-            extendedStackLine, warning = x
-            match = re.findall(REGEX_FILE_AND_LINE_FROM_FRAME, extendedStackLine)
-            if match:
-                sourceFile, line = match[0]
-            else:
-                sourceFile = None
-                line = None
+            sourceFile = None
+            line = None
+            extendedRecord = extendedRecords.get(idx)
+            if extendedRecord is not None:
+                sourceFile, line = getSourceFileAndLine(extendedRecord.text)
+                warning = extendedRecord.warning
 
-            variables = self._getVariablesForFrame(idx)
+            variables = getVariablesForFrame(idx)
 
             f = Frame(module, idx, function, sourceFile, line, variables=variables, warningAboutCorrectness=warning)
 
             frames.append(f)
 
-        threadId = self._getThreadId()
-        return Stack(frames, threadId)
+        return frames
+
+    def getAllStackTraces(self):
+        ''' gets the Stack from getStackTrace(), then one for every other thread (from ~*kcn/~*kpn) '''
+        stack = self.getStackTrace()
+        return [stack] + self._parseOtherThreadsStackTraces(self._callWinDbg(ALL_THREADS_STACK_COMMAND_CLEAN), self._callWinDbg(ALL_THREADS_STACK_COMMAND_EXTENDED),
+                                                              stack.threadId)
+
+    def _parseOtherThreadsStackTraces(self, rawOutputClean, rawOutputExtended, exceptionThreadId):
+        ''' makes a Stack for each thread from ~*kcn/~*kpn output, other than the one with the given thread id
+        (that one already has a Stack from getStackTrace(), in the exception's context). Other threads' frames don't have variables. '''
+        extendedByThreadId = dict(splitThreadsOutput(rawOutputExtended))
+
+        stacks = []
+        for threadId, threadOutputClean in splitThreadsOutput(rawOutputClean):
+            if threadId == exceptionThreadId:
+                continue
+
+            frames = self._parseFrames(parseStackOutput(threadOutputClean), parseStackOutput(extendedByThreadId.get(threadId, '')), lambda idx: [])
+            stacks.append(Stack(frames, threadId))
+
+        return stacks
 
     def getRawAnalysis(self):
-        return self._callWinDbg([
+        return self._callWinDbg(self._getRawAnalysisCommands())
+
+    def _getRawAnalysisCommands(self):
+        return [
             '!analyze -v',
             '.lastevent',
-        ])
+        ]
+
+    def _getLoadedSymbolFilesCommands(self):
+        return [
+            'lm',
+        ]
+
+    def _parseLoadedSymbolFiles(self, rawOutput):
+        r""" gets a list of the symbol files the debugger loaded from lm output. example output
+        == Start Calling lm ==
+        start    end        module name
+        00880000 008a0000   TheCrasher C (private pdb symbols)  c:\symbols\TheCrasher.pdb\D2A5A8C3A1F44D4E9B1C6A0E0A6F1E2B1\TheCrasher.pdb
+        76f50000 77040000   KERNEL32   (deferred)
+        == End Calling lm ==
+        """
+        loadedSymbolFiles = []
+        for line in rawOutput.splitlines():
+            match = REGEX_LOADED_SYMBOL_FILE.search(line)
+            if match:
+                loadedSymbolFiles.append(match.group(1))
+
+        return loadedSymbolFiles
+
+    def getAnalysis(self):
+        ''' gets an Analysis object. If BATCH_ANALYSIS is set, all of it comes from a single cdb run (see _getBatchAnalysis()).
+        After, the symbol files the debugger loaded are marked as used in DOWNSTREAM_SYMBOL_CACHE (and it is evicted from if needed). '''
+        startTime = time.time()
+        try:
+            if self.BATCH_ANALYSIS:
+                analysis, loadedSymbolFiles = self._getBatchAnalysis()
+            else:
+                analysis = Debugger.getAnalysis(self)
+                loadedSymbolFiles = self._parseLoadedSymbolFiles(self._callWinDbg(self._getLoadedSymbolFilesCommands()))
+
+            self.DOWNSTREAM_SYMBOL_CACHE.recordUse(loadedSymbolFiles, since=startTime)
+        finally:
+            self.DOWNSTREAM_SYMBOL_CACHE.evictIfNeeded()
+
+        return analysis
+
+    def _getBatchAnalysis(self):
+        ''' gets a tuple of (Analysis object, symbol files loaded) from one cdb run: the stack, every frame's variables, the thread id and
+        the raw analysis (and every other thread's stack if allThreads is set).
+        The stack (kcn) is gotten first, then the rest is sent to the same cdb run, so variables are only asked for on frames that exist. '''
+        frameIndexes = []
+
+        def getFollowUpGroups(outputs):
+            ''' called with the stack's output, gives back the rest of the command groups '''
+            frameIndexes.extend(parseStackOutput(outputs[0]))
+            debugCommandGroups = [
+                [STACK_COMMAND_EXTENDED],
+                ['~.'],
+            ] + [self._getVariablesForFrameCommands(idx) for idx in frameIndexes]
+
+            if self.allThreads:
+                debugCommandGroups += [
+                    [ALL_THREADS_STACK_COMMAND_CLEAN],
+                    [ALL_THREADS_STACK_COMMAND_EXTENDED],
+                ]
+
+            # the raw analysis goes after the others since !analyze can change the context they look at. lm goes after it to see everything loaded.
+            debugCommandGroups.append(self._getRawAnalysisCommands())
+            debugCommandGroups.append(self._getLoadedSymbolFilesCommands())
+            return debugCommandGroups
+
+        def parseVariables(index, output):
+            ''' each frame's variables are parsed as its output comes in (so the output isn't kept around) '''
+            if 3 <= index < 3 + len(frameIndexes):
+                return self._parseVariables(output)
+            return output
+
+        outputs = self._callWinDbgBatch([[STACK_COMMAND_CLEAN]], onGroupOutput=parseVariables, getFollowUpGroups=getFollowUpGroups)
+
+        rawOutputClean, rawOutputExtended, rawOutputThreadId = outputs[:3]
+        variablesForFrames = dict(zip(frameIndexes, outputs[3:3 + len(frameIndexes)]))
+        rawAnalysis = outputs[-2]
+        loadedSymbolFiles = self._parseLoadedSymbolFiles(outputs[-1])
+
+        stack = self._parseStackTrace(rawOutputClean, rawOutputExtended,
+                                      lambda idx: variablesForFrames.get(idx, []),
+                                      lambda: self._parseThreadId(rawOutputThreadId))
+        if not self.allThreads:
+            return Analysis(os.path.basename(self.crashDump), stack, rawAnalysis), loadedSymbolFiles
+
+        rawOutputAllClean, rawOutputAllExtended = outputs[3 + len(frameIndexes):-2]
+        stacks = [stack] + self._parseOtherThreadsStackTraces(rawOutputAllClean, rawOutputAllExtended, stack.threadId)
+        return Analysis(os.path.basename(self.crashDump), stacks, rawAnalysis), loadedSymbolFiles
 
 if __name__ == '__main__':
     w = WinDbg(r"C:\Users\csm10495\Desktop\TheCrasher\TestAll\6e71a81b-9d54-4966-be65-bbe7ef2b390a.dmp",
@@ -0,0 +1,66 @@
+''' this file is home to a single pass parser for WinDbg (cdb) stack output, like from kcn or kpn (or ~*kcn for every thread) '''
+
+import collections
+import re
+
+# a frame's line starts with its frame number (in hex), like: 0a 010ffc14 00889ad9 TheCrasher!main+0x1b [c:\source.cpp @ 43]
+REGEX_FRAME_LINE = re.compile(r'^\s*([0-9a-fA-F]{2,})\s+\S')
+REGEX_FILE_AND_LINE_FROM_FRAME = re.compile(r'\[(.*)@\s*(\d+)')
+
+# a thread's header line (from ~ or before each thread's stack from ~*k), like: .  0  Id: 97cc.e00 Suspend: 0 Teb: 00f81000 Unfrozen
+REGEX_THREAD_HEADER = re.compile(r'^\s*[.#]?\s*(\d+)\s+Id:\s*([0-9a-fA-F]+)\.([0-9a-fA-F]+)\s')
+
+# the debugger says this when the frames after it may be wrong
+UNWIND_WARNING = 'Stack unwind information not available'
+
+# a frame's line from the stack output. warning is True if an unwind warning came before it.
+StackFrameRecord = collections.namedtuple('StackFrameRecord', ['index', 'text', 'warning'])
+
+def parseStackOutput(rawOutput):
+    ''' walks the given stack output (like from kcn or kpn) once, giving back a dict of frame number -> StackFrameRecord
+    (in the order they came). If a frame number shows up more than once, the first one is kept. '''
+    records = {}
+    warning = False
+    for line in rawOutput.splitlines():
+        if UNWIND_WARNING in line:
+            warning = True
+            continue
+
+        match = REGEX_FRAME_LINE.match(line)
+        if match:
+            index = int(match.group(1), 16)
+            if index not in records:
+                records[index] = StackFrameRecord(index, line.strip(), warning)
+
+    return records
+
+def splitThreadsOutput(rawOutput):
+    ''' walks the given output for every thread (like from ~*kcn) once, giving back a list of (thread id, that thread's output)
+    in the order they came. The thread id is the system's id for it (not the debugger's thread number). '''
+    threads = []
+    lines = None
+    for line in rawOutput.splitlines():
+        match = REGEX_THREAD_HEADER.match(line)
+        if match:
+            lines = []
+            threads.append((int(match.group(3), 16), lines))
+        elif lines is not None:
+            lines.append(line)
+
+    return [(threadId, '\n'.join(lines)) for threadId, lines in threads]
+
+def getModuleAndFunction(text):
+    ''' gets a tuple of (module, function) from a frame's line. function is None if it isn't known (no symbols) '''
+    moduleAndFunction = text.split(None, 2)[1]
+    if '!' in moduleAndFunction:
+        return tuple(moduleAndFunction.split('!', 1))
+
+    return moduleAndFunction, None
+
+def getSourceFileAndLine(text):
+    ''' gets a tuple of (source file, line) from a frame's line (from kpn). Both are None if it doesn't have them '''
+    match = REGEX_FILE_AND_LINE_FROM_FRAME.search(text)
+    if match:
+        return match.groups()
+
+    return None, None
@@ -0,0 +1,86 @@
+''' this contains tests for the WinDbg stack output parser '''
+import timeit
+
+from test_helpers import makeExampleStackOutput
+from windbg_parser import getModuleAndFunction, getSourceFileAndLine, parseStackOutput, splitThreadsOutput
+
+EXAMPLE_KPN_OUTPUT = r"""
+== Start Calling kpn ==
+
+*** Stack trace for last set context - .thread/.cxr resets it
+ # ChildEBP RetAddr
+00 010ffc14 00889ad9 TheCrasher!main(int argc = 0n1, char ** argv = 0x032053f0)+0x1b [c:\source.cpp @ 43]
+WARNING: Stack unwind information not available. Following frames may be wrong.
+09 010ffc5c 754b8674 TheCrasher!something+0xf9
+0a 010ffc70 77225e17 kernel32!BaseThreadInitThunk+0x24
+0a 010ffc70 77225e17 ntdll!Duplicate+0x24
+100 010ffcc8 00000000 0x12345
+
+== End Calling kpn ==
+"""
+
+def test_parse_stack_output():
+    ''' ensures frame numbers are read as hex and unwind warnings carry on to the frames after them '''
+    records = parseStackOutput(EXAMPLE_KPN_OUTPUT)
+    assert list(records) == [0, 9, 10, 256]
+
+    assert records[0].text.startswith('00 010ffc14')
+    assert not records[0].warning
+    assert records[9].warning
+    assert records[256].warning
+
+    # the first of a duplicate frame number is kept
+    assert 'kernel32' in records[10].text
+
+def test_get_module_function_source_file_and_line():
+    ''' ensures the parts of a frame's line can be gotten '''
+    records = parseStackOutput(EXAMPLE_KPN_OUTPUT)
+    assert getModuleAndFunction('00 TheCrasher!main') == ('TheCrasher', 'main')
+    assert getModuleAndFunction('100 0x12345') == ('0x12345', None)
+    assert getSourceFileAndLine(records[0].text) == ('c:\\source.cpp ', '43')
+    assert getSourceFileAndLine(records[9].text) == (None, None)
+
+def test_split_threads_output():
+    ''' ensures output for every thread (like from ~*kcn) is split up by thread '''
+    rawOutput = '\n'.join([
+        '== Start Calling ~*kcn ==',
+        '',
+        '.  0  Id: 97cc.e00 Suspend: 0 Teb: 00f81000 Unfrozen',
+        ' # Call Site',
+        '00 TheCrasher!main',
+        '',
+        '   1  Id: 97cc.1a2b Suspend: 1 Teb: 00f84000 Unfrozen',
+        ' # Call Site',
+        '00 ntdll!NtWaitForWorkViaWorkerFactory',
+        '01 ntdll!TppWorkerThread',
+        '#  2  Id: 97cc.3c Suspend: 1 Teb: 00f87000 Unfrozen',
+        '00 ntdll!NtDelayExecution',
+        '== End Calling ~*kcn ==',
+    ])
+    threads = splitThreadsOutput(rawOutput)
+    assert [threadId for threadId, output in threads] == [0xe00, 0x1a2b, 0x3c]
+    assert list(parseStackOutput(threads[1][1])) == [0, 1]
+    assert getModuleAndFunction(parseStackOutput(threads[2][1])[0].text) == ('ntdll', 'NtDelayExecution')
+
+def test_parse_deep_stack():
+    ''' ensures a deep (recursion) stack is fully parsed, in linear time '''
+    records = parseStackOutput(makeExampleStackOutput(5000))
+    assert list(records) == list(range(5000))
+    assert not records[2499].warning
+    assert records[2500].warning
+    assert getSourceFileAndLine(records[4999].text) == ('c:\\source.cpp ', '5000')
+
+    # 10 times the frames shouldn't take anywhere near 100 times as long
+    smallOutput = makeExampleStackOutput(500)
+    smallSeconds = min(timeit.repeat(lambda: parseStackOutput(smallOutput), number=5, repeat=3))
+    bigOutput = makeExampleStackOutput(5000)
+    bigSeconds = min(timeit.repeat(lambda: parseStackOutput(bigOutput), number=5, repeat=3))
+    assert bigSeconds < smallSeconds * 40
+
+if __name__ == '__main__':
+    # micro-benchmark: the time per frame should stay about the same as the stack gets deeper
+    for frameCount in (10, 100, 1000, 10000):
+        rawOutput = makeExampleStackOutput(frameCount)
+        number = max(1, 10000 // frameCount)
+        seconds = min(timeit.repeat(lambda: parseStackOutput(rawOutput), number=number, repeat=5)) / number
+        print("%6d frames: %9.3f ms (%.2f us per frame)" % (frameCount, seconds * 1000, seconds * 1000000 / frameCount))
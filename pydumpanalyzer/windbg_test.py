@@ -1,13 +1,34 @@
 ''' this contains tests for our windbg debugger '''
+import json
+import os
+import subprocess
+import sys
+import time
 import unittest
+import unittest.mock
 
-from windbg import WinDbg
+from debugger import Debugger
+from test_helpers import FAKE_CDB_ARGS, FAKE_CDB_OUTPUTS_VARIABLE, makeExampleStackOutput
+from windbg import (ALL_THREADS_STACK_COMMAND_CLEAN, ALL_THREADS_STACK_COMMAND_EXTENDED, STACK_COMMAND_CLEAN, STACK_COMMAND_EXTENDED,
+                    WinDbg)
 from variable import Variable
 
 class _TestWindbg(WinDbg):
     ''' This is basically windbg while removing the requirement for CDB to be installed '''
     CDB_DBG_PATH = __file__
 
+def _fakeCallWinDbgBatch(getOutput):
+    ''' makes a stand-in for WinDbg._callWinDbgBatch() that gives back getOutput(group) as each group's output (passed through
+    onGroupOutput, with the follow up groups run after, like the real one) '''
+    def callWinDbgBatch(debugCommandGroups, onGroupOutput=None, getFollowUpGroups=None):
+        outputs = [onGroupOutput(index, getOutput(group)) for index, group in enumerate(debugCommandGroups)]
+        if getFollowUpGroups is not None:
+            for group in getFollowUpGroups(list(outputs)):
+                outputs.append(onGroupOutput(len(outputs), getOutput(group)))
+        return outputs
+
+    return callWinDbgBatch
+
 class TestWindbg(unittest.TestCase):
     ''' home to tests for WinDbg '''
     def setUp(self):
@@ -83,7 +104,7 @@ class TestWindbg(unittest.TestCase):
 
         def callWinDbg(cmd):
             ''' helper mock'd method for _callWinDbg '''
-            if cmd == 'kcn':
+            if cmd == STACK_COMMAND_CLEAN:
                 return EXAMPLE_KCN_OUTPUT
             return EXAMPLE_KPN_OUTPUT
 
@@ -117,4 +138,265 @@ class TestWindbg(unittest.TestCase):
         assert s.frames[4].sourceFile == None
         assert s.frames[4].line == None
         assert len(s.frames[4].variables) == 1
-        assert s.frames[4].variables[0] == A_VARIABLE
\ No newline at end of file
+        assert s.frames[4].variables[0] == A_VARIABLE
+
+    def test_get_stack_trace_with_hex_frame_numbers(self):
+        ''' ensures frames past 9 (numbered in hex by the debugger, like 0a) are in the stack '''
+        rawOutput = '\n'.join('%02x TheCrasher!recurse+0x1b [c:\\source.cpp @ %d]' % (idx, idx) for idx in range(20))
+        s = self.windbg._parseStackTrace(rawOutput, rawOutput, lambda idx: [], lambda: 1)
+
+        assert len(s.frames) == 20
+        assert s.frames[10].index == 10
+        assert s.frames[10].line == 10
+        assert s.frames[19].function == 'recurse+0x1b'
+
+    def test_get_stack_trace_deep_recursion(self):
+        ''' ensures every frame of a deep (recursion) stack is in the stack, not just the first hundred or so '''
+        rawOutput = makeExampleStackOutput(3000)
+        s = self.windbg._parseStackTrace(rawOutput, rawOutput, lambda idx: [], lambda: 1)
+
+        assert [f.index for f in s.frames] == list(range(3000))
+        assert s.frames[2999].line == 3000
+        assert not s.frames[1499].warningAboutCorrectness
+        assert s.frames[1500].warningAboutCorrectness
+
+    def test_batch_analysis(self):
+        ''' ensures getAnalysis() runs cdb once (with the commands on its stdin) and splits up its output by command as it comes.
+        Uses the fake cdb from test_helpers, which (like the real one) puts its prompt in front of each command's output. '''
+        CANNED_OUTPUT = {
+            STACK_COMMAND_CLEAN : ' # Call Site\n00 TheCrasher!main\n01 kernel32!BaseThreadInitThunk',
+            STACK_COMMAND_EXTENDED : (' # ChildEBP RetAddr\n'
+                     '00 010ffc14 00889ad9 TheCrasher!main(int argc = 0n1, char ** argv = 0x032053f0)+0x1b [c:\\source.cpp @ 43]\n'
+                     '01 010ffc70 77225e17 kernel32!BaseThreadInitThunk+0x24'),
+            '~.' : '.  0  Id: 97cc.e00 Suspend: 0 Teb: 00f81000 Unfrozen',
+            '.frame 0n0' : '00 010ffc14 00889ad9 TheCrasher!main+0x1b [c:\\source.cpp @ 43]',
+            'dv /t *' : 'int argc = 0n1',
+            '!analyze -v' : 'FAULTING_IP: TheCrasher!main+1b',
+        }
+
+        realPopen = subprocess.Popen
+        def popen(args, **kwargs):
+            ''' runs the fake cdb (giving the canned output) instead of cdb '''
+            assert '-c' not in args
+            env = dict(os.environ)
+            env[FAKE_CDB_OUTPUTS_VARIABLE] = json.dumps(CANNED_OUTPUT)
+            return realPopen(FAKE_CDB_ARGS + args[1:], env=env, **kwargs)
+
+        with unittest.mock.patch('windbg.subprocess.Popen', side_effect=popen) as popenMock:
+            with unittest.mock.patch.object(self.windbg, '_parseVariables', wraps=self.windbg._parseVariables) as parseVariables:
+                analysis = self.windbg.getAnalysis()
+            popenMock.assert_called_once()
+
+        # variables were only asked for on the stack's frames
+        assert parseVariables.call_count == 2
+
+        assert analysis.dumpFileName == os.path.basename(__file__)
+        stack = analysis.stacks[0]
+        assert stack.threadId == 0xe00
+        assert len(stack.frames) == 2
+        assert stack.frames[0].module == 'TheCrasher'
+        assert stack.frames[0].function == 'main'
+        assert stack.frames[0].sourceFile == 'c:\\source.cpp'
+        assert stack.frames[0].line == 43
+        assert [(v.type, v.name, v.value) for v in stack.frames[0].variables] == [('int', 'argc', 1)]
+        assert stack.frames[1].module == 'kernel32'
+        assert stack.frames[1].sourceFile is None
+        assert 'FAULTING_IP: TheCrasher!main+1b' in analysis.rawAnalysisText
+        assert '== End Calling .lastevent ==' in analysis.rawAnalysisText
+
+    def test_batch_analysis_frame_numbers(self):
+        ''' ensures each frame's variables are asked for with the right frame number, past 9 too (cdb reads numbers in hex by default) '''
+        rawOutput = '\n'.join('%02x TheCrasher!recurse+0x1b [c:\\source.cpp @ %d]' % (idx, idx) for idx in range(20))
+        sentGroups = []
+
+        def getOutput(group):
+            ''' gives the stack for the stack commands, and the frame number for the variables '''
+            sentGroups.append(group)
+            if group[0] in (STACK_COMMAND_CLEAN, STACK_COMMAND_EXTENDED):
+                return rawOutput
+            return group[0]
+
+        callWinDbgBatch = _fakeCallWinDbgBatch(getOutput)
+        with unittest.mock.patch.object(self.windbg, '_callWinDbgBatch', side_effect=callWinDbgBatch):
+            with unittest.mock.patch.object(self.windbg, '_parseVariables', side_effect=lambda output: output):
+                analysis = self.windbg.getAnalysis()
+
+        frameCommands = [group[0] for group in sentGroups if group[0].startswith('.frame')]
+        assert frameCommands == ['.frame 0n%d' % idx for idx in range(20)]
+        assert [f.variables for f in analysis.stacks[0].frames] == frameCommands
+
+    def test_batch_analysis_all_threads(self):
+        ''' ensures every thread's stack is gotten (in the same cdb run) if allThreads is set '''
+        self.windbg.allThreads = True
+        outputs = {
+            STACK_COMMAND_CLEAN : '00 TheCrasher!main',
+            STACK_COMMAND_EXTENDED : '00 010ffc14 00889ad9 TheCrasher!main+0x1b [c:\\source.cpp @ 43]',
+            '~.' : '.  0  Id: 97cc.e00 Suspend: 0 Teb: 00f81000 Unfrozen',
+            ALL_THREADS_STACK_COMMAND_CLEAN : ('.  0  Id: 97cc.e00 Suspend: 0 Teb: 00f81000 Unfrozen\n00 ntdll!KiUserExceptionDispatcher\n'
+                       '   1  Id: 97cc.f00 Suspend: 1 Teb: 00f84000 Unfrozen\n00 ntdll!NtWaitForSingleObject\n01 TheCrasher!worker'),
+            ALL_THREADS_STACK_COMMAND_EXTENDED : ('.  0  Id: 97cc.e00 Suspend: 0 Teb: 00f81000 Unfrozen\n00 00000000 00000000 ntdll!KiUserExceptionDispatcher\n'
+                       '   1  Id: 97cc.f00 Suspend: 1 Teb: 00f84000 Unfrozen\n00 00000000 00000000 ntdll!NtWaitForSingleObject+0xc\n'
+                       '01 00000000 00000000 TheCrasher!worker+0x10 [c:\\worker.cpp @ 12]'),
+            '!analyze -v' : 'FAULTING_IP: TheCrasher!main+1b',
+        }
+
+        callWinDbgBatch = _fakeCallWinDbgBatch(lambda group: outputs.get(group[0], ''))
+        with unittest.mock.patch.object(self.windbg, '_callWinDbgBatch', side_effect=callWinDbgBatch) as callWinDbgBatchMock:
+            analysis = self.windbg.getAnalysis()
+            callWinDbgBatchMock.assert_called_once()
+
+        # the exception thread's stack (in its context) first, then the others
+        assert [s.threadId for s in analysis.stacks] == [0xe00, 0xf00]
+        assert analysis.stacks[0].frames[0].function == 'main'
+        other = analysis.stacks[1]
+        assert [(f.module, f.function) for f in other.frames] == [('ntdll', 'NtWaitForSingleObject'), ('TheCrasher', 'worker')]
+        assert other.frames[1].sourceFile == 'c:\\worker.cpp'
+        assert other.frames[1].line == 12
+        assert other.frames[1].variables == []
+        assert 'FAULTING_IP' in analysis.rawAnalysisText
+
+        # a command at a time gets the same
+        with unittest.mock.patch.object(self.windbg, '_callWinDbg', side_effect=lambda cmd: outputs.get(cmd, '')):
+            with unittest.mock.patch.object(self.windbg, 'getStackTrace', return_value=analysis.stacks[0]):
+                stacks = self.windbg.getAllStackTraces()
+        assert [s.threadId for s in stacks] == [0xe00, 0xf00]
+
+    def test_batch_analysis_can_be_turned_off(self):
+        ''' ensures getAnalysis() goes a command at a time if BATCH_ANALYSIS is False '''
+        self.windbg.BATCH_ANALYSIS = False
+        with unittest.mock.patch.object(self.windbg, '_callWinDbgBatch') as callWinDbgBatch:
+            with unittest.mock.patch.object(self.windbg, 'getStackTrace') as getStackTrace:
+                with unittest.mock.patch.object(self.windbg, 'getRawAnalysis') as getRawAnalysis:
+                    with unittest.mock.patch.object(self.windbg, '_callWinDbg', return_value=''):
+                        getRawAnalysis.return_value = 'raw'
+                        assert self.windbg.getAnalysis().rawAnalysisText == 'raw'
+                        getStackTrace.assert_called_once()
+            callWinDbgBatch.assert_not_called()
+
+    def test_parse_loaded_symbol_files(self):
+        ''' ensures the symbol files the debugger loaded are gotten from lm output '''
+        EXAMPLE_OUTPUT = r"""
+        == Start Calling lm ==
+        start    end        module name
+        00880000 008a0000   TheCrasher C (private pdb symbols)  c:\symbols\TheCrasher.pdb\D2A5A8C3A1F44D4E9B1C6A0E0A6F1E2B1\TheCrasher.pdb
+        76f50000 77040000   KERNEL32   (deferred)
+        77060000 771f0000   ntdll      (pdb symbols)          c:\symbols\wntdll.pdb\C3B1A2D3E4F5061728394A5B6C7D8E9F1\wntdll.pdb
+        == End Calling lm ==
+        """
+        assert self.windbg._parseLoadedSymbolFiles(EXAMPLE_OUTPUT) == [
+            'c:\\symbols\\TheCrasher.pdb\\D2A5A8C3A1F44D4E9B1C6A0E0A6F1E2B1\\TheCrasher.pdb',
+            'c:\\symbols\\wntdll.pdb\\C3B1A2D3E4F5061728394A5B6C7D8E9F1\\wntdll.pdb',
+        ]
+
+    def test_analysis_records_symbol_cache_use(self):
+        ''' ensures the symbol files loaded during an analysis are marked as used in the downstream symbol cache (batch or not) '''
+        LM_OUTPUT = '00880000 008a0000   TheCrasher C (private pdb symbols)  c:\\symbols\\TheCrasher.pdb\\ABC1\\TheCrasher.pdb'
+
+        # gives back lm output for lm, and nothing for everything else
+        callWinDbgBatch = _fakeCallWinDbgBatch(lambda group: LM_OUTPUT if group == ['lm'] else '')
+
+        for batch in (True, False):
+            self.windbg.BATCH_ANALYSIS = batch
+            with unittest.mock.patch.object(self.windbg, 'DOWNSTREAM_SYMBOL_CACHE') as cache:
+                with unittest.mock.patch.object(self.windbg, '_callWinDbgBatch', side_effect=callWinDbgBatch):
+                    with unittest.mock.patch.object(self.windbg, '_callWinDbg', return_value=LM_OUTPUT):
+                        startTime = time.time()
+                        self.windbg.getAnalysis()
+
+                cache.recordUse.assert_called_once()
+                assert cache.recordUse.call_args[0][0] == ['c:\\symbols\\TheCrasher.pdb\\ABC1\\TheCrasher.pdb']
+                assert cache.recordUse.call_args[1]['since'] >= startTime
+                cache.evictIfNeeded.assert_called_once()
+
+        # eviction still happens if the analysis fails
+        with unittest.mock.patch.object(self.windbg, 'DOWNSTREAM_SYMBOL_CACHE') as cache:
+            with unittest.mock.patch.object(self.windbg, '_callWinDbg', side_effect=RuntimeError):
+                with self.assertRaises(RuntimeError):
+                    self.windbg.getAnalysis()
+            cache.recordUse.assert_not_called()
+            cache.evictIfNeeded.assert_called_once()
+
+    def test_call_windbg_batch_streams_groups(self):
+        ''' ensures each group's output is handed off as soon as it is in, and missing output gives back empty output '''
+        seen = []
+        def runCdb(commandArgs, debugCommandsList, exe=None, timeout=60, commandsText=None, onLine=None):
+            ''' gives the output for the first group, then checks it was already handed off (cdb dies before the second) '''
+            for line in ['junk', '== Start Calling kcn ==', '00 TheCrasher!main', '== End Calling kcn ==']:
+                onLine(line)
+            assert seen == [(0, '== Start Calling kcn ==\n00 TheCrasher!main\n== End Calling kcn ==')]
+            return ''
+
+        def onGroupOutput(index, output):
+            seen.append((index, output))
+            return index
+
+        with unittest.mock.patch.object(self.windbg, '_runCdb', side_effect=runCdb):
+            assert self.windbg._callWinDbgBatch([['kcn'], ['kpn']], onGroupOutput=onGroupOutput) == [0, 1]
+        assert seen[1] == (1, '')
+
+    def test_call_windbg_batch_follow_up_groups(self):
+        ''' ensures follow up groups are figured out from the output so far, then sent to the same cdb run '''
+        def runCdb(commandArgs, debugCommandsList, exe=None, timeout=60, commandsText=None, onLine=None):
+            ''' acts like cdb: each .echo's text, then 'output of' each other command, for every command as it is read '''
+            for chunk in commandsText:
+                for command in chunk.splitlines():
+                    onLine(command.split('.echo ', 1)[1] if command.startswith('.echo ') else 'output of %s' % command)
+            return ''
+
+        getFollowUpGroups = unittest.mock.Mock(side_effect=lambda outputs: [['kpn'], ['.frame %d' % len(outputs)]])
+        with unittest.mock.patch.object(self.windbg, '_runCdb', side_effect=runCdb):
+            outputs = self.windbg._callWinDbgBatch([['kcn']], getFollowUpGroups=getFollowUpGroups)
+
+        getFollowUpGroups.assert_called_once_with(['== Start Calling kcn ==\noutput of kcn\n== End Calling kcn =='])
+        assert outputs[1:] == ['== Start Calling kpn ==\noutput of kpn\n== End Calling kpn ==',
+                               '== Start Calling .frame 1 ==\noutput of .frame 1\n== End Calling .frame 1 ==']
+
+        # if cdb goes away first, the follow up groups get empty output
+        with unittest.mock.patch.object(self.windbg, '_runCdb', return_value=''):
+            assert self.windbg._callWinDbgBatch([['kcn']], getFollowUpGroups=lambda outputs: [['kpn']]) == ['', '']
+
+    def test_run_cdb_streams_output(self):
+        ''' ensures cdb's output is read from a pipe (with commands given on stdin) and just the commands' output is kept '''
+        realPopen = subprocess.Popen
+        def popen(args, **kwargs):
+            ''' acts like cdb given -c: echoes the commands after a prompt, then each .echo '''
+            assert '-logo' not in args
+            code = 'import sys; print("banner"); print("0:000> " + sys.argv[1]); [print(c[6:]) for c in sys.argv[1].split(";") if c.startswith(".echo ")]'
+            return realPopen([sys.executable, '-c', code, args[args.index('-c') + 1]], **kwargs)
+
+        with unittest.mock.patch('windbg.subprocess.Popen', side_effect=popen):
+            assert self.windbg._callWinDbg('kcn') == '== Start Calling kcn ==\n\n== End Calling kcn =='
+            assert self.windbg._callWinDbg('kcn', gotoExceptionContext=False, printHeaderFooter=False).startswith('banner\n0:000> ')
+
+        with unittest.mock.patch('windbg.subprocess.Popen', side_effect=lambda args, **kwargs: realPopen([sys.executable, '-c', 'import sys; print(sys.stdin.read().upper())'], **kwargs)):
+            lines = []
+            assert self.windbg._runCdb([], ['kcn'], commandsText='kcn\nq\n', onLine=lines.append) == ''
+            assert lines == ['KCN', 'Q', '']
+
+    def test_run_cdb_timeout_and_statistics(self):
+        ''' ensures a cdb call that takes too long is killed (without waiting it out) and calls are counted '''
+        realPopen = subprocess.Popen
+        def popen(code):
+            ''' gives a Popen that runs the given python code instead of cdb '''
+            return lambda args, **kwargs: realPopen([sys.executable, '-c', code], **kwargs)
+
+        Debugger.CALL_STATISTICS.takeStatistics()
+        with unittest.mock.patch('windbg.subprocess.Popen', side_effect=popen('import time; time.sleep(60)')):
+            startTime = time.time()
+            with self.assertRaises(RuntimeError):
+                self.windbg._runCdb([], ['kcn'], timeout=.5)
+            assert time.time() - startTime < 10
+
+        with unittest.mock.patch('windbg.subprocess.Popen', side_effect=popen('import sys; sys.exit(1)')):
+            with self.assertRaises(subprocess.CalledProcessError):
+                self.windbg._runCdb([], ['kcn'])
+
+        with unittest.mock.patch('windbg.subprocess.Popen', side_effect=popen('pass')):
+            assert self.windbg._runCdb([], ['kcn']) == ''
+
+        statistics = Debugger.CALL_STATISTICS.takeStatistics()
+        assert statistics['DebuggerCalls'] == 3
+        assert statistics['DebuggerCallTimeouts'] == 1
+        assert statistics['DebuggerCallFailures'] == 1
+        assert statistics['DebuggerCallSeconds'] >= .5
+        assert Debugger.CALL_STATISTICS.getStatistics()['DebuggerCalls'] == 0
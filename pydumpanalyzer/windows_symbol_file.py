@@ -0,0 +1,129 @@
+''' this file is home to reading the ids that Windows executables (PE files) and symbols files (PDB files) are kept under in a symbol store.
+Debuggers ask the symbol store for a file by its name and this id (which they get from the crash dump / executable). '''
+
+import struct
+import uuid
+
+from csmlog_setup import getLogger
+
+# PE (exe, dll, sys, ...) headers
+DOS_SIGNATURE = b'MZ'
+PE_SIGNATURE = b'PE\0\0'
+PE_OPTIONAL_HEADER_MAGICS = (0x10b, 0x20b) # PE32, PE32+
+
+# PDB files are MSF (multi-stream format) files. Only MSF 7.0 (what every toolset since VC 7 writes) is supported.
+MSF_MAGIC = b'Microsoft C/C++ MSF 7.00\r\n\x1aDS\0\0\0'
+MSF_NIL_STREAM_SIZE = 0xFFFFFFFF
+PDB_INFO_STREAM = 1 # has the PDB's GUID (and an age)
+PDB_DBI_STREAM = 3  # has the age that matches the one in the executable
+
+logger = getLogger(__file__)
+
+def getPeId(f):
+    ''' gets the symbol store id of the PE file (exe, dll, ...) open (in binary mode) as f: its TimeDateStamp then SizeOfImage, in hex.
+    Returns None if it isn't a PE file. '''
+    f.seek(0)
+    dosHeader = f.read(64)
+    if len(dosHeader) < 64 or dosHeader[:2] != DOS_SIGNATURE:
+        return None
+
+    # the PE signature, then the COFF header (20 bytes), then the optional header
+    f.seek(struct.unpack_from('<I', dosHeader, 0x3c)[0])
+    headers = f.read(24 + 60)
+    if len(headers) < 24 + 60 or headers[:4] != PE_SIGNATURE:
+        return None
+
+    timeDateStamp = struct.unpack_from('<I', headers, 8)[0]
+    magic, = struct.unpack_from('<H', headers, 24)
+    if magic not in PE_OPTIONAL_HEADER_MAGICS:
+        return None
+
+    # SizeOfImage is at the same place in PE32 and PE32+ optional headers
+    sizeOfImage = struct.unpack_from('<I', headers, 24 + 56)[0]
+    return '%08X%x' % (timeDateStamp, sizeOfImage)
+
+def getPdbGuidAndAge(f):
+    ''' gets a tuple of (GUID as a uuid.UUID, age) for the PDB file open (in binary mode) as f. Returns None if it isn't an MSF 7.0 PDB. '''
+    f.seek(0)
+    superBlock = f.read(len(MSF_MAGIC) + 24)
+    if len(superBlock) < len(MSF_MAGIC) + 24 or not superBlock.startswith(MSF_MAGIC):
+        return None
+
+    blockSize, freeBlockMapBlock, blockCount, directorySize, unknown, blockMapBlock = struct.unpack_from('<6I', superBlock, len(MSF_MAGIC))
+    if blockSize == 0 or blockSize % 512:
+        return None
+
+    def readBlocks(blocks, size):
+        ''' reads size bytes from the given blocks (in order) '''
+        data = b''
+        for block in blocks:
+            if block >= blockCount:
+                raise ValueError("Block %d is past the end of the file" % block)
+            f.seek(block * blockSize)
+            data += f.read(min(blockSize, size - len(data)))
+        if len(data) != size:
+            raise ValueError("File is truncated")
+        return data
+
+    def blocksFor(size):
+        ''' number of blocks needed to hold size bytes '''
+        return (size + blockSize - 1) // blockSize
+
+    try:
+        # the block map lists the blocks of the stream directory. The directory lists each stream's size, then each stream's blocks.
+        directoryBlockCount = blocksFor(directorySize)
+        directoryBlocks = struct.unpack('<%dI' % directoryBlockCount, readBlocks([blockMapBlock], directoryBlockCount * 4))
+        directory = readBlocks(directoryBlocks, directorySize)
+
+        streamCount, = struct.unpack_from('<I', directory, 0)
+        streamSizes = [0 if size == MSF_NIL_STREAM_SIZE else size for size in struct.unpack_from('<%dI' % streamCount, directory, 4)]
+
+        def readStream(index, size):
+            ''' reads the first size bytes of the given stream. Gives back None if it doesn't have that many. '''
+            if index >= streamCount or streamSizes[index] < size:
+                return None
+
+            offset = 4 + 4 * streamCount + 4 * sum(blocksFor(s) for s in streamSizes[:index])
+            blocks = struct.unpack_from('<%dI' % blocksFor(size), directory, offset)
+            return readBlocks(blocks, size)
+
+        # version, signature, age, GUID
+        infoStream = readStream(PDB_INFO_STREAM, 28)
+        if infoStream is None:
+            return None
+        age, = struct.unpack_from('<I', infoStream, 8)
+        guid = uuid.UUID(bytes_le=infoStream[12:28])
+
+        # version signature, version, age. The info stream's age goes up each time the PDB is written, this one is what executables have.
+        dbiStream = readStream(PDB_DBI_STREAM, 12)
+        if dbiStream is not None:
+            age, = struct.unpack_from('<I', dbiStream, 8)
+    except (struct.error, ValueError) as ex:
+        logger.warning("Could not read PDB: %s" % str(ex))
+        return None
+
+    return guid, age
+
+def getPdbId(f):
+    ''' gets the symbol store id of the PDB file open (in binary mode) as f: its GUID then age, in hex.
+    Returns None if it isn't an MSF 7.0 PDB. '''
+    guidAndAge = getPdbGuidAndAge(f)
+    if guidAndAge is None:
+        return None
+
+    guid, age = guidAndAge
+    return getPdbIdFromGuidAndAge(guid, age)
+
+def getPdbIdFromGuidAndAge(guid, age):
+    ''' gets the symbol store id for a PDB with the given GUID (a uuid.UUID) and age '''
+    return '%s%x' % (guid.hex.upper(), age)
+
+def getSymbolStoreId(path):
+    ''' gets the symbol store id for the file at the given path (a PDB or PE file). Returns None if it isn't one of those. '''
+    with open(path, 'rb') as f:
+        for getId in (getPdbId, getPeId):
+            fileId = getId(f)
+            if fileId is not None:
+                return fileId
+
+    return None
@@ -0,0 +1,37 @@
+''' this file contains tests for reading symbol store ids from Windows executables and symbols files (made up here, so no Windows tools are needed) '''
+
+import io
+import os
+
+from test_helpers import EXAMPLE_GUID, makePdb, makePe
+from utility import temporaryFilePath
+from windows_symbol_file import MSF_MAGIC, getPdbGuidAndAge, getPdbId, getPeId, getSymbolStoreId
+
+def test_get_pe_id():
+    ''' ensures the id for PE32 and PE32+ files is the TimeDateStamp then SizeOfImage '''
+    assert getPeId(io.BytesIO(makePe(0x5E9B1A2C, 0x2F000))) == '5E9B1A2C2f000'
+    assert getPeId(io.BytesIO(makePe(0xAB, 0x1000, pe32Plus=True))) == '000000AB1000'
+
+def test_get_pdb_id():
+    ''' ensures the id for a PDB is its GUID then the age from its DBI stream (or info stream if there isn't one) '''
+    assert getPdbGuidAndAge(io.BytesIO(makePdb(EXAMPLE_GUID, 5, dbiAge=3))) == (EXAMPLE_GUID, 3)
+    assert getPdbId(io.BytesIO(makePdb(EXAMPLE_GUID, 5, dbiAge=0x1a))) == '123456789ABCDEF011223344556677881a'
+    assert getPdbId(io.BytesIO(makePdb(EXAMPLE_GUID, 5, blockSize=4096))) == '123456789ABCDEF011223344556677885'
+
+def test_not_symbol_files():
+    ''' ensures files that aren't PE or PDB files (or are cut off) don't get an id '''
+    pe = makePe(1, 2)
+    pdb = makePdb(EXAMPLE_GUID, 1, dbiAge=1)
+    for data in (b'', b'abcdefghijklmnopqrstuvwxyz', b'MZ' + b'\0' * 100, pe[:150], pdb[:600], pdb[:len(MSF_MAGIC) + 10], os.urandom(4096)):
+        assert getPeId(io.BytesIO(data)) is None
+        assert getPdbId(io.BytesIO(data)) is None
+
+def test_get_symbol_store_id():
+    ''' ensures the id for a file on disk can be gotten, whichever kind it is '''
+    with temporaryFilePath() as path:
+        for data, expectedId in ((makePe(0x5E9B1A2C, 0x2F000), '5E9B1A2C2f000'),
+                                 (makePdb(EXAMPLE_GUID, 2), '123456789ABCDEF011223344556677882'),
+                                 (b'not a symbols file', None)):
+            with open(path, 'wb') as f:
+                f.write(data)
+            assert getSymbolStoreId(path) == expectedId
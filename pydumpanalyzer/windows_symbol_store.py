@@ -1,39 +1,209 @@
 ''' this is the file for the Windows Symbol Store class '''
 
+import argparse
+import datetime
 import os
-import subprocess
+import shutil
 
-from csmlog_setup import getLogger
+from cabinet import fitsInCabinet, getCabinetFileSize, writeCabinet
+from csmlog_setup import enableConsoleLogging, getLogger
+from symbol_store_index import SymbolStoreIndex
+from symbol_store_layout import INDEX2_FILE_NAME, NOT_ENTRIES, getEntryParts, getPrefix, isPrefixDirectoryName, isTwoTier
+from utility import getUniqueId, lockFile
+from windows_symbol_file import getSymbolStoreId
 
 logger = getLogger(__file__)
 
 class WindowsSymbolStore(object):
-    ''' implementation for the Windows symbol store. Contains an add() method to add an item to the symbol store '''
-    SYM_STORE = r"C:\Program Files (x86)\Windows Kits\10\Debuggers\x86\symstore.exe"
-    def __init__(self, path):
-        ''' Takes in the location to the symbol store. Uses SYM_STORE as the location to symstore.exe '''
-        if not os.path.isfile(self.SYM_STORE):
-            raise EnvironmentError("Can't find symstore: %s" % self.SYM_STORE)
+    ''' implementation for the Windows symbol store. Contains an add() method to add an item to the symbol store.
+    This writes the same layout symstore.exe does (without needing it): each file is kept as <name>/<id>/<name>, where the id comes
+    from the file's headers (see windows_symbol_file). Compressed files are cabinets named like the file with its last character as _.
+    If the store is two tier (see symbol_store_layout), files are kept under a prefix directory: <prefix>/<name>/<id>/<name>.
+    Each add is recorded as a transaction in the 000Admin directory, like symstore.exe does. Adds hold the lock in 000Admin.
+    Adds are passed on to this process's SymbolStoreIndex for the store (if there is one). '''
+    ADMIN_DIRECTORY_NAME = '000Admin'
+    LOCK_FILE_NAME = 'lock'
 
+    def __init__(self, path, twoTier=False):
+        ''' Takes in the location to the symbol store. It will be created on the first add (as two tier if twoTier is set).
+        An existing store keeps the layout it has (see migrateToTwoTier() to change it). '''
         self.path = path
+        self.twoTier = twoTier
+        self.adminPath = os.path.join(self.path, self.ADMIN_DIRECTORY_NAME)
+        self.lockPath = os.path.join(self.adminPath, self.LOCK_FILE_NAME)
+
+    @classmethod
+    def getCompressedFileName(cls, fileName):
+        ''' gets the name a compressed file is kept under in the store. Like: TheCrasher.pdb -> TheCrasher.pd_ '''
+        return fileName[:-1] + '_'
+
+    def contains(self, objPath, compressed=False):
+        ''' returns True if the given object is already in the symbol store (same name, id and size), so adding it would change nothing.
+        If compressed is set, an uncompressed copy in the store counts too. '''
+        fileId = getSymbolStoreId(objPath)
+        if fileId is None:
+            return False
+
+        fileName = os.path.basename(objPath)
+        entryPath = os.path.join(self.path, *getEntryParts(fileName, fileId, isTwoTier(self.path)))
+        size = os.path.getsize(objPath)
+        try:
+            if os.path.isfile(os.path.join(entryPath, fileName)):
+                return os.path.getsize(os.path.join(entryPath, fileName)) == size
+
+            compressedPath = os.path.join(entryPath, self.getCompressedFileName(fileName))
+            return compressed and os.path.isfile(compressedPath) and getCabinetFileSize(compressedPath) == size
+        except OSError:
+            # removed while we looked
+            return False
 
     def add(self, objPath, compressed=False):
-        ''' adds the given object to the symbol store. Optionally can choose to compress the file.
+        ''' adds the given object (a PE file like an exe or dll, or a PDB) to the symbol store. Optionally can choose to compress the file.
+        Returns True if it was added, False if it isn't a kind of file the symbol store keeps. A file too big for a cabinet is added
+        uncompressed.
         Warning: Do not use compression if this is the downstream-most store '''
-        args = [
-            self.SYM_STORE,
-            'add',
-            "/s",
-            self.path,
-            "/t",
-            os.path.splitext(objPath)[0],
-            "/f",
-            objPath,
-        ]
-
-        if compressed:
-            args.append('/compress')
-
-        logger.debug("calling: %s" % args)
-        output = subprocess.check_output(args)
-        logger.debug("output: %s" % output)
+        fileId = getSymbolStoreId(objPath)
+        if fileId is None:
+            logger.warning("Not adding to the symbol store since it isn't a PE or PDB file: %s" % objPath)
+            return False
+
+        if compressed and not fitsInCabinet(objPath):
+            logger.info("Adding uncompressed since it is too big for a cabinet: %s" % objPath)
+            compressed = False
+
+        fileName = os.path.basename(objPath)
+        storedFileName = self.getCompressedFileName(fileName) if compressed else fileName
+        otherFileName = fileName if compressed else self.getCompressedFileName(fileName)
+        self._createIfNeeded()
+
+        # the lock keeps the layout from changing under us (see migrateToTwoTier())
+        with lockFile(self.lockPath):
+            entryParts = getEntryParts(fileName, fileId, isTwoTier(self.path))
+            entryPath = os.path.join(self.path, *entryParts)
+            os.makedirs(entryPath, exist_ok=True)
+
+            # write to a temp file then move into place, so a partially written file is never served
+            tempPath = os.path.join(entryPath, '%s.%s.tmp' % (storedFileName, getUniqueId()))
+            try:
+                if compressed:
+                    with open(tempPath, 'wb') as f:
+                        writeCabinet(objPath, f, fileName)
+                else:
+                    shutil.copyfile(objPath, tempPath)
+                os.replace(tempPath, os.path.join(entryPath, storedFileName))
+            except:
+                if os.path.isfile(tempPath):
+                    os.remove(tempPath)
+                raise
+
+            # don't keep both a compressed and uncompressed copy
+            otherPath = os.path.join(entryPath, otherFileName)
+            if os.path.isfile(otherPath):
+                os.remove(otherPath)
+
+            SymbolStoreIndex.recordAdd(self.path, '/'.join(entryParts + [storedFileName]), '/'.join(entryParts + [otherFileName]))
+            self._recordTransaction(objPath, fileName, fileId)
+
+        logger.debug("Added to the symbol store: %s" % os.path.join(entryPath, storedFileName))
+        return True
+
+    def _createIfNeeded(self):
+        ''' creates the store (and its 000Admin directory) if it doesn't exist yet. A new store is two tier if twoTier is set. '''
+        if os.path.isdir(self.adminPath):
+            return
+
+        isNew = not os.path.isdir(self.path)
+        os.makedirs(self.adminPath, exist_ok=True)
+        if isNew and self.twoTier:
+            open(os.path.join(self.path, INDEX2_FILE_NAME), 'a').close()
+
+    def _recordTransaction(self, objPath, fileName, fileId):
+        ''' records an add of the given file in 000Admin, like symstore.exe does:
+            lastid.txt has the last transaction id, server.txt and history.txt get a line for the transaction,
+            and a file named after the transaction id lists what it added.
+        The lock must be held. Returns the transaction id. '''
+        lastIdPath = os.path.join(self.adminPath, 'lastid.txt')
+        transactionId = 1
+        if os.path.isfile(lastIdPath):
+            with open(lastIdPath, 'r') as f:
+                transactionId = int(f.read().strip() or 0) + 1
+
+        now = datetime.datetime.now()
+        transaction = '%010d,add,file,%s,%s,"%s","","",\n' % (transactionId, now.strftime('%m/%d/%Y'), now.strftime('%H:%M:%S'),
+                                                              os.path.splitext(fileName)[0])
+
+        with open(os.path.join(self.adminPath, '%010d' % transactionId), 'w') as f:
+            f.write('"%s\\%s","%s"\n' % (fileName, fileId, objPath))
+
+        for transactionsFileName in ('server.txt', 'history.txt'):
+            with open(os.path.join(self.adminPath, transactionsFileName), 'a') as f:
+                f.write(transaction)
+
+        with open(lastIdPath, 'w') as f:
+            f.write('%010d' % transactionId)
+
+        # symstore.exe makes this so clients can check that the store is reachable
+        pingPath = os.path.join(self.path, 'pingme.txt')
+        if not os.path.isfile(pingPath):
+            open(pingPath, 'w').close()
+
+        return transactionId
+
+    def migrateToTwoTier(self):
+        ''' converts the store to the two tier layout (see symbol_store_layout) while it is in use.
+        index2.txt is written first, so adds from then on go to the two tier layout. Then each <name> directory is moved under its prefix
+        directory (holding the lock, so it doesn't move during an add). The symbol server finds files in either layout, so there is
+        no downtime. Can be run again (like if stopped partway). Returns the number of entries (<name>/<id> directories) moved. '''
+        self._createIfNeeded()
+        with lockFile(self.lockPath):
+            open(os.path.join(self.path, INDEX2_FILE_NAME), 'a').close()
+
+        moved = 0
+        for nameEntry in list(os.scandir(self.path)):
+            if nameEntry.name in NOT_ENTRIES or not nameEntry.is_dir() or isPrefixDirectoryName(nameEntry.name):
+                continue
+
+            with lockFile(self.lockPath):
+                moved += self._moveToTwoTier(nameEntry.name)
+
+        logger.info("Migrated %d entries to two tier in the symbol store: %s" % (moved, self.path))
+        return moved
+
+    def _moveToTwoTier(self, fileName):
+        ''' moves the given <name> directory under its prefix directory, merging it with what is already there (from adds after the
+        store became two tier). The lock must be held. Returns the number of entries moved. '''
+        fromPath = os.path.join(self.path, fileName)
+        toPath = os.path.join(self.path, getPrefix(fileName), fileName)
+        fileIds = os.listdir(fromPath)
+        if not os.path.isdir(toPath):
+            os.makedirs(os.path.dirname(toPath), exist_ok=True)
+            os.rename(fromPath, toPath)
+            return len(fileIds)
+
+        for fileId in fileIds:
+            fromIdPath = os.path.join(fromPath, fileId)
+            toIdPath = os.path.join(toPath, fileId)
+            if not os.path.isdir(toIdPath):
+                os.rename(fromIdPath, toIdPath)
+                continue
+
+            # the copy already in the two tier layout is newer, only keep files from here it doesn't have (in either compression)
+            for storedFileName in os.listdir(fromIdPath):
+                fromFilePath = os.path.join(fromIdPath, storedFileName)
+                if any(name[:-1] == storedFileName[:-1] for name in os.listdir(toIdPath)):
+                    os.remove(fromFilePath)
+                else:
+                    os.replace(fromFilePath, os.path.join(toIdPath, storedFileName))
+            os.rmdir(fromIdPath)
+
+        os.rmdir(fromPath)
+        return len(fileIds)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Converts a (single tier) Windows symbol store to the two tier layout. '
+                                                 'The store can be in use (like by PDA) while this runs.')
+    parser.add_argument('path', help='path to the symbol store')
+    args = parser.parse_args()
+
+    enableConsoleLogging()
+    WindowsSymbolStore(args.path).migrateToTwoTier()
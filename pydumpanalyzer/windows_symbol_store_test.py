@@ -1,31 +1,174 @@
 ''' this file contains tests for the Windows Symbol Store '''
 
-import subprocess
-import sys
+import os
+import shutil
+import tempfile
 import unittest
+import unittest.mock
 
-import pytest
+import flask
 
+import cabinet
+from symbol_server import SymbolServer
+from symbol_store_index import SymbolStoreIndex
+from test_helpers import EXAMPLE_GUID, makePdb, makePe, readCabinet
 from windows_symbol_store import WindowsSymbolStore
 
-class _TestWindowsSymbolStore(WindowsSymbolStore):
-    ''' special class with a mocked SYM_STORE '''
-    SYM_STORE = __file__
-
 class TestWindowsSymbolStore(unittest.TestCase):
     ''' test class for WindowsSymbolStore '''
     def setUp(self):
-        ''' makes a symbol store in self.symbolStore '''
-        self.symbolStore = _TestWindowsSymbolStore(__file__)
+        ''' makes a symbol store in self.symbolStore (and a place for files to add in self.filesPath) '''
+        self.tempPath = tempfile.mkdtemp()
+        self.filesPath = os.path.join(self.tempPath, 'files')
+        os.mkdir(self.filesPath)
+        self.symbolStore = WindowsSymbolStore(os.path.join(self.tempPath, 'store'))
+
+    def tearDown(self):
+        ''' cleans up after each test '''
+        shutil.rmtree(self.tempPath)
+
+    def _makeFile(self, fileName, data):
+        ''' makes a file with the given name and data to add, giving back its path '''
+        path = os.path.join(self.filesPath, fileName)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def _readStoreFile(self, *parts):
+        ''' reads the given file from the store '''
+        with open(os.path.join(self.symbolStore.path, *parts), 'rb') as f:
+            return f.read()
 
     def test_add(self):
-        ''' tests the add() method '''
+        ''' tests the add() method puts files in the symbol store layout '''
+        pe = makePe(0x5E9B1A2C, 0x2F000)
+        assert self.symbolStore.add(self._makeFile('TheCrasher.exe', pe), compressed=False)
+        assert self._readStoreFile('TheCrasher.exe', '5E9B1A2C2f000', 'TheCrasher.exe') == pe
+
+        pdb = makePdb(EXAMPLE_GUID, 5, dbiAge=1)
+        assert self.symbolStore.add(self._makeFile('TheCrasher.pdb', pdb), compressed=True)
+        assert readCabinet(self._readStoreFile('TheCrasher.pdb', '123456789ABCDEF011223344556677881', 'TheCrasher.pd_')) == ('TheCrasher.pdb', pdb)
+        assert os.listdir(os.path.join(self.symbolStore.path, 'TheCrasher.pdb', '123456789ABCDEF011223344556677881')) == ['TheCrasher.pd_']
+
+        # adding it again uncompressed replaces the compressed one
+        assert self.symbolStore.add(os.path.join(self.filesPath, 'TheCrasher.pdb'), compressed=False)
+        assert os.listdir(os.path.join(self.symbolStore.path, 'TheCrasher.pdb', '123456789ABCDEF011223344556677881')) == ['TheCrasher.pdb']
+
+    def test_add_too_big_for_cabinet(self):
+        ''' ensures a file too big for a cabinet is added uncompressed (instead of failing) '''
+        pe = makePe(0x5E9B1A2C, 0x2F000) + b'\0' * (2 * cabinet.CAB_BLOCK_SIZE)
+        pePath = self._makeFile('TheCrasher.exe', pe)
+        with unittest.mock.patch.object(cabinet, 'CAB_MAX_BLOCKS', 2):
+            assert self.symbolStore.add(pePath, compressed=True)
+            assert os.listdir(os.path.join(self.symbolStore.path, 'TheCrasher.exe', '5E9B1A2C2f000')) == ['TheCrasher.exe']
+            assert self._readStoreFile('TheCrasher.exe', '5E9B1A2C2f000', 'TheCrasher.exe') == pe
+            assert self.symbolStore.contains(pePath, compressed=True)
+
+            with open(pePath, 'r+b') as f:
+                f.truncate(2 * cabinet.CAB_BLOCK_SIZE)
+            assert self.symbolStore.add(pePath, compressed=True)
+            assert os.listdir(os.path.join(self.symbolStore.path, 'TheCrasher.exe', '5E9B1A2C2f000')) == ['TheCrasher.ex_']
+
+    def test_add_updates_index(self):
+        ''' ensures adds show up in the store's index (and a replaced compressed copy goes away) '''
+        index = SymbolStoreIndex.getIndex(self.symbolStore.path)
+        pdbPath = self._makeFile('TheCrasher.pdb', makePdb(EXAMPLE_GUID, 1))
+        assert index.getFilePath('TheCrasher.pdb/123456789ABCDEF011223344556677881/TheCrasher.pdb') is None
+
+        assert self.symbolStore.add(pdbPath, compressed=True)
+        assert index.getFilePath('TheCrasher.pdb/123456789ABCDEF011223344556677881/TheCrasher.pd_') is not None
+
+        assert self.symbolStore.add(pdbPath, compressed=False)
+        assert index.getFilePath('TheCrasher.pdb/123456789ABCDEF011223344556677881/TheCrasher.pdb') is not None
+        assert index.getStatistics()['SymbolIndexEntries'] == 1
+
+    def test_add_two_tier(self):
+        ''' ensures a two tier store keeps files under prefix directories '''
+        self.symbolStore = WindowsSymbolStore(os.path.join(self.tempPath, 'store'), twoTier=True)
+        pe = makePe(0x5E9B1A2C, 0x2F000)
+        assert self.symbolStore.add(self._makeFile('TheCrasher.exe', pe))
+        assert self._readStoreFile('th', 'TheCrasher.exe', '5E9B1A2C2f000', 'TheCrasher.exe') == pe
+        assert os.path.isfile(os.path.join(self.symbolStore.path, 'index2.txt'))
+
+        # an existing store keeps its layout
+        flatStore = WindowsSymbolStore(os.path.join(self.tempPath, 'flat'))
+        assert flatStore.add(self._makeFile('TheCrasher.exe', pe))
+        assert WindowsSymbolStore(flatStore.path, twoTier=True).add(self._makeFile('TheCrasher.pdb', makePdb(EXAMPLE_GUID, 1)))
+        assert sorted(os.listdir(flatStore.path)) == ['000Admin', 'TheCrasher.exe', 'TheCrasher.pdb', 'pingme.txt']
+
+    def test_migrate_to_two_tier(self):
+        ''' ensures a single tier store can be migrated to two tier, with its files served the whole time '''
+        pePath = self._makeFile('TheCrasher.exe', makePe(0x5E9B1A2C, 0x2F000))
+        pdbPath = self._makeFile('TheCrasher.pdb', makePdb(EXAMPLE_GUID, 1))
+        assert self.symbolStore.add(pePath)
+        assert self.symbolStore.add(pdbPath, compressed=True)
+
+        symbolServer = SymbolServer(self.symbolStore.path)
+        app = flask.Flask(__name__)
+        app.add_url_rule('/symbols/<path:path>', 'symbols', lambda path: symbolServer.sendFile(path))
+        client = app.test_client()
+        pdbUrl = '/symbols/TheCrasher.pdb/123456789ABCDEF011223344556677881/TheCrasher.pd_'
+        assert client.get(pdbUrl).status_code == 200
+
+        # an add to the same entry after the store went two tier (but before the entry was moved) wins
+        open(os.path.join(self.symbolStore.path, 'index2.txt'), 'w').close()
+        assert self.symbolStore.add(pdbPath, compressed=False)
+        assert self.symbolStore.migrateToTwoTier() == 2
+
+        assert sorted(os.listdir(self.symbolStore.path)) == ['000Admin', 'index2.txt', 'pingme.txt', 'th']
+        assert sorted(os.listdir(os.path.join(self.symbolStore.path, 'th'))) == ['TheCrasher.exe', 'TheCrasher.pdb']
+        assert os.listdir(os.path.join(self.symbolStore.path, 'th', 'TheCrasher.pdb', '123456789ABCDEF011223344556677881')) == ['TheCrasher.pdb']
+
+        # the server finds the moved files (by either layout's path)
+        assert client.get('/symbols/TheCrasher.exe/5E9B1A2C2f000/TheCrasher.exe').status_code == 200
+        assert client.get('/symbols/th/TheCrasher.exe/5E9B1A2C2f000/TheCrasher.exe').status_code == 200
+        assert client.get(pdbUrl).status_code == 404
+        assert client.get(pdbUrl[:-1] + 'b').status_code == 200
+
+        # adds go to the two tier layout, and migrating again does nothing
+        assert self.symbolStore.add(self._makeFile('Other.dll', makePe(0xAB, 0x1000)))
+        assert os.path.isdir(os.path.join(self.symbolStore.path, 'ot', 'Other.dll'))
+        assert self.symbolStore.migrateToTwoTier() == 0
+
+    def test_contains(self):
+        ''' ensures files already in the store (by name, id and size) can be found '''
+        pdbPath = self._makeFile('TheCrasher.pdb', makePdb(EXAMPLE_GUID, 1))
+        assert not self.symbolStore.contains(pdbPath, compressed=True)
+
+        assert self.symbolStore.add(pdbPath, compressed=True)
+        assert self.symbolStore.contains(pdbPath, compressed=True)
+        assert not self.symbolStore.contains(pdbPath, compressed=False)
+
+        assert self.symbolStore.add(pdbPath, compressed=False)
+        assert self.symbolStore.contains(pdbPath, compressed=True)
+        assert self.symbolStore.contains(pdbPath, compressed=False)
+
+        # same id, different contents
+        with open(pdbPath, 'ab') as f:
+            f.write(b'more')
+        assert not self.symbolStore.contains(pdbPath, compressed=True)
+        assert not self.symbolStore.contains(self._makeFile('notes.txt', b'abcdefghijklmnopqrstuvwxyz'))
+
+    def test_add_ignores_other_files(self):
+        ''' ensures files that aren't executables or symbols aren't added '''
+        assert not self.symbolStore.add(self._makeFile('notes.txt', b'abcdefghijklmnopqrstuvwxyz'), compressed=True)
+        assert not os.path.exists(self.symbolStore.path)
+
+    def test_add_records_transactions(self):
+        ''' ensures each add is recorded in 000Admin like symstore.exe does '''
+        pePath = self._makeFile('TheCrasher.dll', makePe(0xAB, 0x1000, pe32Plus=True))
+        pdbPath = self._makeFile('TheCrasher.pdb', makePdb(EXAMPLE_GUID, 2))
+        assert self.symbolStore.add(pePath)
+        assert self.symbolStore.add(pdbPath, compressed=True)
 
-        # .add() should raise since SYM_STORE isn't an exe (and it won't give an exit code of 0)
-        # OSError if we can't execute a py file (Windows)
-        # Otherwise CalledProcessError for non-zero exit code
-        with pytest.raises((subprocess.CalledProcessError, OSError)):
-            self.symbolStore.add(__file__, compressed=True)
+        assert self._readStoreFile('000Admin', 'lastid.txt') == b'0000000002'
+        history = self._readStoreFile('000Admin', 'history.txt').decode().splitlines()
+        assert self._readStoreFile('000Admin', 'server.txt').decode().splitlines() == history
+        assert len(history) == 2
+        assert history[0].startswith('0000000001,add,file,')
+        assert history[1].startswith('0000000002,add,file,')
+        assert '"TheCrasher",' in history[1]
 
-        with pytest.raises((subprocess.CalledProcessError, OSError)):
-            self.symbolStore.add(__file__, compressed=False)
+        assert self._readStoreFile('000Admin', '0000000001').decode() == '"TheCrasher.dll\\000000AB1000","%s"\n' % pePath
+        assert self._readStoreFile('000Admin', '0000000002').decode() == '"TheCrasher.pdb\\123456789ABCDEF011223344556677882","%s"\n' % pdbPath
+        assert os.path.isfile(os.path.join(self.symbolStore.path, 'pingme.txt'))